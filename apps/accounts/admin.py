@@ -3,10 +3,11 @@ from django.contrib.auth.models import User
 from django.contrib.auth import get_user_model
 from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth.forms import UserCreationForm, UserChangeForm, ReadOnlyPasswordHashField
-from models import Permission, flangioUser
+from models import Permission, flangioUser, APIToken
 from django.utils.translation import ugettext_lazy as _
 from models import flangioUser
 admin.site.register(Permission)
+admin.site.register(APIToken)
 
 
 
@@ -15,7 +15,9 @@ from django.core.urlresolvers import reverse
 from django.http import HttpResponse, HttpResponseRedirect
 from django.conf import settings
 from django.contrib.auth import authenticate, login
+from django.middleware.csrf import CsrfViewMiddleware
 from utils import authorize, unauthorized_json_response, user_permissions
+from tokens import verify_token
 
 
 def json_login_required(func):
@@ -26,11 +28,20 @@ def json_login_required(func):
     
     def wrapper(request, *args, **kwargs):
         user= None
-        #get the Basic username and password from the request.
+        #get the Basic username and password, or the API token, from the request.
         auth_string = request.META.get('HTTP_AUTHORIZATION', None)
         
         if auth_string:
             (authmeth, auth) = auth_string.split(" ", 1)
+            if authmeth.lower() == 'bearer':
+                #no password hashing and no session (see tokens.py)
+                user = verify_token(auth.strip())
+                if not user:
+                    return HttpResponse(unauthorized_json_response(), status=401,
+                            mimetype="application/json")
+                request.user = user
+                return func(request, *args, **kwargs)
+
             auth = auth.strip().decode('base64')
             (username, password) = auth.split(':', 1)
 
@@ -47,6 +58,32 @@ def json_login_required(func):
     return update_wrapper(wrapper, func)
 
 
+def json_password_required(func):
+    """
+        Like json_login_required, but an API token is not enough: the user
+        must send their password (Basic) or be logged in, in which case the
+        request must pass the CSRF check. For views that issue credentials.
+    """
+
+    def wrapper(request, *args, **kwargs):
+        auth_string = request.META.get('HTTP_AUTHORIZATION', None)
+        if auth_string:
+            if auth_string.split(" ", 1)[0].lower() == 'bearer':
+                return HttpResponse(unauthorized_json_response("Send your password, not an API token."),
+                                    status=401, mimetype="application/json")
+            return json_login_required(func)(request, *args, **kwargs)
+
+        if not request.user.is_authenticated() or not request.user.is_active:
+            return HttpResponse(unauthorized_json_response(), status=401,
+                    mimetype="application/json")
+        refused = CsrfViewMiddleware().process_view(request, None, (), {})
+        if refused:
+            return refused
+        return func(request, *args, **kwargs)
+
+    return update_wrapper(wrapper, func)
+
+
 def access_required(permission):
     def decorator(func):
         def inner_decorator(request, *args, **kwargs):
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim: ai ts=4 sts=4 et sw=4
+
+"""
+    Resolve user identifiers.
+
+    A user may be named by username, email, vid or anonymous patient id. All
+    four are matched in one query. When an identifier matches more than one
+    user, the field earlier in IDENTIFIER_FIELDS wins.
+
+    Resolved identifiers are kept, as user ids, in an LRU of
+    IDENTITY_CACHE_SIZE entries for IDENTITY_CACHE_TTL seconds. The entries
+    for a user are dropped when it is saved or deleted in this process (see
+    models.py); other processes see the change once theirs expire.
+    Identifiers that match no one are not cached.
+"""
+
+import operator
+from django.conf import settings
+from django.db.models import Q
+from ..mongodb.cache import LRUCache
+
+
+IDENTIFIER_FIELDS = ('username', 'email', 'vid', 'anonymous_patient_id')
+
+#Identifiers per query, so the parameters fit the database's limit.
+BATCH_SIZE = 200
+
+_ids = LRUCache(settings.IDENTITY_CACHE_SIZE)
+
+
+def _user_model():
+    from models import flangioUser
+    return flangioUser
+
+
+def _query(identifiers):
+    """Return {identifier: user id} for those identifiers that match."""
+    wanted = set(identifiers)
+    q = reduce(operator.or_, [Q(**{"%s__in" % (f): identifiers}) for f in IDENTIFIER_FIELDS])
+    best = {}
+    for row in _user_model().objects.filter(q).values_list('pk', *IDENTIFIER_FIELDS):
+        for rank, value in enumerate(row[1:]):
+            if value in wanted:
+                match = (rank, row[0])
+                if best.get(value, match) >= match:
+                    best[value] = match
+    return dict((i, match[1]) for i, match in best.items())
+
+
+def resolve_identifiers(identifiers):
+    """Return {identifier: user id} for every identifier that names a user.
+    Those not cached are resolved together, BATCH_SIZE to a query."""
+    resolved = {}
+    missing = []
+    for i in set(identifiers):
+        if not i:
+            continue
+        user_id = _ids.get(i)
+        if user_id is None:
+            missing.append(i)
+        else:
+            resolved[i] = user_id
+    for start in range(0, len(missing), BATCH_SIZE):
+        for i, user_id in _query(missing[start:start + BATCH_SIZE]).items():
+            _ids.set(i, user_id, settings.IDENTITY_CACHE_TTL)
+            resolved[i] = user_id
+    return resolved
+
+
+def resolve_identifier(identifier):
+    """Return the id of the user identifier names, or None."""
+    return resolve_identifiers([identifier]).get(identifier)
+
+
+def resolve_users(identifiers):
+    """Return {identifier: user} for every identifier that names a user."""
+    ids = resolve_identifiers(identifiers)
+    users = _user_model().objects.in_bulk(set(ids.values()))
+    return dict((i, users[user_id]) for i, user_id in ids.items() if user_id in users)
+
+
+def resolve_user(identifier):
+    """Return the user identifier names, or None."""
+    return resolve_users([identifier]).get(identifier)
+
+
+def user_changed(sender, instance, **kwargs):
+    _ids.delete_values(instance.pk)
+    #its identifiers may now name it rather than someone else
+    for f in IDENTIFIER_FIELDS:
+        _ids.delete(getattr(instance, f))
@@ -11,6 +11,8 @@ from django.contrib.auth.models import (BaseUserManager, AbstractBaseUser,
 from django.core.mail import send_mail
 from django.core import validators
 from django.utils import timezone
+from identity import user_changed
+from tokens import token_changed
 
 
 
@@ -233,6 +235,23 @@ class Permission(models.Model):
         unique_together = (("user", "permission_name"),)
 
 
-        
+class APIToken(models.Model):
+    """A bearer token for the API (see tokens.py). Only a hash of its
+    secret is stored."""
+    user = models.ForeignKey(flangioUser, related_name="api_tokens")
+    name = models.CharField(max_length=100, blank=True, default="")
+    secret_hash = models.CharField(max_length=64)
+    is_active = models.BooleanField(default=True,
+                help_text="Uncheck to revoke the token.")
+    created_on = models.DateTimeField(default=timezone.now)
+
+    def __unicode__(self):
+        return '%s API token %s (%s)' % (self.user.email, self.pk, self.name)
 
 
+#drop the user's cached identifiers (identity.py)
+post_save.connect(user_changed, sender=flangioUser)
+post_delete.connect(user_changed, sender=flangioUser)
+#forget the token's cached verification (tokens.py)
+post_save.connect(token_changed, sender=APIToken)
+post_delete.connect(token_changed, sender=APIToken)
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim: ai ts=4 sts=4 et sw=4
+
+import base64, json
+from django.test import TestCase
+from django.test.client import Client
+from models import flangioUser, APIToken
+from tokens import issue_token, verify_token
+from identity import resolve_identifiers, resolve_identifier, resolve_user, BATCH_SIZE
+import identity
+
+
+class APITokenTest(TestCase):
+
+    def setUp(self):
+        self.user = flangioUser.objects.create_user("alice", "alice@example.com", "pw")
+        self.api_token, self.token = issue_token(self.user, "tests")
+
+    def test_valid_token(self):
+        self.assertEqual(verify_token(self.token), self.user)
+        #and again from the cache
+        self.assertEqual(verify_token(self.token), self.user)
+
+    def test_wrong_secret(self):
+        self.assertEqual(verify_token("%s.%s" % (self.api_token.pk, "0" * 40)), None)
+        self.assertEqual(verify_token(self.token.split(".")[1]), None)
+        self.assertEqual(verify_token(""), None)
+
+    def test_revoked_token(self):
+        verify_token(self.token)
+        self.api_token.is_active = False
+        self.api_token.save()
+        self.assertEqual(verify_token(self.token), None)
+
+    def test_deleted_token(self):
+        verify_token(self.token)
+        self.api_token.delete()
+        self.assertEqual(verify_token(self.token), None)
+
+    def test_inactive_user(self):
+        verify_token(self.token)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(verify_token(self.token), None)
+
+
+class APITokenViewTest(TestCase):
+
+    def setUp(self):
+        self.user = flangioUser.objects.create_user("alice", "alice@example.com", "pw")
+        self.basic = "Basic " + base64.b64encode("alice:pw")
+
+    def create(self, client=None, **extra):
+        client = client or Client()
+        return client.post("/accounts/api/token/create", {"name": "tests"}, **extra)
+
+    def test_create_with_password(self):
+        response = self.create(HTTP_AUTHORIZATION=self.basic)
+        self.assertEqual(response.status_code, 200)
+        token = json.loads(response.content)["token"]
+        self.assertEqual(verify_token(token), self.user)
+
+    def test_create_with_session(self):
+        client = Client()
+        client.login(username="alice", password="pw")
+        self.assertEqual(self.create(client).status_code, 200)
+
+    def test_session_needs_the_csrf_token(self):
+        client = Client(enforce_csrf_checks=True)
+        client.login(username="alice", password="pw")
+        self.assertEqual(self.create(client).status_code, 403)
+        self.assertEqual(APIToken.objects.count(), 0)
+
+    def test_a_token_cannot_create_tokens(self):
+        api_token, token = issue_token(self.user)
+        response = self.create(HTTP_AUTHORIZATION="Bearer " + token)
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(APIToken.objects.count(), 1)
+
+    def test_anonymous(self):
+        self.assertEqual(self.create().status_code, 401)
+
+    def test_a_token_signs_in_and_revokes(self):
+        api_token, token = issue_token(self.user)
+        response = Client().post("/accounts/api/token/revoke", {"id": api_token.pk},
+                                 HTTP_AUTHORIZATION="Bearer " + token)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(verify_token(token), None)
+        response = Client().post("/accounts/api/token/revoke", {"id": api_token.pk},
+                                 HTTP_AUTHORIZATION="Bearer " + token)
+        self.assertEqual(response.status_code, 401)
+
+
+class ResolveIdentifiersTest(TestCase):
+
+    def setUp(self):
+        #rolled back users send no signals, so start each test afresh
+        identity._ids.clear()
+        self.alice = flangioUser.objects.create_user("alice", "alice@example.com", "pw",
+                                                     vid="123456789012345")
+        self.bob = flangioUser.objects.create_user("bob", "bob@example.com", "pw",
+                                                   anonymous_patient_id="anon-bob")
+
+    def test_every_field(self):
+        self.assertEqual(resolve_identifiers(["alice", "alice@example.com",
+                                              "123456789012345", "anon-bob", "nobody", ""]),
+                         {"alice": self.alice.pk, "alice@example.com": self.alice.pk,
+                          "123456789012345": self.alice.pk, "anon-bob": self.bob.pk})
+        self.assertEqual(resolve_user("bob@example.com"), self.bob)
+        self.assertEqual(resolve_identifier("nobody"), None)
+
+    def test_username_wins_over_email(self):
+        carol = flangioUser.objects.create_user("bob@example.com", "carol@example.com", "pw")
+        self.assertEqual(resolve_identifier("bob@example.com"), carol.pk)
+
+    def test_one_query_then_cached(self):
+        with self.assertNumQueries(1):
+            resolve_identifiers(["alice", "bob", "nobody"])
+        with self.assertNumQueries(0):
+            self.assertEqual(resolve_identifiers(["alice", "bob"]),
+                             {"alice": self.alice.pk, "bob": self.bob.pk})
+
+    def test_batches(self):
+        names = ["missing%s" % (i) for i in range(BATCH_SIZE)] + ["alice"]
+        with self.assertNumQueries(2):
+            self.assertEqual(resolve_identifiers(names), {"alice": self.alice.pk})
+
+    def test_email_change_drops_the_cached_identifier(self):
+        self.assertEqual(resolve_identifier("alice@example.com"), self.alice.pk)
+        self.alice.email = "alice@example.org"
+        self.alice.save()
+        self.assertEqual(resolve_identifier("alice@example.com"), None)
+        self.assertEqual(resolve_identifier("alice@example.org"), self.alice.pk)
+
+    def test_identifier_moving_to_another_user(self):
+        self.assertEqual(resolve_identifier("bob@example.com"), self.bob.pk)
+        self.bob.email = "robert@example.com"
+        self.bob.save()
+        self.alice.email = "bob@example.com"
+        self.alice.save()
+        self.assertEqual(resolve_identifier("bob@example.com"), self.alice.pk)
+
+    def test_deleted_user(self):
+        self.assertEqual(resolve_identifier("bob"), self.bob.pk)
+        self.bob.delete()
+        self.assertEqual(resolve_identifier("bob"), None)
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim: ai ts=4 sts=4 et sw=4
+
+"""
+    API tokens.
+
+    A token is "<APIToken id>.<secret>". The secret is 160 random bits, so
+    its SHA-256 is stored rather than a slow password hash, and checking it
+    costs one row lookup by id and a constant-time comparison of hashes.
+    Clients send it as "Authorization: Bearer <token>" (see
+    decorators.json_login_required).
+
+    A token that checks out is remembered, by its hash, for
+    API_TOKEN_CACHE_TTL seconds. Revoking (unchecking is_active) or deleting
+    it advances the "flangio-gen:apitokens" generation (see
+    apps/mongodb/cache.py), which is part of the cache key. With a shared
+    SEARCH_CACHE_BACKEND that reaches every worker at once; otherwise other
+    processes stop accepting the token within API_TOKEN_CACHE_TTL seconds.
+"""
+
+import os, binascii, hashlib
+from django.conf import settings
+from django.utils.crypto import constant_time_compare
+from ..mongodb.cache import LRUCache, named_generation, bump_named_generation
+
+
+GENERATION_NAME = "flangio-gen:apitokens"
+
+_verified = LRUCache(settings.API_TOKEN_CACHE_SIZE)
+
+
+def _hash(secret):
+    return hashlib.sha256(secret).hexdigest()
+
+
+def issue_token(user, name=""):
+    """Create an API token for user. Return (the APIToken, the token); the
+    token itself is not stored and can't be shown again."""
+    from models import APIToken
+    secret = binascii.hexlify(os.urandom(20))
+    api_token = APIToken.objects.create(user=user, name=name, secret_hash=_hash(secret))
+    return api_token, "%s.%s" % (api_token.pk, secret)
+
+
+def verify_token(token):
+    """Return the active user a token belongs to, or None."""
+    from models import APIToken, flangioUser
+    if isinstance(token, unicode):
+        token = token.encode('utf-8')
+    token_id, sep, secret = token.partition('.')
+    if not sep or not token_id.isdigit() or not secret:
+        return None
+    key = "%s:%s" % (named_generation(GENERATION_NAME), _hash(token))
+    user_id = _verified.get(key)
+    if user_id is None:
+        try:
+            api_token = APIToken.objects.get(pk=int(token_id), is_active=True)
+        except APIToken.DoesNotExist:
+            return None
+        if not constant_time_compare(api_token.secret_hash, _hash(secret)):
+            return None
+        user_id = api_token.user_id
+        _verified.set(key, user_id, settings.API_TOKEN_CACHE_TTL)
+    try:
+        user = flangioUser.objects.get(pk=user_id)
+    except flangioUser.DoesNotExist:
+        return None
+    if not user.is_active:
+        return None
+    return user
+
+
+def token_changed(sender, instance, created=False, **kwargs):
+    if not created:
+        bump_named_generation(GENERATION_NAME)
@@ -15,6 +15,8 @@ urlpatterns = patterns('',
     #API Calls (these return JSON). ------------------------------------------
     url(r'api/test-credentials',  api_test_credentials,
             name='api-test-credentials'),
+    url(r'api/token/create',  api_token_create,  name='api_token_create'),
+    url(r'api/token/revoke',  api_token_revoke,  name='api_token_revoke'),
     url(r'api/user/create',  csrf_exempt(json_login_required(api_user_create)),
         name='api_user_create'),
     url(r'api/user/update', api_user_update,  name='api_user_update'), 
@@ -3,10 +3,13 @@
 # vim: ai ts=4 sts=4 et sw=4
 
 import json, string, random
+from django.conf import settings
 from django.contrib.auth import login, authenticate
 from httpauth import HttpBasicAuthentication
 from django.http import HttpResponse
 from models import Permission
+from ..socialgraph.index import shares
+from identity import resolve_users
 from datetime import date
 
 def random_string(length=6, alphabet=string.letters+string.digits):
@@ -59,52 +62,23 @@ def unauthorized_json_response(additional_info=None):
 def verify_users_exist_and_sg(data):
     """
     Scan supplied user id's for exist valitity. All must exists.
-    Compare ids against username, email, and anonymous_patient_id
-    in that order.
+    Each may be a username, email, vid or anonymous_patient_id; they are
+    resolved together (see accounts/identity.py).
     """
 
     data['errors']=[]
-    try:
-        receiver=User.objects.get(username=data['receiver'])
-    except User.DoesNotExist:
-        try:
-            receiver=User.objects.get(email=data['receiver'])
-        except User.DoesNotExist:
-            try:
-                receiver=User.objects.get(anonymous_patient_id=data['receiver'])
-            except UserProfile.DoesNotExist:
-                msg ="Receiver %s not found." %(data['receiver'])
-                data['errors'].append({'field':'receiver','description':msg})
-
-    try:
-        sender=User.objects.get(username=data['sender'])
-    except User.DoesNotExist:
-        try:
-            sender=User.objects.get(email=data['sender'])
-        except User.DoesNotExist:
-            try:
-                sender=User.objects.get(anonymous_patient_id=data['sender'])
-            except UserProfile.DoesNotExist:
-                msg ="Sender %s not found." %(data['sender'])
-                data['errors'].append({'field':'sender','description': msg})
-
-    try:
-        subject=User.objects.get(username=data['subject'])
-    except User.DoesNotExist:
-        try:
-            subject=User.objects.get(email=data['subject'])
-        except User.DoesNotExist:
-            try:
-                up = User.objects.get(anonymous_patient_id=data['subject'])
-                subject = up.user
-            except User.DoesNotExist:
-                msg ="Subject %s not found." %(data['subject'])
-                data['errors'].append({'field':'subject', 'description': msg })
-
-    social_graph_errors = verify_social_graph(sender, receiver, subject)
+    users = resolve_users([data['receiver'], data['sender'], data['subject']])
+    for field in ('receiver', 'sender', 'subject'):
+        if not users.has_key(data[field]):
+            msg ="%s %s not found." %(field.capitalize(), data[field])
+            data['errors'].append({'field':field, 'description':msg})
 
-    if social_graph_errors:
-        data['errors'].append(social_graph_errors)
+    if not data['errors']:
+        social_graph_errors = verify_social_graph(users[data['sender']],
+                                                  users[data['receiver']],
+                                                  users[data['subject']])
+        if social_graph_errors:
+            data['errors'].append(social_graph_errors)
 
     #If all is good then this should be an empty list.
     if not data['errors']:
@@ -118,9 +92,7 @@ def verify_social_graph(sender, receiver, subject):
     if settings.RESPECT_SOCIAL_GRAPH==False:
         return errors
     #otherwise verify that a Social graph G exists between sender and subject.
-    try:
-        sg=SocialGraph.objects.get(grantor=subject, grantee=sender)
-    except(SocialGraph.DoesNotExist):
+    if not shares(subject.pk, sender.pk):
         error = "A social graph does not exist between the grantor %s and the grantee %s." % (subject, sender)
         errors.append(error)
 
@@ -2,7 +2,8 @@ import sys, types, datetime, os, json
 from django.http import HttpResponse, HttpResponseRedirect
 from django.contrib.auth import authenticate, login, logout
 from django.conf import settings
-from models import flangioUser as User
+from models import flangioUser as User, APIToken
+from tokens import issue_token
 from django.core.urlresolvers import reverse
 from django.shortcuts import render_to_response
 from django.template import RequestContext
@@ -11,8 +12,9 @@ from django.core import serializers
 from django.db.utils import IntegrityError
 from django.views.decorators.csrf import csrf_exempt
 from forms import *
-from decorators import json_login_required, access_required
+from decorators import json_login_required, json_password_required, access_required
 from ..socialgraph.models import SocialGraph
+from ..mongodb.encoding import dumps, pretty_requested
 from django.utils.translation import ugettext_lazy as _
 from django.contrib import messages
 from django.contrib.auth.forms import SetPasswordForm
@@ -69,7 +71,46 @@ def simple_email_login(request):
 def api_test_credentials(request):
     message ="Your API credentials for user %s are valid." % (request.user)
     jsonstr={"code": 200, "message": message}
-    jsonstr=json.dumps(jsonstr, indent = 4,)
+    jsonstr=dumps(jsonstr, pretty_requested(request))
+    return HttpResponse(jsonstr, status=200, mimetype="application/json")
+
+
+@csrf_exempt
+@json_password_required
+def api_token_create(request):
+    """Issue an API token to the user, who must sign in with their password
+    or session rather than another token. It is only ever shown in this
+    response; send it as "Authorization: Bearer <token>"."""
+    if request.method != 'POST':
+        jsonstr={"code": 405, "message": "This method is not allowed. Try a POST"}
+        jsonstr=dumps(jsonstr, pretty_requested(request))
+        return HttpResponse(jsonstr, status=405, mimetype="application/json")
+    api_token, token = issue_token(request.user, request.POST.get('name', ''))
+    jsonstr={"code": 200, "message": "API token %s created." % (api_token.pk),
+             "id": api_token.pk, "token": token}
+    jsonstr=dumps(jsonstr, pretty_requested(request))
+    return HttpResponse(jsonstr, status=200, mimetype="application/json")
+
+
+@csrf_exempt
+@json_login_required
+def api_token_revoke(request):
+    """Revoke one of the user's API tokens, given its id."""
+    if request.method != 'POST':
+        jsonstr={"code": 405, "message": "This method is not allowed. Try a POST"}
+        jsonstr=dumps(jsonstr, pretty_requested(request))
+        return HttpResponse(jsonstr, status=405, mimetype="application/json")
+    try:
+        api_token = APIToken.objects.get(pk=int(request.POST.get('id', '')),
+                                         user=request.user)
+    except (ValueError, APIToken.DoesNotExist):
+        jsonstr={"code": 404, "message": "API token not found."}
+        jsonstr=dumps(jsonstr, pretty_requested(request))
+        return HttpResponse(jsonstr, status=404, mimetype="application/json")
+    api_token.is_active = False
+    api_token.save()
+    jsonstr={"code": 200, "message": "API token %s revoked." % (api_token.pk)}
+    jsonstr=dumps(jsonstr, pretty_requested(request))
     return HttpResponse(jsonstr, status=200, mimetype="application/json")
 
 
@@ -86,13 +127,13 @@ def api_delete_user(request, email):
     except User.DoesNotExist:
         message ="User %s does not exist." % (email)
         jsond={"code": 404, "message": message}
-        jsonstr=json.dumps(jsond, indent = 4,)
+        jsonstr=dumps(jsond, pretty_requested(request))
         return HttpResponse(jsonstr, status=404, mimetype="application/json")
         
     u.delete()
     message ="User %s deleted." % (email)
     jsond={"code": 200, "message": message}
-    jsonstr=json.dumps(jsond, indent = 4,)
+    jsonstr=dumps(jsond, pretty_requested(request))
     return HttpResponse(jsonstr, status=200, mimetype="application/json")
     
     
@@ -163,14 +204,14 @@ def api_read_user(request, email):
     except User.DoesNotExist:
         message ="User %s does not exist." % (email)
         jsond={"code": 404, "message": message}
-        jsonstr=json.dumps(jsond, indent = 4,)
+        jsonstr=dumps(jsond, pretty_requested(request))
         return HttpResponse(jsonstr, status=404, mimetype="application/json")
         
     user = {"first_name": u.first_name, "last_name":u.last_name,
             "username": u.username, "email": email,
             "date_joined": str(u.date_joined)}
     jsond={"code": 200, "user": user}
-    jsonstr=json.dumps(jsond, indent = 4,)
+    jsonstr=dumps(jsond, pretty_requested(request))
     return HttpResponse(jsonstr, status=200, mimetype="application/json")
 
 
@@ -229,7 +270,7 @@ def api_user_create(request):
                 except:
                     pass
             jsonstr=result
-            jsonstr=json.dumps(jsonstr, indent = 4,)
+            jsonstr=dumps(jsonstr, pretty_requested(request))
             return HttpResponse(jsonstr, status=200, mimetype="application/json")
         else:
             # the form had errors
@@ -244,7 +285,7 @@ def api_user_create(request):
             jsonstr={"code": 400,
                       "message": "User creation failed due to errors.",
                          "errors": errors}
-            jsonstr=json.dumps(jsonstr, indent = 4,)
+            jsonstr=dumps(jsonstr, pretty_requested(request))
             return HttpResponse(jsonstr, status=400, mimetype="application/json")
     # this is an HTTP GET
     return render_to_response('accounts/create.html',
@@ -271,7 +312,7 @@ def api_user_update(request):
             jsonstr = { "code": 400,
                         "message": "Update did not identify the user by email.",
                         "errors": ["Update did not identify the user by email.", ]}
-            jsonstr=json.dumps(jsonstr, indent = 4,)
+            jsonstr=dumps(jsonstr, pretty_requested(request))
             return HttpResponse(jsonstr, status=400, mimetype="application/json")
         
         try:
@@ -282,7 +323,7 @@ def api_user_update(request):
             jsonstr = { "code": 404,
                         "message": "User not found.",
                         "errors": [msg, ]}
-            jsonstr=json.dumps(jsonstr, indent = 4,)
+            jsonstr=dumps(jsonstr, pretty_requested(request))
             return HttpResponse(jsonstr, status=400, mimetype="application/json")
         
         form = APIUserUpdateForm(request.POST, instance=user)
@@ -291,7 +332,7 @@ def api_user_update(request):
         if form.is_valid():
             result=form.save()
             jsonstr=result
-            jsonstr=json.dumps(jsonstr, indent = 4,)
+            jsonstr=dumps(jsonstr, pretty_requested(request))
             return HttpResponse(jsonstr, status=200, mimetype="application/json")
         else:
             # the form had errors
@@ -306,7 +347,7 @@ def api_user_update(request):
             jsonstr = { "code": 400,
                         "message": "User update failed due to errors.",
                         "errors": errors}
-            jsonstr=json.dumps(jsonstr, indent = 4,)
+            jsonstr=dumps(jsonstr, pretty_requested(request))
             return HttpResponse(jsonstr, status=400, mimetype="application/json")
     # this is an HTTP GET
     return render_to_response('accounts/create.html',
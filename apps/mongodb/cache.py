@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim: ai ts=4 sts=4 et sw=4
+
+"""
+    Caches kept in front of MongoDB.
+
+    Every database and collection has a generation number. Every helper that
+    writes to a collection calls collection_changed() (or database_changed()
+    for a dropped database) which bumps the generation, and every cache key
+    includes the current generations, so a write makes all earlier entries
+    for that collection unreachable at once.
+
+    Generations live in the shared Django cache named by SEARCH_CACHE_BACKEND
+    when one is configured, so a write in one worker invalidates every
+    worker. Without it they are kept in this process only, and other
+    processes see a write once their entries expire.
+
+    Search results are cached in an in-process LRU of SEARCH_CACHE_SIZE
+    entries and, when SEARCH_CACHE_BACKEND is set, in the shared cache too.
+    Exact counts are cached in this process per collection generation and
+    normalized query for SEARCH_COUNT_CACHE_TTL seconds.
+"""
+
+import threading, time, hashlib
+import cPickle as pickle
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import get_cache
+from bson import json_util
+
+
+_counts = {}
+_counts_lock = threading.Lock()
+
+_generations = {}
+_generations_lock = threading.Lock()
+
+
+def normalize_query(query):
+    """Return a canonical string for a query dict (keys sorted, BSON types
+    preserved) so equal queries share cache entries."""
+    return json_util.dumps(query, sort_keys=True, separators=(',', ':'))
+
+
+def shared_cache():
+    """Return the shared Django cache, or None when none is configured."""
+    if not settings.SEARCH_CACHE_BACKEND:
+        return None
+    return get_cache(settings.SEARCH_CACHE_BACKEND)
+
+
+def _generation_name(database_name, collection_name=None):
+    if collection_name is None:
+        return "flangio-gen:%s" % (database_name)
+    return "flangio-gen:%s:%s" % (database_name, collection_name)
+
+
+def _new_generation():
+    #Start from the clock rather than 0 so a restarted shared cache can't
+    #hand out a generation that entries still held locally were made with.
+    return int(time.time() * 1000)
+
+
+def named_generation(name):
+    """Return the current value of the generation number called name."""
+    shared = shared_cache()
+    if shared is not None:
+        g = shared.get(name)
+        if g is None:
+            shared.add(name, _new_generation(), None)
+            g = shared.get(name)
+        if g is not None:
+            return g
+    with _generations_lock:
+        return _generations.setdefault(name, _new_generation())
+
+
+def bump_named_generation(name):
+    """Advance the generation number called name and return its new value."""
+    with _generations_lock:
+        g = _generations[name] = _generations.get(name, _new_generation()) + 1
+    shared = shared_cache()
+    if shared is not None:
+        try:
+            g = shared.incr(name)
+        except ValueError:
+            g = _new_generation()
+            shared.set(name, g, None)
+    return g
+
+
+def get_generation(database_name, collection_name=None):
+    """Return the generation of a database, or of a collection if named."""
+    return named_generation(_generation_name(database_name, collection_name))
+
+
+def _bump_generation(database_name, collection_name=None):
+    bump_named_generation(_generation_name(database_name, collection_name))
+
+
+def generation_key(database_name, collection_name):
+    """Return a string that changes whenever the collection is written to
+    or its database is dropped."""
+    return "%s.%s" % (get_generation(database_name),
+                      get_generation(database_name, collection_name))
+
+
+def _count_key(database_name, collection_name, query):
+    return "%s:%s" % (generation_key(database_name, collection_name),
+                      normalize_query(query))
+
+
+def get_cached_count(database_name, collection_name, query):
+    """Return the cached exact count for query, or None."""
+    entries = _counts.get((str(database_name), str(collection_name)))
+    if not entries:
+        return None
+    entry = entries.get(_count_key(database_name, collection_name, query))
+    if entry is None or entry[0] < time.time():
+        return None
+    return entry[1]
+
+
+def set_cached_count(database_name, collection_name, query, count):
+    ttl = settings.SEARCH_COUNT_CACHE_TTL
+    if not ttl:
+        return
+    with _counts_lock:
+        entries = _counts.setdefault((str(database_name), str(collection_name)), {})
+        if len(entries) >= settings.SEARCH_COUNT_CACHE_SIZE:
+            #drop whatever has expired, and everything if nothing had.
+            now = time.time()
+            for k, v in entries.items():
+                if v[0] < now:
+                    del entries[k]
+            if len(entries) >= settings.SEARCH_COUNT_CACHE_SIZE:
+                entries.clear()
+        entries[_count_key(database_name, collection_name, query)] = (time.time() + ttl, count)
+
+
+class LRUCache(object):
+    """A small thread-safe LRU of pickled values with a time to live."""
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                return None
+            self.entries[key] = entry
+            return entry[1]
+
+    def set(self, key, value, ttl):
+        if self.size <= 0:
+            return
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (time.time() + ttl, value)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def delete_values(self, value):
+        """Drop every entry holding value."""
+        with self.lock:
+            for k, entry in self.entries.items():
+                if entry[1] == value:
+                    del self.entries[k]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+_results = LRUCache(settings.SEARCH_CACHE_SIZE)
+
+
+def result_cache_enabled():
+    return bool(settings.SEARCH_CACHE_SIZE or settings.SEARCH_CACHE_BACKEND)
+
+
+def result_cache_key(database_name, collection_name, *parts):
+    """Build the cache key for a search. parts are the query, projection,
+    sort, skip, limit and anything else that changes the response."""
+    body = normalize_query([str(database_name), str(collection_name)] + list(parts))
+    return "flangio-search:%s:%s" % (generation_key(database_name, collection_name),
+                                     hashlib.sha1(body).hexdigest())
+
+
+def get_cached_result(key):
+    """Return a fresh copy of the cached response_dict for key, or None."""
+    data = _results.get(key)
+    if data is None:
+        shared = shared_cache()
+        if shared is not None:
+            data = shared.get(key)
+            if data is not None:
+                _results.set(key, data, settings.SEARCH_CACHE_TTL)
+    if data is None:
+        return None
+    return pickle.loads(data)
+
+
+def set_cached_result(key, response_dict):
+    if len(response_dict.get('results', ())) > settings.SEARCH_CACHE_MAX_RESULTS:
+        return
+    data = pickle.dumps(response_dict, pickle.HIGHEST_PROTOCOL)
+    _results.set(key, data, settings.SEARCH_CACHE_TTL)
+    shared = shared_cache()
+    if shared is not None:
+        shared.set(key, data, settings.SEARCH_CACHE_TTL)
+
+
+def collection_changed(database_name, collection_name):
+    """Invalidate everything cached for a collection. Call after any write."""
+    _bump_generation(str(database_name), str(collection_name))
+    with _counts_lock:
+        _counts.pop((str(database_name), str(collection_name)), None)
+
+
+def database_changed(database_name):
+    """Invalidate everything cached for every collection of a database."""
+    _bump_generation(str(database_name))
+    with _counts_lock:
+        for k in _counts.keys():
+            if k[0] == str(database_name):
+                del _counts[k]
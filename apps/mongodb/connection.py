@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim: ai ts=4 sts=4 et sw=4
+
+"""
+    A process-wide registry of pooled MongoClient instances.
+
+    MongoClient keeps its own connection pool and is thread-safe, so one
+    client per host/port/options is shared by every helper instead of opening
+    a new connection on each call. Clients are created lazily and the registry
+    is discarded when the process id changes (i.e. after a fork), because a
+    client must never be shared between a parent and child process.
+"""
+
+import os, sys, threading
+from django.conf import settings
+from pymongo import MongoClient
+
+
+_clients = {}
+_clients_pid = os.getpid()
+_clients_lock = threading.Lock()
+
+
+def default_client_options():
+    """Return the pool and timeout options defined in settings."""
+    options = {'maxPoolSize': settings.MONGO_MAX_POOL_SIZE,
+               'connectTimeoutMS': settings.MONGO_CONNECT_TIMEOUT_MS,
+               'socketTimeoutMS': settings.MONGO_SOCKET_TIMEOUT_MS,
+               'waitQueueTimeoutMS': settings.MONGO_WAIT_QUEUE_TIMEOUT_MS,
+               }
+    options.update(settings.MONGO_CLIENT_OPTIONS)
+    return options
+
+
+def _registry_key(host, port, options):
+    return (host, int(port), tuple(sorted(options.items())))
+
+
+def _check_pid():
+    """Throw away the clients inherited from a parent process."""
+    global _clients, _clients_pid, _clients_lock
+    pid = os.getpid()
+    if pid != _clients_pid:
+        _clients = {}
+        _clients_pid = pid
+        _clients_lock = threading.Lock()
+
+
+def get_mongo_client(host=None, port=None, **options):
+    """Return the shared MongoClient for host/port/options, creating it on
+    first use. Options not supplied default to the MONGO_* settings.
+    """
+    if host is None:
+        host = settings.MONGO_HOST
+    if port is None:
+        port = settings.MONGO_PORT
+
+    client_options = default_client_options()
+    client_options.update(options)
+    #drop unset options so pymongo applies its own defaults.
+    for k, v in client_options.items():
+        if v is None:
+            del client_options[k]
+
+    _check_pid()
+    key = _registry_key(host, port, client_options)
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                client = MongoClient(host=host, port=int(port), connect=False,
+                                     **client_options)
+                _clients[key] = client
+    return client
+
+
+def get_mongo_db(database_name=settings.MONGO_DB_NAME):
+    """Return a database handle from the default shared client."""
+    return get_mongo_client()[str(database_name)]
+
+
+def get_mongo_collection(database_name=settings.MONGO_DB_NAME,
+                         collection_name=settings.MONGO_MASTER_COLLECTION):
+    """Return a collection handle from the default shared client."""
+    return get_mongo_db(database_name)[str(collection_name)]
+
+
+def close_mongo_clients():
+    """Close and forget every client in this process."""
+    _check_pid()
+    with _clients_lock:
+        for client in _clients.values():
+            try:
+                client.close()
+            except:
+                pass
+        _clients.clear()
+
+
+def mongo_health_check(host=None, port=None):
+    """Ping the server through the shared client. A client that fails the
+    ping is evicted from the registry so the next caller reconnects.
+    Return a response_dict.
+    """
+    response_dict = {}
+    client = get_mongo_client(host, port)
+    try:
+        client.admin.command('ping')
+        response_dict['code'] = 200
+        response_dict['type'] = "health-check"
+        response_dict['message'] = "OK"
+    except:
+        with _clients_lock:
+            for k, v in _clients.items():
+                if v is client:
+                    del _clients[k]
+        try:
+            client.close()
+        except:
+            pass
+        #the details stay in the server log; the endpoint is public.
+        print "MongoDB health check failed"
+        print str(sys.exc_info())
+        response_dict['code'] = 503
+        response_dict['type'] = "Error"
+        response_dict['message'] = "MongoDB is unreachable."
+
+    return response_dict
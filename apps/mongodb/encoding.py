@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim: ai ts=4 sts=4 et sw=4
+
+"""
+    JSON encoding for API responses.
+
+    BSON types (ObjectId, datetimes at any depth, Decimal128, ...) are
+    converted by the encoder's default() hook while the document is being
+    written, so results no longer need a separate pass to fix them up first.
+    Compact output is the default because only then does the json module use
+    its C encoder; clients that want indented output send pretty=true.
+
+    The encoder class is named by the JSON_ENCODER setting so a faster or
+    more complete one can be swapped in.
+"""
+
+import json, uuid
+from decimal import Decimal
+from datetime import datetime, date, time
+from django.conf import settings
+from django.utils.module_loading import import_by_path
+from bson.objectid import ObjectId
+from bson.dbref import DBRef
+from bson.timestamp import Timestamp
+try:
+    from bson.decimal128 import Decimal128
+except ImportError:
+    #pymongo < 3.4
+    Decimal128 = None
+
+
+class BSONEncoder(json.JSONEncoder):
+    """JSONEncoder that writes BSON types the way flangio always has:
+    dates, times and ids as strings."""
+
+    def default(self, o):
+        if isinstance(o, (datetime, date, time)):
+            return o.__str__()
+        if isinstance(o, ObjectId):
+            return o.__str__()
+        if Decimal128 is not None and isinstance(o, Decimal128):
+            #as a string so no precision is lost
+            return o.to_decimal().__str__()
+        if isinstance(o, (Decimal, uuid.UUID)):
+            return o.__str__()
+        if isinstance(o, Timestamp):
+            return o.as_datetime().__str__()
+        if isinstance(o, DBRef):
+            return o.as_doc().to_dict()
+        return json.JSONEncoder.default(self, o)
+
+
+_encoders = {}
+
+
+def get_encoder(pretty=False):
+    """Return the shared encoder instance from the JSON_ENCODER setting."""
+    pretty = bool(pretty)
+    encoder = _encoders.get(pretty)
+    if encoder is None:
+        cls = import_by_path(settings.JSON_ENCODER)
+        if pretty:
+            encoder = cls(indent=4, separators=(',', ': '))
+        else:
+            encoder = cls(separators=(',', ':'))
+        _encoders[pretty] = encoder
+    return encoder
+
+
+def dumps(obj, pretty=None):
+    """Return obj as JSON text. pretty defaults to JSON_PRETTY_PRINT."""
+    if pretty is None:
+        pretty = settings.JSON_PRETTY_PRINT
+    return get_encoder(pretty).encode(obj)
+
+
+def pretty_requested(request):
+    """True if the client sent pretty=true, otherwise the site default."""
+    value = request.GET.get('pretty', None)
+    if value is None:
+        return settings.JSON_PRETTY_PRINT
+    return value.lower() in ('1', 'true', 'yes')
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim: ai ts=4 sts=4 et sw=4
+
+"""
+    Compile search GET parameters into a MongoDB filter.
+
+    A parameter is a field name, optionally followed by __ and an operator:
+
+        state=MD                  equality (unchanged from before)
+        age__gte=30               $gt, $gte, $lt, $lte
+        state__in=MD,VA           $in / $nin, comma separated
+        state__ne=MD              $ne
+        name__prefix=Jo           anchored regular expression, can use an index
+        email__exists=true        $exists
+
+    Plain equality values are left as strings, as they always were (see
+    CAST_STRINGS_TO_INTEGERS). Operator values are typed: integers, decimals,
+    ISO dates (2014-01-02 or 2014-01-02T03:04:05) and true/false/null become
+    numbers, datetimes, booleans and None. Wrap a value in double quotes to
+    keep it a string, e.g. zip__in="02134","02135".
+
+    A name whose suffix is not an operator is taken whole as the field name.
+"""
+
+import re, threading
+from datetime import datetime
+
+
+class InvalidQuery(Exception):
+    pass
+
+
+OPERATORS = ('gt', 'gte', 'lt', 'lte', 'ne', 'in', 'nin', 'prefix', 'exists')
+
+_INT = re.compile(r'^-?\d+$')
+_FLOAT = re.compile(r'^-?(\d+\.\d*|\.\d+)([eE][-+]?\d+)?$')
+_DATE_FORMATS = ('%Y-%m-%d', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M:%S',
+                 '%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%d %H:%M:%S.%f')
+
+#Compiled plans, keyed by the sorted parameter names.
+MAX_CACHED_PLANS = 1000
+_plans = {}
+_plans_lock = threading.Lock()
+
+
+def typed_value(value):
+    """Return value converted to the type it looks like."""
+    if len(value) >= 2 and value[0] == '"' and value[-1] == '"':
+        return value[1:-1]
+    if _INT.match(value):
+        return int(value)
+    if _FLOAT.match(value):
+        return float(value)
+    lowered = value.lower()
+    if lowered == 'true':
+        return True
+    if lowered == 'false':
+        return False
+    if lowered == 'null':
+        return None
+    if len(value) >= 10 and value[4:5] == '-' and value[7:8] == '-':
+        for f in _DATE_FORMATS:
+            try:
+                return datetime.strptime(value, f)
+            except ValueError:
+                pass
+    return value
+
+
+def _split_list(value):
+    return [typed_value(v) for v in value.split(',') if v != '']
+
+
+def _exists(value):
+    lowered = value.lower()
+    if lowered in ('1', 'true', 'yes', ''):
+        return True
+    if lowered in ('0', 'false', 'no'):
+        return False
+    raise InvalidQuery("exists must be true or false.")
+
+
+def _prefix(value):
+    return {'$regex': '^' + re.escape(value)}
+
+
+#operator -> (mongo operator, value converter). A None mongo operator means
+#the converter builds the whole condition.
+_OPERATOR_PLANS = {
+    'gt':     ('$gt', typed_value),
+    'gte':    ('$gte', typed_value),
+    'lt':     ('$lt', typed_value),
+    'lte':    ('$lte', typed_value),
+    'ne':     ('$ne', typed_value),
+    'in':     ('$in', _split_list),
+    'nin':    ('$nin', _split_list),
+    'exists': ('$exists', _exists),
+    'prefix': (None, _prefix),
+    }
+
+
+def split_param(name):
+    """Return (field, operator) for a parameter name. operator is None for
+    plain equality."""
+    field, sep, op = name.rpartition('__')
+    if sep and field and op in OPERATORS:
+        return field, op
+    return name, None
+
+
+def compile_plan(names):
+    """Return the plan for a set of parameter names: a tuple of
+    (parameter, field, mongo operator, converter). Raise InvalidQuery if
+    a field is used both for equality and with an operator."""
+    plan = []
+    equality = set()
+    operators = set()
+    for name in sorted(names):
+        field, op = split_param(name)
+        if op is None:
+            equality.add(field)
+            plan.append((name, field, None, None))
+        else:
+            operators.add(field)
+            mongo_op, converter = _OPERATOR_PLANS[op]
+            plan.append((name, field, mongo_op, converter))
+    both = equality & operators
+    if both:
+        raise InvalidQuery("%s cannot be matched exactly and with an operator at the same time."
+                           % (", ".join(sorted(both))))
+    return tuple(plan)
+
+
+def get_plan(names):
+    """Return the cached plan for this parameter shape, compiling it once."""
+    shape = tuple(sorted(names))
+    plan = _plans.get(shape)
+    if plan is None:
+        plan = compile_plan(shape)
+        with _plans_lock:
+            if len(_plans) >= MAX_CACHED_PLANS:
+                _plans.clear()
+            _plans[shape] = plan
+    return plan
+
+
+def compile_filter(params):
+    """Return the MongoDB filter for a dict of GET parameters."""
+    query = {}
+    for name, field, mongo_op, converter in get_plan(params.keys()):
+        value = params[name]
+        if converter is None:
+            query[field] = value
+            continue
+        condition = query.setdefault(field, {})
+        if mongo_op is None:
+            condition.update(converter(value))
+        else:
+            condition[mongo_op] = converter(value)
+    return query
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim: ai ts=4 sts=4 et sw=4
+
+"""
+    Flatten nested documents into table rows.
+
+    Embedded documents become dotted-path columns, the notation MongoDB
+    itself uses: {"address": {"city": "Baltimore"}} has the column
+    address.city. Arrays are flattened by position (tags.0, tags.1, ...)
+    unless FLATTEN_ARRAYS is False, in which case an array is one cell of
+    compact JSON.
+
+    A FlattenPlan reads a fixed list of columns out of each document. It is
+    compiled once per list of columns and cached (see get_plan). Cells are
+    produced a batch of rows at a time, column by column, so the control
+    characters XML-based formats (XLSX, HTML) cannot hold are stripped with
+    one translate() per column rather than one pass per cell. Text is kept
+    as unicode; nothing else is dropped.
+"""
+
+import json, threading
+from django.conf import settings
+from encoding import dumps
+
+
+#Compiled plans, keyed by their columns.
+MAX_CACHED_PLANS = 100
+_plans = {}
+_plans_lock = threading.Lock()
+
+#Rows formatted together by FlattenPlan.text_rows
+BATCH_ROWS = 500
+
+#C0 control characters other than tab, newline and carriage return, and
+#the two noncharacters XML does not allow.
+_CONTROL = dict.fromkeys(range(0, 9) + [11, 12] + range(14, 32) + [0xfffe, 0xffff])
+
+#Joins the cells of a column so it can be cleaned in one call. It is left
+#out of the table used on the joined text.
+_SEPARATOR = u"\ufffe"
+_CONTROL_JOINED = dict((k, v) for k, v in _CONTROL.items() if k != ord(_SEPARATOR))
+
+
+def _is_array(value):
+    return isinstance(value, (list, tuple)) and settings.FLATTEN_ARRAYS
+
+
+def _children(value):
+    if isinstance(value, dict):
+        return value.items()
+    return [(str(i), v) for i, v in enumerate(value)]
+
+
+def document_paths(document, prefix=""):
+    """Yield the dotted path of every value of a document that is not
+    itself flattened, in document order. Empty documents and arrays are
+    values."""
+    for k, v in _children(document):
+        path = prefix + k
+        if (isinstance(v, dict) or _is_array(v)) and v:
+            for p in document_paths(v, path + "."):
+                yield p
+        else:
+            yield path
+
+
+def _getter(column):
+    parts = column.split('.')
+    if len(parts) == 1:
+        return lambda d: d.get(column)
+    steps = [(p, int(p) if p.isdigit() else None) for p in parts]
+    def get(d):
+        value = d
+        for key, index in steps:
+            if isinstance(value, dict):
+                value = value.get(key)
+            elif index is not None and isinstance(value, (list, tuple)) and \
+                 index < len(value):
+                value = value[index]
+            else:
+                return None
+        return value
+    return get
+
+
+def cell_text(value):
+    """Return a value as the unicode text of a cell, without loss:
+    unflattened documents and arrays as compact JSON, floats exactly."""
+    if value is None:
+        return u""
+    if isinstance(value, unicode):
+        return value
+    if isinstance(value, str):
+        return value.decode("utf-8", "replace")
+    if isinstance(value, float):
+        return unicode(repr(value))
+    if isinstance(value, (bool, int, long)):
+        return unicode(value)
+    text = dumps(value, False)
+    if text.startswith('"'):
+        #dates, ObjectId, Decimal128 and the like encode as JSON strings
+        return json.loads(text)
+    return text
+
+
+def clean(text):
+    """Strip the control characters XML can't hold from unicode text."""
+    return text.translate(_CONTROL)
+
+
+def clean_column(texts):
+    """clean() a list of unicode strings with a single translate()."""
+    joined = _SEPARATOR.join(texts)
+    if joined.count(_SEPARATOR) != len(texts) - 1:
+        #a value contains the separator
+        return [clean(t) for t in texts]
+    return joined.translate(_CONTROL_JOINED).split(_SEPARATOR)
+
+
+class FlattenPlan(object):
+    """Reads the given columns, which may be dotted paths, from documents."""
+
+    def __init__(self, columns):
+        self.columns = tuple(columns)
+        self.getters = [_getter(c) for c in self.columns]
+
+    def values(self, document):
+        """Return the row of a document as its values."""
+        return [get(document) for get in self.getters]
+
+    def text_rows(self, documents, batch_rows=BATCH_ROWS):
+        """Yield the row of each document as a list of clean unicode cells."""
+        batch = []
+        for d in documents:
+            batch.append(d)
+            if len(batch) >= batch_rows:
+                for row in self._format(batch):
+                    yield row
+                batch = []
+        if batch:
+            for row in self._format(batch):
+                yield row
+
+    def _format(self, batch):
+        if not self.getters:
+            return [() for d in batch]
+        columns = [clean_column([cell_text(get(d)) for d in batch])
+                   for get in self.getters]
+        return zip(*columns)
+
+
+def get_plan(columns):
+    """Return the cached plan for these columns, compiling it once."""
+    columns = tuple(columns)
+    plan = _plans.get(columns)
+    if plan is None:
+        plan = FlattenPlan(columns)
+        with _plans_lock:
+            if len(_plans) >= MAX_CACHED_PLANS:
+                _plans.clear()
+            _plans[columns] = plan
+    return plan
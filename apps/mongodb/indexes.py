@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim: ai ts=4 sts=4 et sw=4
+
+"""
+    Check whether a sort can be served by an index.
+
+    Without a suitable index MongoDB sorts the matching documents in memory,
+    which is slow on large collections and fails outright once the sort
+    exceeds the server's memory limit. Searches can refuse such sorts up
+    front (see SEARCH_REQUIRE_INDEXED_SORT).
+
+    The index list of a collection is cached for INDEX_CACHE_TTL seconds.
+"""
+
+import threading, time
+from pymongo import ASCENDING, DESCENDING
+from connection import get_mongo_client
+
+
+INDEX_CACHE_TTL = 60
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def parse_sort(value):
+    """Parse a sort= parameter such as "-age,name" into a list of
+    (key, direction) tuples. A leading - sorts descending."""
+    spec = []
+    for k in value.split(','):
+        k = k.strip()
+        if not k:
+            continue
+        if k[0] == '-':
+            spec.append((unicode(k[1:]), DESCENDING))
+        else:
+            spec.append((unicode(k.lstrip('+')), ASCENDING))
+    return spec
+
+
+def parse_fields(value):
+    """Parse a fields= parameter ("name,age") into a list of keys."""
+    return [unicode(k.strip()) for k in value.split(',') if k.strip()]
+
+
+def get_index_keys(database_name, collection_name):
+    """Return the key patterns of every index on a collection as lists of
+    (key, direction) tuples."""
+    key = (str(database_name), str(collection_name))
+    entry = _indexes.get(key)
+    if entry is not None and entry[0] > time.time():
+        return entry[1]
+    collection = get_mongo_client()[key[0]][key[1]]
+    patterns = []
+    for name, info in collection.index_information().items():
+        patterns.append([(unicode(k), d) for k, d in info['key']])
+    with _indexes_lock:
+        _indexes[key] = (time.time() + INDEX_CACHE_TTL, patterns)
+    return patterns
+
+
+def indexes_changed(database_name, collection_name):
+    with _indexes_lock:
+        _indexes.pop((str(database_name), str(collection_name)), None)
+
+
+def _pattern_serves_sort(pattern, sort_spec, equality_keys):
+    #Leading index keys matched by equality don't affect the order.
+    while pattern and pattern[0][0] in equality_keys and \
+          pattern[0][0] not in [k for k, d in sort_spec]:
+        pattern = pattern[1:]
+    if len(pattern) < len(sort_spec):
+        return False
+    prefix = pattern[:len(sort_spec)]
+    if [k for k, d in prefix] != [k for k, d in sort_spec]:
+        return False
+    #An index can be walked forwards or backwards.
+    same = [d for k, d in prefix] == [d for k, d in sort_spec]
+    reverse = [d for k, d in prefix] == [-d for k, d in sort_spec]
+    return same or reverse
+
+
+def sort_is_indexed(database_name, collection_name, sort_spec, query={}):
+    """True if some index returns documents matching query in sort_spec
+    order without an in-memory sort."""
+    if not sort_spec or sort_spec == [('_id', ASCENDING)] or \
+       sort_spec == [('_id', DESCENDING)]:
+        return True
+    equality_keys = [k for k, v in query.items()
+                     if not k.startswith('$') and not isinstance(v, dict)]
+    for pattern in get_index_keys(database_name, collection_name):
+        if [d for k, d in pattern if d not in (ASCENDING, DESCENDING)]:
+            #text, hashed and geo indexes can't serve a sort
+            continue
+        if _pattern_serves_sort(pattern, sort_spec, equality_keys):
+            return True
+    return False
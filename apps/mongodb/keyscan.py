@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim: ai ts=4 sts=4 et sw=4
+
+"""
+    Find every column of a query's results without reading them.
+
+    An inline map/reduce on the server emits the dotted path of each value
+    of each matching document, as document_paths() (flatten.py) lists them,
+    with its position in the document and the type of the value. Only the
+    distinct paths come back, so every key is found, however late it first
+    appears, while the documents stay on the server.
+
+    Paths are ordered by where they sit in the documents (earliest position
+    seen, then by name), which keeps _id first and a document's own field
+    order. Value types are those arrow_type() (search/arrow_utils.py)
+    understands; a number is an int if every value seen was integral.
+"""
+
+from datetime import datetime
+from django.conf import settings
+from bson.binary import Binary
+from bson.code import Code
+
+
+_MAP = Code("""
+function() {
+    function typeName(v) {
+        if (v === null || v === undefined) return "null";
+        if (typeof v == "boolean") return "bool";
+        if (typeof v == "string") return "string";
+        if (typeof v == "number")
+            return (v % 1 === 0 && Math.abs(v) <= 9007199254740991) ? "int" : "float";
+        if (typeof NumberLong != "undefined" && v instanceof NumberLong) return "int";
+        if (typeof NumberInt != "undefined" && v instanceof NumberInt) return "int";
+        if (v instanceof Date) return "date";
+        if (typeof BinData != "undefined" && v instanceof BinData) return "binary";
+        return "other";
+    }
+    var wrappers = [typeof ObjectId != "undefined" && ObjectId,
+                    typeof NumberLong != "undefined" && NumberLong,
+                    typeof NumberInt != "undefined" && NumberInt,
+                    typeof NumberDecimal != "undefined" && NumberDecimal,
+                    typeof BinData != "undefined" && BinData,
+                    typeof Timestamp != "undefined" && Timestamp,
+                    typeof DBRef != "undefined" && DBRef,
+                    typeof DBPointer != "undefined" && DBPointer];
+    function nested(v) {
+        if (v === null || typeof v != "object") return false;
+        if (Array.isArray(v)) return flattenArrays;
+        for (var i = 0; i < wrappers.length; i++)
+            if (wrappers[i] && v instanceof wrappers[i]) return false;
+        return Object.prototype.toString.call(v) == "[object Object]";
+    }
+    function walk(value, prefix, rank) {
+        var i = 0;
+        for (var k in value) {
+            var v = value[k];
+            var r = rank.concat([i++]);
+            if (flat && nested(v) && Object.keys(v).length)
+                walk(v, prefix + k + ".", r);
+            else
+                emit(prefix + k, {rank: r, types: [typeName(v)]});
+        }
+    }
+    walk(this, "", []);
+}
+""")
+
+_REDUCE = Code("""
+function(key, values) {
+    function before(a, b) {
+        for (var i = 0; i < a.length && i < b.length; i++)
+            if (a[i] != b[i]) return a[i] < b[i];
+        return a.length < b.length;
+    }
+    var result = {rank: values[0].rank, types: []};
+    var seen = {};
+    values.forEach(function(v) {
+        if (before(v.rank, result.rank)) result.rank = v.rank;
+        v.types.forEach(function(t) {
+            if (!seen[t]) { seen[t] = true; result.types.push(t); }
+        });
+    });
+    return result;
+}
+""")
+
+PYTHON_TYPES = {'null': type(None),
+                'bool': bool,
+                'string': unicode,
+                'int': int,
+                'float': float,
+                'date': datetime,
+                'binary': Binary,
+                #ObjectId, documents, arrays and the rest are written as text
+                'other': dict,
+                }
+
+
+def scan_keys(collection, query, value_types=None, flat=False, max_time_ms=None):
+    """Return the keys of every document of collection matching query, with
+    id in place of _id, as result_keys() (apps/utils.py) would list them
+    after reading them all. If value_types is a dict it is filled with key
+    -> the set of Python types of its values. If flat is True nested values
+    are listed by their dotted paths."""
+    kwargs = {'query': query or {},
+              'scope': {'flat': bool(flat), 'flattenArrays': bool(settings.FLATTEN_ARRAYS)}}
+    if max_time_ms:
+        kwargs['maxTimeMS'] = int(max_time_ms)
+    rows = collection.inline_map_reduce(_MAP, _REDUCE, **kwargs)
+    rows = sorted(rows, key=lambda r: (list(r['value']['rank']), r['_id']))
+    keylist = []
+    for r in rows:
+        k = r['_id']
+        types = set(PYTHON_TYPES.get(t, dict) for t in r['value']['types'])
+        if k == '_id':
+            #iterate_results turns it into a string
+            k, types = 'id', set([unicode])
+        keylist.append(k)
+        if value_types is not None:
+            value_types.setdefault(k, set()).update(types)
+    return keylist
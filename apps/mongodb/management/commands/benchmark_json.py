@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim: ai ts=4 sts=4 et sw=4
+
+import json, timeit
+from datetime import datetime, timedelta
+from optparse import make_option
+from django.core.management.base import BaseCommand
+from bson.objectid import ObjectId
+from ...encoding import dumps
+from ....utils import normalize_results
+
+
+def sample_response(rows, nested=False):
+    results = []
+    start = datetime(2014, 1, 1)
+    for i in range(rows):
+        r = {"id": str(ObjectId()), "sender": "user%s" % (i % 50),
+             "subject": "patient%s" % (i % 500), "transaction_type": "text",
+             "weight": 150 + i % 40, "height": 1.7, "notes": "x" * 40,
+             "sinceid": i, "event_date": start + timedelta(minutes=i),
+             "created_on": start + timedelta(minutes=i, seconds=30)}
+        if nested:
+            r["_id"] = ObjectId()
+            r["vitals"] = {"taken": start + timedelta(minutes=i), "pulse": 70}
+        results.append(r)
+    return {"code": 200, "type": "search-results", "num_results": rows,
+            "results": results}
+
+
+class Command(BaseCommand):
+    help = "Time the JSON encoding of a search response: the old normalize_results + indented json.dumps path against the BSON encoder."
+
+    option_list = BaseCommand.option_list + (
+        make_option('--rows', type='int', default=10000,
+                    help='Documents in the sample response.'),
+        make_option('--repeat', type='int', default=5,
+                    help='Encodings per timing; the best of three is reported.'),
+        )
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        repeat = options['repeat']
+        flat = sample_response(rows)
+        nested = sample_response(rows, nested=True)
+
+        def old_path():
+            #normalize_results rewrites the rows in place, so give it a copy.
+            r = dict(flat, results=[dict(d) for d in flat['results']])
+            json.dumps(normalize_results(r), indent=4)
+
+        timings = (
+            ("normalize_results + json.dumps(indent=4)", old_path),
+            ("dumps(pretty=True)", lambda: dumps(flat, pretty=True)),
+            ("dumps() compact", lambda: dumps(flat, pretty=False)),
+            ("dumps() compact, nested BSON types", lambda: dumps(nested, pretty=False)),
+            )
+
+        self.stdout.write("%s rows, best of 3 x %s encodings" % (rows, repeat))
+        baseline = None
+        for name, fn in timings:
+            best = min(timeit.repeat(fn, number=repeat, repeat=3)) / repeat
+            if baseline is None:
+                baseline = best
+            self.stdout.write("%-42s %8.1f ms  %5.2fx" % (name, best * 1000, baseline / best))
@@ -7,7 +7,10 @@ from django.template.defaultfilters import slugify
 OUTPUT_CHOICES = (("csv","Comma Seperated Value (.csv)"),
                   ("xls","Microsoft Excel(xls)"),
                   ("json","JSON"),
-                  ("xml","XML"))
+                  ("xml","XML"),
+                  ("ndjson","Newline Delimited JSON (.ndjson)"),
+                  ("parquet","Parquet (.parquet)"),
+                  ("arrow","Arrow IPC stream (.arrows)"))
 
 class CreateHistory(models.Model):
 
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim: ai ts=4 sts=4 et sw=4
+
+"""
+    Keyset (a.k.a. cursor token) pagination.
+
+    Instead of skip(), each page asks for the documents that sort after the
+    last document of the previous page. The position is the value of every
+    sort key plus _id, which makes the order total, so each page is a range
+    scan on an index over the sort keys. The position is handed to the client
+    as a signed, opaque token.
+
+    Documents missing a sort key sort as null and cannot be paged past with a
+    range query, so keyset pagination should be used on keys every document
+    has.
+"""
+
+from datetime import datetime
+from django.core import signing
+from bson import json_util
+from pymongo import ASCENDING, DESCENDING
+
+
+CURSOR_SALT = "flangio.search.cursor"
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class BSONJSONSerializer(object):
+    """Serializer for django.core.signing that round-trips BSON types
+    (ObjectId, datetime, ...) found in sort keys."""
+
+    def dumps(self, obj):
+        return json_util.dumps(obj, separators=(',', ':')).encode('latin-1')
+
+    def loads(self, data):
+        return json_util.loads(data.decode('latin-1'))
+
+
+def normalize_sort(sort=None):
+    """Return the sort as a list of (key, direction) tuples ending with _id.
+    sort may be None, a key name, or a list of [key, direction] pairs as
+    stored on a SavedSearch."""
+    spec = []
+    if sort:
+        if isinstance(sort, basestring):
+            spec.append((unicode(sort), ASCENDING))
+        else:
+            for k, d in sort:
+                spec.append((unicode(k), int(d)))
+    if '_id' not in [k for k, d in spec]:
+        if spec:
+            spec.append(('_id', spec[-1][1]))
+        else:
+            spec.append(('_id', ASCENDING))
+    return spec
+
+
+def get_path(document, key):
+    """Return the value at a dotted key, or None when it is missing."""
+    value = document
+    for part in key.split('.'):
+        if not isinstance(value, dict) or not value.has_key(part):
+            return None
+        value = value[part]
+    return value
+
+
+def keyset_filter(sort_spec, values):
+    """Build the filter selecting documents that sort after values."""
+    clauses = []
+    for i, (k, d) in enumerate(sort_spec):
+        clause = {}
+        for j in range(i):
+            clause[sort_spec[j][0]] = values[j]
+        if d == DESCENDING:
+            clause[k] = {'$lt': values[i]}
+        else:
+            clause[k] = {'$gt': values[i]}
+        clauses.append(clause)
+    if len(clauses) == 1:
+        return clauses[0]
+    return {'$or': clauses}
+
+
+def encode_cursor(sort_spec, values):
+    payload = {'s': [list(s) for s in sort_spec], 'v': values}
+    return signing.dumps(payload, salt=CURSOR_SALT,
+                         serializer=BSONJSONSerializer, compress=True)
+
+
+def decode_cursor(token, sort_spec):
+    """Return the position values stored in token. Raise InvalidCursor if the
+    token was tampered with or was issued for a different sort."""
+    try:
+        payload = signing.loads(token, salt=CURSOR_SALT,
+                                serializer=BSONJSONSerializer)
+        values = payload['v']
+        issued_for = [(unicode(k), int(d)) for k, d in payload['s']]
+    except (signing.BadSignature, ValueError, KeyError, TypeError):
+        raise InvalidCursor("The after cursor is not valid.")
+    if issued_for != sort_spec or not isinstance(values, list) or \
+       len(values) != len(sort_spec):
+        raise InvalidCursor("The after cursor was issued for a different sort.")
+    #json_util returns aware UTC datetimes; the client hands out naive ones.
+    for i, v in enumerate(values):
+        if isinstance(v, datetime) and v.tzinfo is not None:
+            values[i] = v.replace(tzinfo=None) - v.utcoffset()
+    return values
+
+
+class KeysetPage(object):
+    """One page of a keyset paginated search. Feed it every raw document
+    returned (before _id is removed) and ask it for the next token."""
+
+    def __init__(self, sort=None, after="", limit=0):
+        self.sort = normalize_sort(sort)
+        self.limit = limit
+        self.values = None
+        if after:
+            self.values = decode_cursor(after, self.sort)
+        self.count = 0
+        self.last = None
+
+    def keys(self):
+        return [k for k, d in self.sort]
+
+    def filter(self, query):
+        """Return query restricted to documents after the cursor position."""
+        if self.values is None:
+            return query
+        ks = keyset_filter(self.sort, self.values)
+        if not query:
+            return ks
+        return {'$and': [query, ks]}
+
+    def observe(self, document):
+        self.count += 1
+        self.last = [get_path(document, k) for k in self.keys()]
+
+    def next_token(self):
+        """Return the token for the following page, or None on the last page."""
+        if self.last is None or not self.limit or self.count < self.limit:
+            return None
+        return encode_cursor(self.sort, self.last)
@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim: ai ts=4 sts=4 et sw=4
+
+"""
+    Slow query log.
+
+    The search helpers time each query. A streamed search is timed only while
+    it waits on the server, not while the client reads. One that takes
+    SLOW_QUERY_LOG_MS or longer is written to the capped collection
+    SLOW_QUERY_LOG_COLLECTION with its shape (the query with every value
+    replaced by 1, so searches that differ only in their values group
+    together), time and the number of documents returned.
+
+    Cursors are tagged with a unique comment (tag_cursor), so when the
+    server's profiler is on the documents examined are read from its
+    system.profile entries for the query instead of running it again. One
+    that takes SLOW_QUERY_EXPLAIN_MS or longer also has its plan saved:
+    explain() with queryPlanner verbosity, which plans the query without
+    running it. That is still done at most once per shape every
+    SLOW_QUERY_EXPLAIN_INTERVAL seconds, and not for a stream the client
+    abandoned.
+
+    Logging never raises; a failure to log is printed and ignored.
+"""
+
+import sys, time, uuid, threading
+from datetime import datetime
+from django.conf import settings
+from pymongo.errors import CollectionInvalid
+from bson import json_util
+from bson.son import SON
+from connection import get_mongo_client
+from cache import normalize_query
+
+
+_capped_ready = False
+_last_explained = {}
+_lock = threading.Lock()
+
+
+def start_timer():
+    return time.time()
+
+
+def tag_cursor(cursor):
+    """Give the cursor a unique comment so the profiler's entries for it can
+    be found. Return the cursor."""
+    if settings.SLOW_QUERY_LOG_MS is not None:
+        cursor.slowlog_comment = uuid.uuid4().hex
+        cursor.comment(cursor.slowlog_comment)
+    return cursor
+
+
+def query_shape(value):
+    """Return value with every leaf replaced by 1, keeping keys, operators
+    and $and/$or clause lists."""
+    if isinstance(value, dict):
+        return dict((k, query_shape(v)) for k, v in value.items())
+    if isinstance(value, (list, tuple)) and value and isinstance(value[0], dict):
+        return [query_shape(v) for v in value]
+    return 1
+
+
+def shape_key(database_name, collection_name, query, sort=None):
+    return "%s.%s %s sort=%s" % (database_name, collection_name,
+                                 normalize_query(query_shape(query or {})),
+                                 normalize_query(sort or []))
+
+
+def get_slowlog_collection():
+    """Return the slow log collection, creating it capped on first use."""
+    global _capped_ready
+    db = get_mongo_client()[settings.MONGO_DB_NAME]
+    if not _capped_ready:
+        try:
+            db.create_collection(settings.SLOW_QUERY_LOG_COLLECTION, capped=True,
+                                 size=settings.SLOW_QUERY_LOG_SIZE)
+        except CollectionInvalid:
+            #it already exists
+            pass
+        _capped_ready = True
+    return db[settings.SLOW_QUERY_LOG_COLLECTION]
+
+
+def summarize_explain(explain):
+    """Return (documents examined, plan description) from explain() output
+    of either the 2.x or the 3.x+ format. Examined is None for queryPlanner
+    output."""
+    if explain.has_key('queryPlanner') or explain.has_key('executionStats'):
+        examined = explain.get('executionStats', {}).get('totalDocsExamined')
+        stages = []
+        stage = explain.get('queryPlanner', {}).get('winningPlan', {})
+        while stage:
+            stages.append(stage.get('stage', '?'))
+            stage = stage.get('inputStage')
+        return examined, " <- ".join(stages)
+    return explain.get('nscannedObjects'), explain.get('cursor')
+
+
+def explain_plan(collection, query, sort=None):
+    """Return the queryPlanner explain() output of a find. The server picks
+    the plan without running the query."""
+    command = SON([('find', collection.name), ('filter', query or {})])
+    if sort:
+        if isinstance(sort, basestring):
+            sort = [(sort, 1)]
+        command['sort'] = SON((unicode(k), int(d)) for k, d in sort)
+    return collection.database.command('explain', command, verbosity='queryPlanner')
+
+
+def profiled_examined(collection, comment):
+    """Return the documents examined by the query tagged with comment, as
+    the server's profiler recorded them, or None if it recorded nothing."""
+    examined = None
+    spec = {'ns': collection.full_name,
+            '$or': [{'command.comment': comment},
+                    {'originatingCommand.comment': comment},
+                    {'query.$comment': comment}]}
+    for e in collection.database['system.profile'].find(spec):
+        n = e.get('docsExamined', e.get('nscannedObjects'))
+        if n is not None:
+            examined = (examined or 0) + n
+    return examined
+
+
+def _should_explain(shape):
+    now = time.time()
+    with _lock:
+        if _last_explained.get(shape, 0) + settings.SLOW_QUERY_EXPLAIN_INTERVAL > now:
+            return False
+        if len(_last_explained) > 10000:
+            _last_explained.clear()
+        _last_explained[shape] = now
+    return True
+
+
+def log_query(source, collection, query, sort=None, started=None, returned=0,
+              cursor=None, millis=None, explain=True):
+    """Record the query if it was slow. collection is the pymongo collection
+    searched and started the value of start_timer() before the query ran;
+    millis, if given, is the time it took instead. The documents examined
+    are looked up for cursor if it was tagged (see tag_cursor). A very slow
+    query is explained unless explain is False."""
+    if settings.SLOW_QUERY_LOG_MS is None:
+        return
+    if millis is None:
+        if started is None:
+            return
+        millis = int((time.time() - started) * 1000)
+    if millis < settings.SLOW_QUERY_LOG_MS:
+        return
+    try:
+        database_name = collection.database.name
+        shape = shape_key(database_name, collection.name, query, sort)
+        entry = {'shape': shape,
+                 'source': source,
+                 'database_name': database_name,
+                 'collection_name': collection.name,
+                 'query': normalize_query(query or {}),
+                 'millis': millis,
+                 'returned': returned,
+                 'examined': None,
+                 'created': datetime.utcnow(),
+                 }
+        comment = getattr(cursor, 'slowlog_comment', None)
+        if comment:
+            entry['examined'] = profiled_examined(collection, comment)
+        if explain and settings.SLOW_QUERY_EXPLAIN_MS is not None and \
+           millis >= settings.SLOW_QUERY_EXPLAIN_MS and _should_explain(shape):
+            plan = explain_plan(collection, query, sort)
+            entry['plan'] = summarize_explain(plan)[1]
+            #stored as text: explain output has keys MongoDB won't store
+            entry['explain'] = json_util.dumps(plan, indent=4)
+        get_slowlog_collection().insert(entry, w=0)
+    except:
+        print "Error writing the slow query log"
+        print str(sys.exc_info())
+
+
+def worst_shapes(limit=50):
+    """Group the slow log by shape and return a list of dicts, worst (most
+    total time) first."""
+    shapes = {}
+    for e in get_slowlog_collection().find({}, {'explain': 0}):
+        s = shapes.get(e['shape'])
+        if s is None:
+            s = {'shape': e['shape'], 'count': 0, 'total_millis': 0, 'max_millis': 0,
+                 'returned': 0, 'examined': None, 'plan': None, 'sources': [],
+                 'query': e.get('query'), 'last_seen': e.get('created')}
+            shapes[e['shape']] = s
+        s['count'] += 1
+        s['total_millis'] += e.get('millis', 0)
+        s['max_millis'] = max(s['max_millis'], e.get('millis', 0))
+        s['returned'] = max(s['returned'], e.get('returned') or 0)
+        if e.get('examined') is not None:
+            s['examined'] = max(s['examined'], e['examined'])
+        if e.get('plan'):
+            s['plan'] = e['plan']
+        if e.get('source') not in s['sources']:
+            s['sources'].append(e.get('source'))
+        if e.get('created') and (s['last_seen'] is None or e['created'] > s['last_seen']):
+            s['last_seen'] = e['created']
+            s['query'] = e.get('query')
+    result = shapes.values()
+    for s in result:
+        s['avg_millis'] = s['total_millis'] / s['count']
+    result.sort(key=lambda s: s['total_millis'], reverse=True)
+    return result[:limit]
+
+
+def explain_for_shape(shape):
+    """Return the latest saved explain() text for a shape, or None."""
+    for e in get_slowlog_collection().find({'shape': shape, 'explain': {'$exists': True}},
+                                           {'explain': 1}).sort('$natural', -1).limit(1):
+        return e['explain']
+    return None
@@ -6,6 +6,20 @@ Replace this with more appropriate tests for your application.
 """
 
 from django.test import TestCase
+from django.test.utils import override_settings
+from django.test.client import RequestFactory
+from django.conf import settings
+from pymongo import MongoClient
+from . import connection, cache
+from .encoding import dumps
+from . import filters, indexes, slowlog, flatten
+from ..utils import _stream_results
+from .filters import compile_filter, InvalidQuery
+from .pagination import (KeysetPage, InvalidCursor, keyset_filter,
+                         normalize_sort, encode_cursor, decode_cursor)
+from bson.objectid import ObjectId
+from datetime import datetime
+import json, time
 
 
 class SimpleTest(TestCase):
@@ -14,3 +28,368 @@ class SimpleTest(TestCase):
         Tests that 1 + 1 always equals 2.
         """
         self.assertEqual(1 + 1, 2)
+
+
+class ConnectionRegistryTest(TestCase):
+
+    def setUp(self):
+        connection.close_mongo_clients()
+
+    def test_client_is_shared(self):
+        """
+        The same host/port/options return the same pooled client.
+        """
+        a = connection.get_mongo_client()
+        b = connection.get_mongo_client()
+        self.assertTrue(a is b)
+
+    def test_options_are_part_of_the_key(self):
+        a = connection.get_mongo_client()
+        b = connection.get_mongo_client(maxPoolSize=5)
+        self.assertFalse(a is b)
+        self.assertEqual(b.max_pool_size, 5)
+
+    def test_builds_a_real_client(self):
+        """
+        The settings' options are ones the installed pymongo accepts.
+        """
+        client = connection.get_mongo_client()
+        self.assertTrue(isinstance(client, MongoClient))
+        self.assertEqual(client.max_pool_size, settings.MONGO_MAX_POOL_SIZE)
+
+    def test_health_check_hides_errors(self):
+        class Admin(object):
+            def command(self, name):
+                raise Exception("secret connection details")
+        class Client(object):
+            admin = Admin()
+            def close(self):
+                pass
+        get_mongo_client = connection.get_mongo_client
+        connection.get_mongo_client = lambda host, port: Client()
+        try:
+            result = connection.mongo_health_check()
+        finally:
+            connection.get_mongo_client = get_mongo_client
+        self.assertEqual(result['code'], 503)
+        self.assertEqual(result['message'], "MongoDB is unreachable.")
+
+    def test_registry_is_reset_after_fork(self):
+        a = connection.get_mongo_client()
+        connection._clients_pid = -1
+        b = connection.get_mongo_client()
+        self.assertFalse(a is b)
+
+
+class KeysetPaginationTest(TestCase):
+
+    def test_sort_always_ends_with_id(self):
+        self.assertEqual(normalize_sort(None), [('_id', 1)])
+        self.assertEqual(normalize_sort([["age", -1]]),
+                         [('age', -1), ('_id', -1)])
+
+    def test_keyset_filter(self):
+        spec = [('age', 1), ('_id', 1)]
+        oid = ObjectId()
+        self.assertEqual(keyset_filter(spec, [30, oid]),
+                         {'$or': [{'age': {'$gt': 30}},
+                                  {'age': 30, '_id': {'$gt': oid}}]})
+
+    def test_cursor_round_trip(self):
+        spec = normalize_sort([["when", -1]])
+        values = [datetime(2014, 1, 2, 3, 4, 5), ObjectId()]
+        token = encode_cursor(spec, values)
+        self.assertEqual(decode_cursor(token, spec), values)
+
+    def test_tampered_or_foreign_cursor_is_rejected(self):
+        spec = normalize_sort([["age", 1]])
+        token = encode_cursor(spec, [30, ObjectId()])
+        self.assertRaises(InvalidCursor, decode_cursor, token + "x", spec)
+        self.assertRaises(InvalidCursor, decode_cursor, token,
+                          normalize_sort([["age", -1]]))
+
+    def test_next_token_only_on_a_full_page(self):
+        page = KeysetPage([["age", 1]], "", 2)
+        page.observe({'_id': ObjectId(), 'age': 1})
+        self.assertEqual(page.next_token(), None)
+        last = ObjectId()
+        page.observe({'_id': last, 'age': 2})
+        after = KeysetPage([["age", 1]], page.next_token(), 2)
+        self.assertEqual(after.values, [2, last])
+        self.assertEqual(after.filter({'state': 'MD'}),
+                         {'$and': [{'state': 'MD'},
+                                   {'$or': [{'age': {'$gt': 2}},
+                                            {'age': 2, '_id': {'$gt': last}}]}]})
+
+
+class CountCacheTest(TestCase):
+
+    def test_counts_are_cached_per_query(self):
+        cache.set_cached_count("db", "c", {"a": 1, "b": 2}, 42)
+        self.assertEqual(cache.get_cached_count("db", "c", {"b": 2, "a": 1}), 42)
+        self.assertEqual(cache.get_cached_count("db", "c", {"a": 2}), None)
+
+    def test_write_invalidates_the_collection(self):
+        cache.set_cached_count("db", "c", {}, 42)
+        cache.set_cached_count("db", "other", {}, 7)
+        cache.collection_changed("db", "c")
+        self.assertEqual(cache.get_cached_count("db", "c", {}), None)
+        self.assertEqual(cache.get_cached_count("db", "other", {}), 7)
+
+    @override_settings(SEARCH_COUNT_CACHE_TTL=0)
+    def test_ttl_of_zero_disables_the_cache(self):
+        cache.set_cached_count("db", "ttl", {}, 42)
+        self.assertEqual(cache.get_cached_count("db", "ttl", {}), None)
+
+
+class ResultCacheTest(TestCase):
+
+    def test_lru_evicts_the_least_recently_used(self):
+        lru = cache.LRUCache(2)
+        lru.set("a", 1, 60)
+        lru.set("b", 2, 60)
+        lru.get("a")
+        lru.set("c", 3, 60)
+        self.assertEqual(lru.get("b"), None)
+        self.assertEqual(lru.get("a"), 1)
+        self.assertEqual(lru.get("c"), 3)
+
+    def test_results_round_trip_as_copies(self):
+        key = cache.result_cache_key("db", "r", {"a": 1}, None, 0, 10)
+        cache.set_cached_result(key, {"code": 200, "results": [{"a": 1}]})
+        first = cache.get_cached_result(key)
+        first['results'].append({"a": 2})
+        self.assertEqual(cache.get_cached_result(key)['results'], [{"a": 1}])
+
+    def test_writes_change_the_key(self):
+        key = cache.result_cache_key("db", "r", {"a": 1})
+        cache.collection_changed("db", "other")
+        self.assertEqual(cache.result_cache_key("db", "r", {"a": 1}), key)
+        cache.collection_changed("db", "r")
+        self.assertNotEqual(cache.result_cache_key("db", "r", {"a": 1}), key)
+        key = cache.result_cache_key("db", "r", {"a": 1})
+        cache.database_changed("db")
+        self.assertNotEqual(cache.result_cache_key("db", "r", {"a": 1}), key)
+
+
+class EncodingTest(TestCase):
+
+    def test_bson_types_at_any_depth(self):
+        oid = ObjectId()
+        doc = {"_id": oid, "d": {"when": datetime(2014, 1, 2, 3, 4, 5)},
+               "l": [datetime(2014, 1, 2)]}
+        self.assertEqual(json.loads(dumps(doc)),
+                         {"_id": str(oid), "d": {"when": "2014-01-02 03:04:05"},
+                          "l": ["2014-01-02 00:00:00"]})
+
+    def test_compact_by_default(self):
+        self.assertEqual(dumps({"a": [1, 2]}), '{"a":[1,2]}')
+        self.assertEqual(dumps({"a": 1}, pretty=True), '{\n    "a": 1\n}')
+
+
+class FilterTest(TestCase):
+
+    def test_equality_is_unchanged(self):
+        self.assertEqual(compile_filter({"state": "MD", "age": "30"}),
+                         {"state": "MD", "age": "30"})
+
+    def test_operators_are_typed(self):
+        self.assertEqual(compile_filter({"age__gte": "30", "age__lt": "40.5",
+                                         "state__in": "MD,VA",
+                                         "zip__nin": '"02134"',
+                                         "email__exists": "false",
+                                         "born__gt": "2014-01-02"}),
+                         {"age": {"$gte": 30, "$lt": 40.5},
+                          "state": {"$in": ["MD", "VA"]},
+                          "zip": {"$nin": ["02134"]},
+                          "email": {"$exists": False},
+                          "born": {"$gt": datetime(2014, 1, 2)}})
+
+    def test_prefix_is_escaped_and_anchored(self):
+        self.assertEqual(compile_filter({"name__prefix": "Jo.n"}),
+                         {"name": {"$regex": "^Jo\\.n"}})
+
+    def test_unknown_suffix_is_part_of_the_field(self):
+        self.assertEqual(compile_filter({"a__b": "1"}), {"a__b": "1"})
+
+    def test_equality_and_operator_on_one_field(self):
+        self.assertRaises(InvalidQuery, compile_filter, {"age": "1", "age__gt": "0"})
+
+    def test_plans_are_cached_per_shape(self):
+        compile_filter({"x__gt": "1"})
+        plan = filters.get_plan(["x__gt"])
+        compile_filter({"x__gt": "2"})
+        self.assertTrue(filters.get_plan(["x__gt"]) is plan)
+
+
+class SortIndexTest(TestCase):
+
+    def setUp(self):
+        indexes._indexes[("db", "c")] = (time.time() + 60,
+            [[("_id", 1)], [("age", 1), ("name", -1)], [("state", 1), ("when", 1)],
+             [("body", "text")]])
+
+    def test_parse(self):
+        self.assertEqual(indexes.parse_sort("-age,name"), [("age", -1), ("name", 1)])
+        self.assertEqual(indexes.parse_fields("a, b,"), ["a", "b"])
+
+    def test_non_ascii_field_names(self):
+        self.assertEqual(indexes.parse_sort(u"-\xe2ge,n\xe4me"),
+                         [(u"\xe2ge", -1), (u"n\xe4me", 1)])
+        self.assertEqual(indexes.parse_fields(u"\xe2ge, name"), [u"\xe2ge", u"name"])
+        self.assertFalse(indexes.sort_is_indexed("db", "c", [(u"\xe2ge", 1)]))
+        spec = normalize_sort([[u"\xe2ge", -1]])
+        token = encode_cursor(spec, [u"x", 30])
+        self.assertEqual(decode_cursor(token, spec), [u"x", 30])
+
+    def test_unindexed_non_ascii_sort_is_a_bad_request(self):
+        from ..search.views import prepare_search_results
+        request = RequestFactory().get("/search.json", {"sort": u"-\xe2ge"})
+        with self.settings(SEARCH_REQUIRE_INDEXED_SORT=True):
+            response = prepare_search_results(request, "db", "c")
+        self.assertEqual(response['code'], 400)
+        self.assertTrue(u"sort=-\xe2ge" in response['message'])
+
+    def test_index_prefix_in_either_direction(self):
+        self.assertTrue(indexes.sort_is_indexed("db", "c", [("age", 1)]))
+        self.assertTrue(indexes.sort_is_indexed("db", "c", [("age", -1), ("name", 1)]))
+        self.assertFalse(indexes.sort_is_indexed("db", "c", [("age", 1), ("name", 1)]))
+        self.assertFalse(indexes.sort_is_indexed("db", "c", [("name", 1)]))
+
+    def test_equality_prefix_is_skipped(self):
+        self.assertFalse(indexes.sort_is_indexed("db", "c", [("when", 1)]))
+        self.assertTrue(indexes.sort_is_indexed("db", "c", [("when", 1)], {"state": "MD"}))
+        self.assertFalse(indexes.sort_is_indexed("db", "c", [("when", 1)],
+                                                 {"state": {"$in": ["MD"]}}))
+
+
+class SlowLogTest(TestCase):
+
+    def test_values_are_dropped_from_the_shape(self):
+        self.assertEqual(slowlog.query_shape({"$or": [{"a": 5}, {"b": {"$in": [1, 2]}}]}),
+                         {"$or": [{"a": 1}, {"b": {"$in": 1}}]})
+        self.assertEqual(slowlog.shape_key("db", "c", {"a": "x"}),
+                         slowlog.shape_key("db", "c", {"a": "y"}))
+
+    def test_explain_summary(self):
+        old = {"cursor": "BasicCursor", "nscannedObjects": 900, "n": 10}
+        new = {"executionStats": {"totalDocsExamined": 900},
+               "queryPlanner": {"winningPlan": {"stage": "FETCH",
+                                                "inputStage": {"stage": "IXSCAN"}}}}
+        self.assertEqual(slowlog.summarize_explain(old), (900, "BasicCursor"))
+        self.assertEqual(slowlog.summarize_explain(new), (900, "FETCH <- IXSCAN"))
+        del new["executionStats"]
+        self.assertEqual(slowlog.summarize_explain(new), (None, "FETCH <- IXSCAN"))
+
+    def test_stream_is_timed_while_waiting_on_the_cursor(self):
+        def results():
+            time.sleep(0.05)
+            yield {}
+            yield {}
+        calls = []
+        stream = _stream_results({}, results(), None, lambda *args: calls.append(args))
+        for d in stream:
+            #a slow client
+            time.sleep(0.2)
+        n, waited, aborted = calls[0]
+        self.assertEqual((n, aborted), (2, False))
+        self.assertTrue(0.05 <= waited < 0.2)
+
+    def test_abandoned_stream(self):
+        calls = []
+        stream = _stream_results({}, (d for d in [{}, {}]), None,
+                                 lambda *args: calls.append(args))
+        stream.next()
+        stream.close()
+        self.assertEqual(calls[0][0], 1)
+        self.assertTrue(calls[0][2])
+
+    def test_plan_and_examined_without_running_the_query(self):
+        collection = _FakeCollection([{'docsExamined': 700}, {'docsExamined': 200}])
+        cursor = _FakeCursor()
+        with self.settings(SLOW_QUERY_LOG_MS=100, SLOW_QUERY_EXPLAIN_MS=1000):
+            slowlog.tag_cursor(cursor)
+            self._log(collection, cursor, millis=5000)
+            slowlog._last_explained.clear()
+            self._log(collection, cursor, millis=5000, explain=False)
+        explained, abandoned = collection.inserted
+        self.assertEqual(cursor.comments, [cursor.slowlog_comment])
+        self.assertEqual(collection.profile_spec['$or'][0],
+                         {'command.comment': cursor.slowlog_comment})
+        self.assertEqual(explained['examined'], 900)
+        self.assertEqual(explained['plan'], "COLLSCAN")
+        self.assertEqual(collection.commands, [("explain", "queryPlanner")])
+        self.assertEqual(abandoned['examined'], 900)
+        self.assertFalse(abandoned.has_key('explain'))
+
+    def _log(self, collection, cursor, **kwargs):
+        get_slowlog_collection = slowlog.get_slowlog_collection
+        slowlog.get_slowlog_collection = lambda: collection
+        try:
+            slowlog.log_query("test", collection, {'a': 1}, [('a', 1)], cursor=cursor,
+                              **kwargs)
+        finally:
+            slowlog.get_slowlog_collection = get_slowlog_collection
+
+
+class _FakeCursor(object):
+
+    def __init__(self):
+        self.comments = []
+
+    def comment(self, comment):
+        self.comments.append(comment)
+
+
+class _FakeCollection(object):
+    """Stands in for the searched collection, its database, system.profile
+    and the slow log."""
+
+    name = "c"
+    full_name = "db.c"
+
+    def __init__(self, profile):
+        self.database = self
+        self.profile = profile
+        self.inserted = []
+        self.commands = []
+
+    def __getitem__(self, name):
+        return self
+
+    def find(self, spec):
+        self.profile_spec = spec
+        return self.profile
+
+    def command(self, name, value, verbosity=None):
+        self.commands.append((name, verbosity))
+        return {'queryPlanner': {'winningPlan': {'stage': "COLLSCAN"}}}
+
+    def insert(self, entry, w=None):
+        self.inserted.append(entry)
+
+
+class FlattenTest(TestCase):
+
+    doc = {"name": u"Jos\xe9", "address": {"city": "Baltimore", "zip": "21201"},
+           "tags": ["a", "b"], "score": 0, "ratio": 0.1, "empty": {}}
+
+    def test_nested_values_get_dotted_paths(self):
+        self.assertEqual(sorted(flatten.document_paths(self.doc)),
+                         ["address.city", "address.zip", "empty", "name", "ratio",
+                          "score", "tags.0", "tags.1"])
+        with self.settings(FLATTEN_ARRAYS=False):
+            self.assertTrue("tags" in list(flatten.document_paths(self.doc)))
+
+    def test_text_rows_keep_the_data(self):
+        plan = flatten.get_plan(["name", "address.city", "tags.1", "tags.5", "score",
+                                 "ratio", "empty", "address"])
+        self.assertTrue(flatten.get_plan(list(plan.columns)) is plan)
+        row = list(plan.text_rows([self.doc]))[0]
+        self.assertEqual(list(row), [u"Jos\xe9", u"Baltimore", u"b", u"", u"0", u"0.1",
+                                     u"{}", u'{"city":"Baltimore","zip":"21201"}'])
+
+    def test_control_characters_are_stripped(self):
+        self.assertEqual(flatten.clean_column([u"a\x00b", u"c\td\n", u""]),
+                         [u"ab", u"c\td\n", u""])
+        self.assertEqual(flatten.clean_column([u"x\ufffey", u"z"]), [u"xy", u"z"])
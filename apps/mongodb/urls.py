@@ -38,6 +38,8 @@ urlpatterns = patterns('',
          login_required(create_collection), name="create_collection"),
     
     #API calls ----------------------------------------------------------------
+    url(r'^api/health.json$', health_check, name="api_mongodb_health_check"),
+
     url(r'^api/database/(?P<database_name>[^/]+)/collection/(?P<collection_name>[^/]+)/clear$',
          json_login_required(clear_collection), name="api_clear_collection"), 
     
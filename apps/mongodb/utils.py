@@ -4,11 +4,13 @@
 
 from django.conf import settings
 import os, json, sys
-from pymongo import Connection, DESCENDING
-from pymongo import MongoClient
+from pymongo import DESCENDING
 from bson.objectid import ObjectId
 import csv
 from ..utils import delete_mongo, write_mongo
+from connection import get_mongo_client
+from cache import collection_changed, database_changed
+from indexes import indexes_changed
 
 
 def mongo_delete_json_util(query={}, database_name=settings.MONGO_DB_NAME,
@@ -104,8 +106,7 @@ def create_mongo_db(database_name, collection_name, initial_document):
    response_dict={}
     
    try:
-      mc =   MongoClient(host=settings.MONGO_HOST,
-                           port=settings.MONGO_PORT)
+      mc =   get_mongo_client()
         
       db          =   mc[str(database_name)]
       collection  =  db[str(collection_name)]
@@ -113,6 +114,7 @@ def create_mongo_db(database_name, collection_name, initial_document):
       d = json.loads(initial_document)
       
       myobjectid=collection.save(d)
+      collection_changed(database_name, collection_name)
         
    except:
       #error connecting to mongodb
@@ -135,7 +137,7 @@ def show_dbs():
     l=[]
     response_dict={}
     try:
-        c=   Connection(settings.MONGO_HOST, settings.MONGO_PORT)
+        c=   get_mongo_client()
         dbs = c.database_names()
         
         
@@ -166,11 +168,12 @@ def mongodb_clear_collection(dbname, collectionname):
     l=[]
     response_dict={}
     try:
-        c   =  Connection(settings.MONGO_HOST, settings.MONGO_PORT)
+        c   =  get_mongo_client()
         dbs =  c[dbname]
         dbc =  dbs[collectionname]
         
         dbc.remove({})
+        collection_changed(dbname, collectionname)
         #print "success"
         return ""
     
@@ -188,10 +191,11 @@ def mongodb_ensure_index(dbname, collectionname, keys):
     l=[]
     response_dict={}
     try:
-        c   =  Connection(settings.MONGO_HOST, settings.MONGO_PORT)
+        c   =  get_mongo_client()
         dbs =  c[dbname]
         dbc =  dbs[collectionname]
         dbc.ensure_index(keys)
+        indexes_changed(dbname, collectionname)
         #print "success"
         return ""
     
@@ -214,9 +218,10 @@ def mongodb_drop_collection(dbname, collectionname):
     l=[]
     response_dict={}
     try:
-        c=   Connection(settings.MONGO_HOST, settings.MONGO_PORT)
+        c=   get_mongo_client()
         dbs = c[dbname]
         dbs.drop_collection(collectionname)
+        collection_changed(dbname, collectionname)
         #print "success"
         return ""
     
@@ -237,8 +242,9 @@ def mongodb_drop_database(dbname):
     l=[]
     response_dict={}
     try:
-        c=   Connection(settings.MONGO_HOST, settings.MONGO_PORT)
+        c=   get_mongo_client()
         c.drop_database(dbname)
+        database_changed(dbname)
         #print "success"
         return ""
     
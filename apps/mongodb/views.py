@@ -15,6 +15,8 @@ from utils import (show_dbs, mongodb_drop_collection, mongodb_drop_database,
 
 from forms import EnsureIndexForm, DeleteForm, DocumentForm, CreateDatabaseForm
 from utils import mongo_delete_json_util, mongo_create_json_util
+from connection import mongo_health_check
+from encoding import dumps, pretty_requested
 from bson.objectid import ObjectId
 
 def showdbs(request):
@@ -26,6 +28,14 @@ def showdbs(request):
                               RequestContext(request, context,))
 
 
+def health_check(request):
+    """Report whether the pooled MongoDB client can reach the server."""
+    result = mongo_health_check()
+    results_json = dumps(result, pretty_requested(request))
+    return HttpResponse(results_json, status=int(result['code']),
+                        mimetype="application/json")
+
+
 def delete_collection(request, database_name, collection_name):
     response = mongodb_drop_collection(database_name, collection_name)
     #print response
@@ -206,7 +216,7 @@ def remove_data_from_collection(request,  database_name=settings.MONGO_DB_NAME,
                                              just_one=just_one)
             
             #convert to json and respond.
-            results_json = json.dumps(results, indent =4)
+            results_json = dumps(results, pretty_requested(request))
             return HttpResponse(results_json, status=int(results['code']),
                                     mimetype="application/json")        
         else:
@@ -252,7 +262,7 @@ def create_document_in_collection(request,
                                              collection_name=collection_name)
             
             #convert to json and respond.
-            results_json = json.dumps(results, indent = 4)
+            results_json = dumps(results, pretty_requested(request))
             return HttpResponse(results_json, status=int(results['code']),
                                     mimetype="application/json")        
         else:
@@ -295,7 +305,7 @@ def update_document_in_collection(request,  database_name=settings.MONGO_DB_NAME
                 result = { "code":    400,
                            "type":    "Error",
                            "message": "Updates must include either id or _id." }
-                results_json = json.dumps(result, indent = 4)
+                results_json = dumps(result, pretty_requested(request))
                 return HttpResponse(results_json, status=result['code'],
                                     mimetype="application/json")     
         
@@ -303,7 +313,7 @@ def update_document_in_collection(request,  database_name=settings.MONGO_DB_NAME
                 result = { "code":    400,
                            "type":    "Error",
                            "message": "Updates cannot contain both id and _id" }
-                results_json = json.dumps(result, indent = 4)
+                results_json = dumps(result, pretty_requested(request))
                 return HttpResponse(results_json, status=result[code],
                                     mimetype="application/json")     
         
@@ -321,7 +331,7 @@ def update_document_in_collection(request,  database_name=settings.MONGO_DB_NAME
                                              update=True)
             
             #convert to json and respond.
-            results_json = json.dumps(results, indent = 4)
+            results_json = dumps(results, pretty_requested(request))
             return HttpResponse(results_json, status=int(results['code']),
                                     mimetype="application/json")        
         else:
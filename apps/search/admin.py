@@ -1,5 +1,5 @@
 from django.contrib import admin
-from models import SavedSearch
+from models import SavedSearch, ExportJob
 
 
 
@@ -11,3 +11,12 @@ class SavedSearchAdmin(admin.ModelAdmin):
 
 admin.site.register(SavedSearch, SavedSearchAdmin)
 
+
+class ExportJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'output_format', 'user', 'status', 'rows_written',
+                    'total_rows', 'size', 'creation_date')
+    list_filter = ('status', 'output_format')
+
+
+admin.site.register(ExportJob, ExportJobAdmin)
+
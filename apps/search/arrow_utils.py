@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim: ai ts=4 sts=4 et sw=4
+
+"""
+    Parquet and Arrow IPC output.
+
+    Column types come from the BSON values. The key scan (stream_keys in
+    apps/utils.py) records the types of every value of every key, and
+    arrow_type() picks the Arrow type that holds them all: int64, float64,
+    bool, timestamp (BSON dates are milliseconds, UTC) or binary. Anything
+    else, including a key whose values are of mixed types, becomes a string
+    column; embedded documents and arrays are written there as compact JSON.
+
+    The schema is written before the first row, so a value that does not fit
+    its column (one written after the key scan) can't widen it. Such a
+    column's batch is converted value by value instead, and values that do
+    not fit are written as null rather than ending the file early.
+
+    Rows are read ARROW_BATCH_ROWS at a time, turned into a record batch
+    and written out before the next batch is read, so memory use does not
+    grow with the number of results. Arrow output is the IPC stream format.
+
+    pyarrow is optional. Without it these formats answer 501.
+"""
+
+from datetime import datetime
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from bson.binary import Binary
+from ..mongodb.flatten import cell_text
+from columns import get_column_plan
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+
+ARROW_FORMATS = ('parquet', 'arrow')
+
+ARROW_CONTENT_TYPES = {'parquet': "application/vnd.apache.parquet",
+                       'arrow': "application/vnd.apache.arrow.stream",
+                       }
+
+ARROW_EXTENSIONS = {'parquet': ".parquet",
+                    'arrow': ".arrows",
+                    }
+
+
+def arrow_available():
+    return pa is not None
+
+
+def _all(value_types, classes):
+    return all(issubclass(t, classes) for t in value_types)
+
+
+def arrow_type(value_types):
+    """Return the Arrow type for a column whose values have these Python
+    types."""
+    value_types = set(value_types) - set([type(None)])
+    if not value_types:
+        return pa.string()
+    if bool in value_types:
+        if value_types == set([bool]):
+            return pa.bool_()
+        return pa.string()
+    if _all(value_types, (int, long)):
+        return pa.int64()
+    if _all(value_types, (int, long, float)):
+        return pa.float64()
+    if _all(value_types, datetime):
+        return pa.timestamp('ms', tz='UTC')
+    if _all(value_types, Binary):
+        return pa.binary()
+    return pa.string()
+
+
+def arrow_schema(columns, value_types):
+    return pa.schema([pa.field(k, arrow_type(value_types.get(k, ()))) for k in columns])
+
+
+def _text(value):
+    if value is None:
+        return None
+    return cell_text(value)
+
+
+def _int(value):
+    if isinstance(value, float):
+        #a double the key scan saw as a whole number; pyarrow would quietly
+        #truncate one that isn't, so that does not fit.
+        if value.is_integer():
+            return int(value)
+        return None
+    return value
+
+
+def _float(value):
+    if not isinstance(value, (int, long, float)):
+        return value
+    return float(value)
+
+
+def _utc(value):
+    if not isinstance(value, datetime) or value.tzinfo is None:
+        return value
+    return value.replace(tzinfo=None) - value.utcoffset()
+
+
+def _binary(value):
+    if not isinstance(value, (str, Binary)):
+        return value
+    return bytes(value)
+
+
+def converter(arrow_type):
+    """Return the function that makes a value fit a column of arrow_type,
+    or None if values are used as they are."""
+    if pa.types.is_string(arrow_type):
+        return _text
+    if pa.types.is_integer(arrow_type):
+        return _int
+    if pa.types.is_floating(arrow_type):
+        return _float
+    if pa.types.is_timestamp(arrow_type):
+        return _utc
+    if pa.types.is_binary(arrow_type):
+        return _binary
+    return None
+
+
+def _fits(value, arrow_type):
+    try:
+        pa.array([value], type=arrow_type)
+    except (pa.ArrowException, TypeError, ValueError, OverflowError):
+        return False
+    return True
+
+
+def column_array(values, arrow_type):
+    """Return values as an array of arrow_type; those that don't fit it are
+    null."""
+    try:
+        return pa.array(values, type=arrow_type)
+    except (pa.ArrowException, TypeError, ValueError, OverflowError):
+        return pa.array([v if _fits(v, arrow_type) else None for v in values],
+                        type=arrow_type)
+
+
+def record_batch(schema, converters, rows):
+    arrays = []
+    for field, convert in zip(schema, converters):
+        values = [r.get(field.name) for r in rows]
+        if convert is not None:
+            values = [convert(v) for v in values]
+        arrays.append(column_array(values, field.type))
+    return pa.RecordBatch.from_arrays(arrays, [f.name for f in schema])
+
+
+class Sink(object):
+    """A file-like object that keeps what the Arrow writers write until it
+    is taken with drain()."""
+
+    closed = False
+
+    def __init__(self):
+        self.pieces = []
+        self.position = 0
+
+    def write(self, data):
+        data = bytes(data)
+        self.pieces.append(data)
+        self.position += len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = "".join(self.pieces)
+        self.pieces = []
+        return data
+
+
+def arrow_pieces(keylist, value_types, listresults, output_format,
+                 batch_rows=settings.ARROW_BATCH_ROWS, collection_name=None):
+    """Generate the bytes of a Parquet file or Arrow IPC stream of the
+    results, one batch at a time. listresults may be a cursor."""
+    columns = get_column_plan(collection_name).order(keylist)
+    schema = arrow_schema(columns, value_types)
+    converters = [converter(f.type) for f in schema]
+    sink = Sink()
+    if output_format == "parquet":
+        writer = pq.ParquetWriter(sink, schema, compression=settings.PARQUET_COMPRESSION)
+        write = lambda batch: writer.write_table(pa.Table.from_batches([batch]))
+    else:
+        writer = pa.RecordBatchStreamWriter(sink, schema)
+        write = writer.write_batch
+    try:
+        rows = []
+        for d in listresults:
+            rows.append(d)
+            if len(rows) >= batch_rows:
+                write(record_batch(schema, converters, rows))
+                rows = []
+                yield sink.drain()
+        if rows:
+            write(record_batch(schema, converters, rows))
+        writer.close()
+        yield sink.drain()
+    finally:
+        if hasattr(listresults, 'close'):
+            listresults.close()
+
+
+def arrow_response(keylist, value_types, listresults, output_format, collection_name=None):
+    filename = datetime.now().strftime('%m-%d-%Y_%H:%M:%S') + ARROW_EXTENSIONS[output_format]
+    response = StreamingHttpResponse(arrow_pieces(keylist, value_types, listresults,
+                                                  output_format,
+                                                  collection_name=collection_name),
+                                     content_type=ARROW_CONTENT_TYPES[output_format])
+    response['Content-Disposition'] = 'attachment; filename=' + filename
+    return response
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim: ai ts=4 sts=4 et sw=4
+
+"""
+    Column plans for tabular output.
+
+    A ColumnPlan holds what is needed to lay out the columns of a
+    collection's results:
+    - the key catalog (the <collection>_keys collection made by build_keys,
+      ordered by SORTCOLUMNS) when SORTCOLUMNS is set;
+    - ALPHABETIZE_COLUMNS;
+    - the data dictionary labels when OTHER_LABELS is set.
+    It turns a list of result keys into output order with a single sort.
+    Catalog keys come first, in catalog order. The rest keep their order,
+    or are alphabetized. Dotted paths to nested values sort with their
+    top-level key.
+
+    One plan is kept per collection. It is rebuilt when the catalog or the
+    labels collection is written to (see apps/mongodb/cache.py) or after
+    COLUMN_PLAN_TTL seconds, since other processes' writes are only seen
+    through a shared cache.
+"""
+
+import threading, time
+from django.conf import settings
+from ..utils import get_collection_keys, get_collection_labels
+from ..mongodb.cache import generation_key
+
+
+#Orders remembered per plan, keyed by the key list.
+MAX_CACHED_ORDERS = 100
+
+_plans = {}
+_plans_lock = threading.Lock()
+
+
+class ColumnPlan(object):
+
+    def __init__(self, catalog=(), labels=None):
+        self.catalog = list(catalog)
+        self.labels = labels or {}
+        self.rank = {}
+        for i, k in enumerate(self.catalog):
+            self.rank.setdefault(k, i)
+        self._orders = {}
+
+    def _sort_key(self, keylist):
+        unranked = len(self.catalog)
+        def key(i):
+            k = keylist[i]
+            rank = self.rank.get(k)
+            if rank is None:
+                rank = self.rank.get(k.split('.')[0], unranked)
+            if settings.ALPHABETIZE_COLUMNS:
+                return (rank, k)
+            return (rank, i)
+        return key
+
+    def permutation(self, keylist):
+        """Return the indexes of keylist in output order."""
+        keylist = tuple(keylist)
+        order = self._orders.get(keylist)
+        if order is None:
+            order = sorted(range(len(keylist)), key=self._sort_key(keylist))
+            if len(self._orders) >= MAX_CACHED_ORDERS:
+                self._orders.clear()
+            self._orders[keylist] = order
+        return order
+
+    def order(self, keylist):
+        """Return keylist in output order."""
+        return [keylist[i] for i in self.permutation(keylist)]
+
+    def headers(self, columns):
+        """Return the header row for columns already in output order."""
+        if not self.labels:
+            return list(columns)
+        return [self.labels.get(c, c) for c in columns]
+
+
+def _generations(collection_name):
+    generations = [generation_key(settings.MONGO_DB_NAME, "%s_keys" % (collection_name))]
+    if settings.OTHER_LABELS:
+        generations.append(generation_key(settings.MONGO_DB_NAME,
+                                          settings.MONGO_MASTER_LABELS_COLLECTION))
+    return tuple(generations)
+
+
+def get_column_plan(collection_name=None):
+    """Return the column plan of a collection (default the master one)."""
+    collection_name = collection_name or settings.MONGO_MASTER_COLLECTION
+    generations = _generations(collection_name)
+    entry = _plans.get(collection_name)
+    if entry is not None and entry[0] == generations and entry[1] > time.time():
+        return entry[2]
+
+    catalog = ()
+    if settings.SORTCOLUMNS:
+        catalog = get_collection_keys(collection_name)
+    labels = None
+    if settings.OTHER_LABELS:
+        labels = get_collection_labels()
+    plan = ColumnPlan(catalog, labels)
+    with _plans_lock:
+        _plans[collection_name] = (generations, time.time() + settings.COLUMN_PLAN_TTL,
+                                   plan)
+    return plan
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim: ai ts=4 sts=4 et sw=4
+
+"""
+    Compression of search and export responses.
+
+    Views decorated with compressed() have their response body compressed
+    while it streams, when the client's Accept-Encoding allows it. zstd and
+    brotli are used when their modules (zstandard, brotli) are installed
+    and the client accepts them, otherwise gzip. Levels come from
+    RESPONSE_COMPRESSION_LEVELS.
+
+    Bodies shorter than RESPONSE_COMPRESSION_MIN_SIZE bytes are sent as they
+    are. For a streamed body only that much is read ahead to decide.
+
+    These are left alone:
+    - formats that are already compressed (XLSX, Parquet);
+    - partial content;
+    - responses that already have a Content-Encoding, so a view that
+      returns another decorated view's response is only compressed once.
+"""
+
+import zlib
+from functools import wraps
+from itertools import chain
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "application/xml",
+                      "application/vnd.apache.arrow.stream")
+
+
+def _gzip(level):
+    c = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return c.compress, c.flush
+
+
+def _brotli(level):
+    c = brotli.Compressor(quality=level)
+    return c.process, c.finish
+
+
+def _zstd(level):
+    c = zstandard.ZstdCompressor(level=level).compressobj()
+    return c.compress, c.flush
+
+
+#In order of preference.
+ENCODINGS = []
+if zstandard is not None:
+    ENCODINGS.append(("zstd", _zstd))
+if brotli is not None:
+    ENCODINGS.append(("br", _brotli))
+ENCODINGS.append(("gzip", _gzip))
+
+#Used for an encoding missing from RESPONSE_COMPRESSION_LEVELS.
+DEFAULT_LEVELS = {"gzip": 6, "br": 4, "zstd": 3}
+
+
+def compressible(content_type):
+    content_type = content_type.split(';')[0].strip().lower()
+    return content_type.startswith("text/") or content_type in COMPRESSIBLE_TYPES
+
+
+def negotiate(accept_encoding):
+    """Return the name of the encoding to use for an Accept-Encoding header,
+    or None. The client's highest q-value wins; ties go to the preferred
+    encoding. * only stands for gzip."""
+    accepted = {}
+    for part in accept_encoding.split(','):
+        name, sep, params = part.partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for p in params.split(';'):
+            k, sep, v = p.strip().partition('=')
+            if k == 'q':
+                try:
+                    q = float(v)
+                except ValueError:
+                    q = 0.0
+        accepted[name] = q
+    best = None
+    for name, factory in ENCODINGS:
+        q = accepted.get(name)
+        if q is None and name == "gzip":
+            q = accepted.get("*")
+        if q and (best is None or q > best[0]):
+            best = (q, name)
+    if best is None:
+        return None
+    return best[1]
+
+
+def _compressor(encoding):
+    level = settings.RESPONSE_COMPRESSION_LEVELS.get(encoding, DEFAULT_LEVELS[encoding])
+    return dict(ENCODINGS)[encoding](level)
+
+
+def compress_sequence(pieces, encoding):
+    """Compress an iterable of byte strings as it is read."""
+    compress, finish = _compressor(encoding)
+    for piece in pieces:
+        data = compress(piece)
+        if data:
+            yield data
+    yield finish()
+
+
+def _read_ahead(pieces, size):
+    """Return (the pieces read, whether pieces ran out) after reading at
+    least size bytes."""
+    head = []
+    read = 0
+    for piece in pieces:
+        head.append(piece)
+        read += len(piece)
+        if read >= size:
+            return head, False
+    return head, True
+
+
+def compress_response(request, response):
+    """Compress response in place for request's Accept-Encoding, if worth
+    it, and return it."""
+    if not settings.RESPONSE_COMPRESSION or \
+       not compressible(response.get('Content-Type', '')):
+        return response
+    patch_vary_headers(response, ('Accept-Encoding',))
+    if response.status_code != 200 or response.has_header('Content-Encoding'):
+        return response
+    encoding = negotiate(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+    if encoding is None:
+        return response
+
+    if response.streaming:
+        pieces = iter(response.streaming_content)
+        head, finished = _read_ahead(pieces, settings.RESPONSE_COMPRESSION_MIN_SIZE)
+        if finished:
+            response.streaming_content = head
+            return response
+        response.streaming_content = compress_sequence(chain(head, pieces), encoding)
+        if response.has_header('Content-Length'):
+            del response['Content-Length']
+    else:
+        if len(response.content) < settings.RESPONSE_COMPRESSION_MIN_SIZE:
+            return response
+        compress, finish = _compressor(encoding)
+        content = compress(response.content) + finish()
+        if len(content) >= len(response.content):
+            return response
+        response.content = content
+        response['Content-Length'] = str(len(content))
+
+    response['Content-Encoding'] = encoding
+    if response.has_header('Accept-Ranges'):
+        #byte ranges would be of the compressed body
+        del response['Accept-Ranges']
+    etag = response.get('ETag')
+    if etag and etag.endswith('"'):
+        response['ETag'] = '%s-%s"' % (etag[:-1], encoding)
+    return response
+
+
+def compressed(view):
+    """Decorate a view so its response is compressed (see above)."""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        return compress_response(request, view(request, *args, **kwargs))
+    return wrapper
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim: ai ts=4 sts=4 et sw=4
+
+"""
+    Conditional GET for searches.
+
+    A search view decorated with conditional_search() sends an ETag built
+    from the collection's write generation (see apps/mongodb/cache.py), the
+    view, its arguments and the GET parameters. A request whose
+    If-None-Match holds that ETag gets 304 Not Modified before any query
+    runs. Saved searches, custom reports and the like call the search
+    views, so their arguments (the saved query, sort, ...) are part of it.
+
+    Without a shared SEARCH_CACHE_BACKEND, generations are per process and
+    don't see other processes' writes, so an ETag is then only honoured for
+    SEARCH_ETAG_TTL seconds. With RESPECT_SOCIAL_GRAPH results depend on
+    who asks, so the users sharing with the requester are part of it too.
+"""
+
+import inspect, hashlib, time
+from functools import wraps
+from django.conf import settings
+from django.http import HttpResponseNotModified
+from ..mongodb.cache import result_cache_key, shared_cache
+from ..utils import social_graph_subjects
+from compression import ENCODINGS
+
+
+def search_etag(request, view_name, callargs):
+    database_name = callargs.get('database_name', settings.MONGO_DB_NAME)
+    collection_name = callargs.get('collection_name', settings.MONGO_MASTER_COLLECTION)
+    arguments = sorted((k, v) for k, v in callargs.items()
+                       if k not in ('request', 'database_name', 'collection_name'))
+    params = sorted((k, request.GET.getlist(k)) for k in request.GET.keys())
+    parts = [view_name, arguments, params]
+    if settings.RESPECT_SOCIAL_GRAPH:
+        parts.append(social_graph_subjects(request))
+    if shared_cache() is None:
+        parts.append(int(time.time() / settings.SEARCH_ETAG_TTL))
+    key = result_cache_key(database_name, collection_name, *parts)
+    return '"%s"' % (hashlib.sha1(key).hexdigest())
+
+
+def _base_tag(tag):
+    #compress_response() adds the encoding to the tag
+    tag = tag.strip()
+    if tag.startswith('W/'):
+        tag = tag[2:]
+    for name, factory in ENCODINGS:
+        suffix = '-%s"' % (name)
+        if tag.endswith(suffix):
+            return tag[:-len(suffix)] + '"'
+    return tag
+
+
+def etag_matches(request, etag):
+    header = request.META.get('HTTP_IF_NONE_MATCH')
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    return etag in [_base_tag(t) for t in header.split(',')]
+
+
+def conditional_search(view):
+    """Decorate a search view with ETag / If-None-Match support."""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not settings.SEARCH_ETAGS or request.method not in ('GET', 'HEAD'):
+            return view(request, *args, **kwargs)
+        etag = search_etag(request, view.__name__,
+                           inspect.getcallargs(view, request, *args, **kwargs))
+        if etag_matches(request, etag):
+            response = HttpResponseNotModified()
+            response['ETag'] = etag
+            return response
+        response = view(request, *args, **kwargs)
+        if response.status_code == 200 and not response.has_header('ETag'):
+            response['ETag'] = etag
+        return response
+    return wrapper
@@ -0,0 +1,339 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim: ai ts=4 sts=4 et sw=4
+
+"""
+    Background export jobs.
+
+    submit_export() records an ExportJob and hands its id to a pool of
+    EXPORT_WORKERS threads in this process. A worker streams the search from
+    the cursor into a file under EXPORT_ROOT, updating rows_written as it
+    goes; the file is only served to its owner, by artifact_response(). With
+    EXPORT_WORKERS = 0 jobs stay queued until "manage.py run_export_jobs"
+    picks them up.
+
+    Queued ids only live in the process that queued them, so workers that
+    start queue every job still waiting in the database, and a job asked for
+    again is queued again; claiming a job is atomic, so each runs once. A
+    running job also records a heartbeat; one not heard from for
+    EXPORT_STALE_SECONDS lost its worker to a restart or crash and is marked
+    failed rather than handed out forever.
+
+    A job's cache_key covers the user, the search and the generation of the
+    collection (see apps/mongodb/cache.py), so the same user asking again for
+    the same export before the collection is written to gets the existing job
+    and its file.
+"""
+
+import os, re, sys, json, time, Queue, threading
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.db import connection
+from django.http import HttpResponse, StreamingHttpResponse
+from bson import json_util
+from ..utils import (query_mongo_stream, stream_json, stream_ndjson, chunk_output,
+                     social_graph_query, social_graph_subjects)
+from ..mongodb.cache import result_cache_key
+from xls_utils import stream_csv_rows, stream_html_rows, excelify, xls_rows, XLSX_CONTENT_TYPE
+from arrow_utils import (arrow_available, arrow_pieces, ARROW_FORMATS,
+                         ARROW_CONTENT_TYPES, ARROW_EXTENSIONS)
+from models import ExportJob
+
+
+EXPORT_CONTENT_TYPES = {'csv': "text/csv",
+                        'xlsx': XLSX_CONTENT_TYPE,
+                        'json': "application/json",
+                        'html': "text/html; charset=utf-8",
+                        'ndjson': "application/x-ndjson",
+                        }
+EXPORT_CONTENT_TYPES.update(ARROW_CONTENT_TYPES)
+
+#rows_written is saved after this many rows, or this many seconds
+PROGRESS_EVERY = 1000
+HEARTBEAT_EVERY = 30
+
+_queue = Queue.Queue()
+_workers = []
+_workers_pid = None
+_workers_lock = threading.Lock()
+
+
+class ExportError(Exception):
+    pass
+
+
+def export_cache_key(user, output_format, database_name, collection_name, query,
+                     sort, return_keys, skip, limit):
+    #a job is only shown to the user who asked for it, so each gets their own
+    parts = ["export", output_format, query, sort, sorted(return_keys), skip, limit,
+             user.pk]
+    if settings.RESPECT_SOCIAL_GRAPH:
+        #rows are filtered for the user, and the file is made again once who
+        #shares with them changes.
+        parts.append(social_graph_subjects(_JobRequest(user)))
+    return result_cache_key(database_name, collection_name, *parts)
+
+
+def artifact_path(job):
+    if not job.artifact:
+        return None
+    return os.path.join(settings.EXPORT_ROOT, job.artifact)
+
+
+def submit_export(user, output_format, database_name, collection_name, query={},
+                  sort=None, return_keys=(), skip=0, limit=0, saved_search=None):
+    """Return (job, created). An unfinished or finished job for the same
+    export against the same collection generation is returned instead of
+    starting a new one."""
+    key = export_cache_key(user, output_format, database_name, collection_name,
+                           query, sort, return_keys, skip, limit)
+    fail_orphaned_jobs(cache_key=key)
+    for job in ExportJob.objects.filter(cache_key=key,
+                                        status__in=("queued", "running", "complete")):
+        if job.status == "queued":
+            #its id may have been lost with the process that queued it
+            _enqueue(job.pk)
+            return job, False
+        if job.status == "running" or os.path.exists(artifact_path(job) or ""):
+            return job, False
+
+    job = ExportJob.objects.create(user=user, saved_search=saved_search,
+                                   output_format=output_format,
+                                   database_name=database_name,
+                                   collection_name=collection_name,
+                                   query=json_util.dumps(query),
+                                   sort=json.dumps(sort) if sort else "",
+                                   return_keys=" ".join(return_keys),
+                                   skip=skip, limit=limit, cache_key=key)
+    _enqueue(job.pk)
+    return job, True
+
+
+def fail_orphaned_jobs(**filters):
+    """Mark failed the running jobs (those matching filters) whose worker has
+    not been heard from for EXPORT_STALE_SECONDS. Return how many."""
+    now = datetime.now()
+    cutoff = now - timedelta(seconds=settings.EXPORT_STALE_SECONDS)
+    return ExportJob.objects.filter(status="running", heartbeat__lt=cutoff, **filters).update(
+        status="failed", finished=now,
+        message="The export stopped when its worker did. Ask for it again.")
+
+
+def _enqueue(job_id):
+    if settings.EXPORT_WORKERS:
+        _start_workers()
+        _queue.put(job_id)
+
+
+def _start_workers():
+    global _queue, _workers_pid
+    with _workers_lock:
+        if _workers_pid == os.getpid():
+            return
+        #threads and queued ids do not survive a fork
+        _queue = Queue.Queue()
+        _workers_pid = os.getpid()
+        del _workers[:]
+        for i in range(settings.EXPORT_WORKERS):
+            t = threading.Thread(target=_worker, name="flangio-export-%s" % (i))
+            t.daemon = True
+            t.start()
+            _workers.append(t)
+        #pick up what a previous process left behind
+        fail_orphaned_jobs()
+        for job_id in ExportJob.objects.filter(status="queued").order_by(
+                'creation_date').values_list('pk', flat=True):
+            _queue.put(job_id)
+
+
+def _worker():
+    while True:
+        job_id = _queue.get()
+        try:
+            run_export(job_id)
+        except:
+            print "Error running export job %s" % (job_id)
+            print str(sys.exc_info())
+        finally:
+            connection.close()
+
+
+def _counted(job, results):
+    n = 0
+    beat = time.time()
+    for d in results:
+        n += 1
+        if n % PROGRESS_EVERY == 0 or time.time() - beat >= HEARTBEAT_EVERY:
+            ExportJob.objects.filter(pk=job.pk).update(rows_written=n,
+                                                       heartbeat=datetime.now())
+            beat = time.time()
+        yield d
+    ExportJob.objects.filter(pk=job.pk).update(rows_written=n, heartbeat=datetime.now())
+
+
+class _JobRequest(object):
+    """Just enough of a request for social_graph_query."""
+    def __init__(self, user):
+        self.user = user
+
+
+def write_export(job, f):
+    """Write the job's search to the open file f."""
+    sort = None
+    if job.sort:
+        sort = json.loads(job.sort)
+    if job.output_format in ARROW_FORMATS and not arrow_available():
+        raise ExportError("Parquet and Arrow output need the pyarrow package.")
+    query = json_util.loads(job.query)
+    if settings.RESPECT_SOCIAL_GRAPH:
+        query = social_graph_query(_JobRequest(job.user), query)
+    result = query_mongo_stream(query, job.database_name,
+                                job.collection_name, skip=job.skip, sort=sort,
+                                limit=job.limit, return_keys=job.return_keys.split(),
+                                max_time_ms=settings.EXPORT_TIME_LIMIT_MS,
+                                scan_keys=job.output_format not in ("json", "ndjson"),
+                                scan_types=job.output_format in ARROW_FORMATS)
+    if int(result['code']) != 200:
+        raise ExportError(result.get('message', "The search failed."))
+
+    total = result['num_results']
+    if total is not None:
+        total = max(total - job.skip, 0)
+        if job.limit:
+            total = min(total, job.limit)
+    ExportJob.objects.filter(pk=job.pk).update(total_rows=total, heartbeat=datetime.now())
+
+    result['results'] = results = _counted(job, result['results'])
+
+    if job.output_format == "csv":
+        pieces = chunk_output(stream_csv_rows(result['keys'], results, job.collection_name))
+    elif job.output_format == "html":
+        pieces = chunk_output(stream_html_rows(result['keys'], results,
+                                               collection_name=job.collection_name))
+    elif job.output_format == "json":
+        pieces = stream_json(result)
+    elif job.output_format == "ndjson":
+        pieces = stream_ndjson(results)
+    elif job.output_format in ARROW_FORMATS:
+        pieces = arrow_pieces(result['keys'], result['types'], results, job.output_format,
+                              collection_name=job.collection_name)
+    elif job.output_format == "xlsx":
+        pieces = ()
+        header, rows = xls_rows(result['keys'], results, job.collection_name)
+        excelify(rows, f, header=header)
+    else:
+        raise ExportError("Unknown export format %s." % (job.output_format))
+
+    for piece in pieces:
+        if isinstance(piece, unicode):
+            piece = piece.encode("utf-8")
+        f.write(piece)
+
+    if result.get('error'):
+        raise ExportError(result['error']['message'])
+
+
+def run_export(job_id):
+    """Run a queued job. Return False if another worker already claimed it."""
+    now = datetime.now()
+    claimed = ExportJob.objects.filter(pk=job_id, status="queued").update(
+        status="running", started=now, heartbeat=now)
+    if not claimed:
+        return False
+    job = ExportJob.objects.get(pk=job_id)
+
+    name = "%s-%s%s" % (job.pk, job.cache_key.split(':')[-1][:12],
+                        ARROW_EXTENSIONS.get(job.output_format, "." + job.output_format))
+    path = os.path.join(settings.EXPORT_ROOT, name)
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    partial = path + ".part"
+    try:
+        f = open(partial, "wb")
+        try:
+            write_export(job, f)
+        finally:
+            f.close()
+        os.rename(partial, path)
+        ExportJob.objects.filter(pk=job.pk).update(status="complete", artifact=name,
+                                                   size=os.path.getsize(path),
+                                                   finished=datetime.now())
+    except:
+        if os.path.exists(partial):
+            os.remove(partial)
+        ExportJob.objects.filter(pk=job.pk).update(status="failed",
+                                                   message=str(sys.exc_info()[1]),
+                                                   finished=datetime.now())
+    return True
+
+
+def export_status(job):
+    """Return a response_dict describing a job."""
+    response_dict = {}
+    response_dict['code'] = 200
+    response_dict['type'] = "export-job"
+    response_dict['id'] = job.pk
+    response_dict['status'] = job.status
+    response_dict['output_format'] = job.output_format
+    response_dict['rows_written'] = job.rows_written
+    response_dict['total_rows'] = job.total_rows
+    response_dict['size'] = job.size
+    response_dict['created'] = job.creation_date
+    response_dict['finished'] = job.finished
+    if job.message:
+        response_dict['message'] = job.message
+    return response_dict
+
+
+_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def _read_file(path, start, length, block_size=65536):
+    f = open(path, "rb")
+    try:
+        f.seek(start)
+        while length > 0:
+            data = f.read(min(block_size, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+    finally:
+        f.close()
+
+
+def artifact_response(request, job):
+    """Serve a finished job's file. A single byte range (Range: bytes=a-b)
+    is answered with 206 Partial Content so downloads can resume."""
+    path = artifact_path(job)
+    size = os.path.getsize(path)
+    etag = '"%s-%s"' % (job.cache_key.split(':')[-1][:12], size)
+    start, end = 0, size - 1
+    status = 200
+
+    range_header = request.META.get('HTTP_RANGE', '').strip()
+    if_range = request.META.get('HTTP_IF_RANGE')
+    m = _RANGE.match(range_header)
+    if m and (m.group(1) or m.group(2)) and (not if_range or if_range == etag):
+        if m.group(1):
+            start = int(m.group(1))
+            if m.group(2):
+                end = min(int(m.group(2)), size - 1)
+        else:
+            #bytes=-n is the last n bytes
+            start = max(size - int(m.group(2)), 0)
+        if start >= size or start > end:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = "bytes */%s" % (size)
+            return response
+        status = 206
+
+    response = StreamingHttpResponse(_read_file(path, start, end - start + 1), status=status,
+                                     content_type=EXPORT_CONTENT_TYPES[job.output_format])
+    response['Content-Length'] = end - start + 1
+    response['Accept-Ranges'] = "bytes"
+    response['ETag'] = etag
+    response['Content-Disposition'] = 'attachment; filename=' + os.path.basename(path)
+    if status == 206:
+        response['Content-Range'] = "bytes %s-%s/%s" % (start, end, size)
+    return response
@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim: ai ts=4 sts=4 et sw=4
+
+import time
+from optparse import make_option
+from django.core.management.base import BaseCommand
+from ...models import ExportJob
+from ...exports import run_export, fail_orphaned_jobs
+
+
+class Command(BaseCommand):
+    help = "Run queued export jobs. Use this when EXPORT_WORKERS is 0, or to finish jobs left queued by a restart."
+
+    option_list = BaseCommand.option_list + (
+        make_option('--loop', action='store_true', default=False,
+                    help='Keep polling for new jobs instead of exiting when none are left.'),
+        make_option('--interval', type='int', default=5,
+                    help='Seconds between polls with --loop.'),
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            failed = fail_orphaned_jobs()
+            if failed:
+                self.stdout.write("Marked %s orphaned export jobs failed" % (failed))
+            ran = 0
+            for job_id in ExportJob.objects.filter(status="queued").order_by(
+                    'creation_date').values_list('pk', flat=True):
+                if run_export(job_id):
+                    ran += 1
+                    self.stdout.write("Ran export job %s" % (job_id))
+            if not options['loop']:
+                break
+            if not ran:
+                time.sleep(options['interval'])
@@ -7,12 +7,16 @@ from django.template.defaultfilters import slugify
 OUTPUT_CHOICES = (("json","JSON"),
                   ("html", "HTML"),
                   ("csv","Comma Seperated Value (.csv)"),
+                  ("xml","XML"),
+                  ("ndjson","Newline Delimited JSON (.ndjson)"),
+                  ("parquet","Parquet (.parquet)"),
+                  ("arrow","Arrow IPC stream (.arrows)"),
                   )
 
 class SavedSearch(models.Model):
 
     user            = models.ForeignKey(settings.AUTH_USER_MODEL)
-    output_format   = models.CharField(max_length=4, choices=OUTPUT_CHOICES,
+    output_format   = models.CharField(max_length=7, choices=OUTPUT_CHOICES,
                                         default="json")
     title           = models.CharField(max_length=100, unique=True)
     slug            = models.SlugField(max_length=100, unique=True)
@@ -52,3 +56,63 @@ class SavedSearch(models.Model):
             self.slug = slugify(self.title)
         super(SavedSearch, self).save(**kwargs)
 
+
+
+
+EXPORT_FORMAT_CHOICES = (("csv", "Comma Seperated Value (.csv)"),
+                         ("xlsx", "Excel (.xlsx)"),
+                         ("json", "JSON"),
+                         ("html", "HTML"),
+                         ("ndjson", "Newline Delimited JSON (.ndjson)"),
+                         ("parquet", "Parquet (.parquet)"),
+                         ("arrow", "Arrow IPC stream (.arrows)"),
+                         )
+
+EXPORT_STATUS_CHOICES = (("queued", "Queued"),
+                         ("running", "Running"),
+                         ("complete", "Complete"),
+                         ("failed", "Failed"),
+                         )
+
+class ExportJob(models.Model):
+    """A search exported to a file under EXPORT_ROOT by a background worker."""
+
+    user            = models.ForeignKey(settings.AUTH_USER_MODEL)
+    saved_search    = models.ForeignKey(SavedSearch, null=True, blank=True,
+                                        on_delete=models.SET_NULL)
+    output_format   = models.CharField(max_length=7, choices=EXPORT_FORMAT_CHOICES,
+                                        default="csv")
+    database_name   = models.CharField(max_length=100,
+                        default = settings.MONGO_DB_NAME)
+    collection_name = models.CharField(max_length=100,
+                        default =settings.MONGO_MASTER_COLLECTION)
+    query           = models.TextField(default="{}", verbose_name="JSON Query Dict")
+    sort            = models.TextField(default="", blank=True)
+    return_keys     = models.TextField(default="", blank=True)
+    skip            = models.IntegerField(default=0)
+    limit           = models.IntegerField(default=0,
+                            help_text = "0 exports every matching document.")
+    #Identifies the query and the collection generation it ran against, so
+    #an unchanged collection can reuse the artifact.
+    cache_key       = models.CharField(max_length=200, db_index=True)
+    status          = models.CharField(max_length=10, choices=EXPORT_STATUS_CHOICES,
+                                        default="queued")
+    rows_written    = models.IntegerField(default=0)
+    total_rows      = models.IntegerField(null=True, blank=True)
+    #The file's name under EXPORT_ROOT.
+    artifact        = models.CharField(max_length=255, blank=True)
+    size            = models.BigIntegerField(default=0)
+    message         = models.TextField(default="", blank=True)
+    creation_date   = models.DateTimeField(auto_now_add=True)
+    started         = models.DateTimeField(null=True, blank=True)
+    #Touched by the worker running the job as it writes; a running job not
+    #touched for EXPORT_STALE_SECONDS has lost its worker.
+    heartbeat       = models.DateTimeField(null=True, blank=True)
+    finished        = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        get_latest_by = "creation_date"
+        ordering = ('-creation_date',)
+
+    def __unicode__(self):
+        return "%s export %s (%s)" % (self.output_format, self.pk, self.status)
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim: ai ts=4 sts=4 et sw=4
+
+import unittest
+from datetime import datetime
+from django.test import TestCase
+from .arrow_utils import arrow_available, arrow_pieces
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+
+@unittest.skipUnless(arrow_available(), "pyarrow is not installed")
+class ArrowOutputTest(TestCase):
+
+    def columns(self, keys, value_types, rows, output_format="parquet"):
+        data = "".join(arrow_pieces(keys, value_types, iter(rows), output_format,
+                                    batch_rows=500))
+        if output_format == "parquet":
+            table = pq.read_table(pa.BufferReader(data))
+        else:
+            table = pa.ipc.open_stream(pa.BufferReader(data)).read_all()
+        #timestamps as milliseconds, which need no time zone database
+        return dict((f.name, c.cast(pa.int64()).to_pylist()
+                     if pa.types.is_timestamp(f.type) else c.to_pylist())
+                    for f, c in zip(table.schema, table.columns))
+
+    def test_types_changing_after_the_first_rows(self):
+        #as the key scan finds them across every row
+        value_types = {'n': set([int, float]), 's': set([int, unicode])}
+        rows = [{'n': i, 's': i} for i in range(1000)] + [{'n': 0.5, 's': u"x"}]
+        for output_format in ("parquet", "arrow"):
+            columns = self.columns(["n", "s"], value_types, rows, output_format)
+            self.assertEqual(columns['n'][-2:], [999.0, 0.5])
+            self.assertEqual(columns['s'][-2:], [u"999", u"x"])
+
+    def test_values_that_no_longer_fit_are_null(self):
+        #written after the key scan: the schema can't change any more
+        value_types = {'n': set([int]), 'd': set([datetime])}
+        when = datetime(2014, 1, 2, 3, 4, 5)
+        millis = 1388631845000
+        rows = [{'n': 1, 'd': when}] * 600 + [{'n': 2.0, 'd': u"soon"},
+                                              {'n': 2.5, 'd': when},
+                                              {'n': u"x", 'd': None}]
+        columns = self.columns(["n", "d"], value_types, rows)
+        self.assertEqual(len(columns['n']), 603)
+        self.assertEqual(columns['n'][-4:], [1, 2, None, None])
+        self.assertEqual(columns['d'][-4:], [millis, None, millis, None])
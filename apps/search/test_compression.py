@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim: ai ts=4 sts=4 et sw=4
+
+import zlib
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.http import HttpResponse, StreamingHttpResponse
+from .compression import negotiate, compressed, ENCODINGS
+
+
+BODY = '{"results": [%s]}' % (", ".join(['{"n": %s}' % (i) for i in range(100)]))
+
+
+def gunzip(data):
+    return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+
+
+class NegotiateTest(TestCase):
+
+    def test_nothing_acceptable(self):
+        for header in ("", "identity", "gzip;q=0", "*;q=0", "gzip;q=x", "compress"):
+            self.assertEqual(negotiate(header), None, header)
+
+    def test_gzip_and_star(self):
+        self.assertEqual(negotiate("gzip"), "gzip")
+        self.assertEqual(negotiate(" GZIP ; q=0.5"), "gzip")
+        self.assertEqual(negotiate("*"), "gzip")
+        self.assertEqual(negotiate("*, gzip;q=0"), None)
+
+    def test_identity_refused(self):
+        #identity;q=0 only says the body must be encoded
+        self.assertEqual(negotiate("identity;q=0"), None)
+        self.assertEqual(negotiate("gzip, identity;q=0"), "gzip")
+        self.assertEqual(negotiate("identity;q=0, *"), "gzip")
+
+    def test_highest_q_value_wins(self):
+        names = [name for name, factory in ENCODINGS]
+        self.assertEqual(negotiate(", ".join(names)), names[0])
+        for name in names:
+            header = ", ".join(["%s;q=0.8" % (name)] +
+                               ["%s;q=0.5" % (n) for n in names if n != name])
+            self.assertEqual(negotiate(header), name)
+        self.assertEqual(negotiate("gzip;q=0.9, unknown"), "gzip")
+
+
+class CompressedTest(TestCase):
+
+    def setUp(self):
+        self.settings_override = self.settings(RESPONSE_COMPRESSION=True,
+                                               RESPONSE_COMPRESSION_MIN_SIZE=100)
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+
+    def get(self, response, accept_encoding="gzip"):
+        request = RequestFactory().get("/", HTTP_ACCEPT_ENCODING=accept_encoding)
+        return compressed(lambda request: response)(request)
+
+    def content(self, response):
+        if response.streaming:
+            return "".join(response.streaming_content)
+        return response.content
+
+    def test_body_is_gzipped(self):
+        response = HttpResponse(BODY, content_type="application/json")
+        response['ETag'] = '"abc"'
+        response['Accept-Ranges'] = "bytes"
+        response = self.get(response)
+        self.assertEqual(response['Content-Encoding'], "gzip")
+        self.assertEqual(response['Vary'], "Accept-Encoding")
+        self.assertEqual(gunzip(response.content), BODY)
+        self.assertEqual(response['Content-Length'], str(len(response.content)))
+        self.assertEqual(response['ETag'], '"abc-gzip"')
+        self.assertFalse(response.has_header('Accept-Ranges'))
+
+    def test_streamed_body_is_gzipped(self):
+        pieces = [BODY[i:i + 10] for i in range(0, len(BODY), 10)]
+        response = StreamingHttpResponse(iter(pieces), content_type="text/csv")
+        response['Content-Length'] = str(len(BODY))
+        response = self.get(response)
+        self.assertEqual(response['Content-Encoding'], "gzip")
+        self.assertFalse(response.has_header('Content-Length'))
+        self.assertEqual(gunzip(self.content(response)), BODY)
+
+    def test_short_bodies_are_left_alone(self):
+        response = self.get(HttpResponse(BODY[:99], content_type="application/json"))
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(response.content, BODY[:99])
+
+    def test_short_streamed_body_is_left_alone(self):
+        response = StreamingHttpResponse(iter([BODY[:50], BODY[50:99]]),
+                                         content_type="application/json")
+        response = self.get(response)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(self.content(response), BODY[:99])
+        self.assertEqual(response['Vary'], "Accept-Encoding")
+
+    def test_only_200_is_compressed(self):
+        for status in (206, 304, 400, 404):
+            response = HttpResponse(BODY, content_type="application/json", status=status)
+            response['ETag'] = '"abc"'
+            response = self.get(response)
+            self.assertFalse(response.has_header('Content-Encoding'))
+            self.assertEqual(response.content, BODY)
+            self.assertEqual(response['ETag'], '"abc"')
+            self.assertEqual(response['Vary'], "Accept-Encoding")
+
+    def test_compressed_formats_are_left_alone(self):
+        for content_type in ("application/octet-stream", "application/vnd.apache.parquet",
+                             "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"):
+            response = self.get(HttpResponse(BODY, content_type=content_type))
+            self.assertFalse(response.has_header('Content-Encoding'))
+            self.assertFalse(response.has_header('Vary'))
+            self.assertEqual(response.content, BODY)
+
+    def test_already_encoded_or_not_accepted(self):
+        response = HttpResponse(BODY, content_type="application/json")
+        response['Content-Encoding'] = "br"
+        self.assertEqual(self.get(response).content, BODY)
+        response = self.get(HttpResponse(BODY, content_type="application/json"),
+                            accept_encoding="identity")
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(response.content, BODY)
+
+    def test_turned_off(self):
+        with self.settings(RESPONSE_COMPRESSION=False):
+            response = self.get(HttpResponse(BODY, content_type="application/json"))
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertFalse(response.has_header('Vary'))
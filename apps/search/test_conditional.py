@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim: ai ts=4 sts=4 et sw=4
+
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.http import HttpResponse
+from ..mongodb.cache import collection_changed
+from .conditional import conditional_search
+
+
+calls = []
+
+
+@conditional_search
+def search_view(request, database_name="db", collection_name="c", limit=10):
+    calls.append(request)
+    if request.GET.get('fail'):
+        return HttpResponse("{}", content_type="application/json", status=400)
+    return HttpResponse("[]", content_type="application/json")
+
+
+class ConditionalSearchTest(TestCase):
+
+    def setUp(self):
+        del calls[:]
+        self.settings_override = self.settings(SEARCH_ETAGS=True, SEARCH_ETAG_TTL=3600,
+                                               RESPECT_SOCIAL_GRAPH=False)
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+
+    def get(self, params={}, method="get", **kwargs):
+        request = getattr(RequestFactory(), method)("/search.json", params)
+        return search_view(request, **kwargs)
+
+    def etag(self, params={}, **kwargs):
+        response = self.get(params, **kwargs)
+        self.assertEqual(response.status_code, 200)
+        return response['ETag']
+
+    def revalidate(self, if_none_match, params={}):
+        request = RequestFactory().get("/search.json", params,
+                                       HTTP_IF_NONE_MATCH=if_none_match)
+        return search_view(request)
+
+    def test_matching_tag_is_not_modified(self):
+        etag = self.etag({'a': "1"})
+        del calls[:]
+        for header in (etag, "W/" + etag, '"other", ' + etag, "*",
+                       etag[:-1] + '-gzip"', "W/" + etag[:-1] + '-br"'):
+            response = self.revalidate(header, {'a': "1"})
+            self.assertEqual(response.status_code, 304, header)
+            self.assertEqual(response['ETag'], etag)
+        #before the view ran
+        self.assertEqual(calls, [])
+
+    def test_other_tags_run_the_search(self):
+        etag = self.etag({'a': "1"})
+        for header in ('"other"', etag[:-1] + '-deflate"', etag[1:-1]):
+            response = self.revalidate(header, {'a': "1"})
+            self.assertEqual(response.status_code, 200, header)
+            self.assertEqual(response['ETag'], etag)
+
+    def test_tag_follows_parameters_and_arguments(self):
+        etag = self.etag({'a': "1"})
+        self.assertEqual(self.etag({'a': "1"}), etag)
+        self.assertNotEqual(self.etag({'a': "2"}), etag)
+        self.assertNotEqual(self.etag({'a': "1", 'b': "1"}), etag)
+        self.assertNotEqual(self.etag({'a': "1"}, limit=5), etag)
+        self.assertNotEqual(self.etag({'a': "1"}, collection_name="d"), etag)
+        self.assertEqual(self.revalidate(etag, {'a': "2"}).status_code, 200)
+
+    def test_tag_changes_when_the_collection_does(self):
+        etag = self.etag()
+        other = self.etag(collection_name="d")
+        collection_changed("db", "c")
+        self.assertNotEqual(self.etag(), etag)
+        self.assertEqual(self.revalidate(etag).status_code, 200)
+        self.assertEqual(self.etag(collection_name="d"), other)
+
+    def test_only_successful_gets_are_tagged(self):
+        self.assertFalse(self.get({'fail': "1"}).has_header('ETag'))
+        self.assertFalse(self.get(method="post").has_header('ETag'))
+        with self.settings(SEARCH_ETAGS=False):
+            self.assertFalse(self.get().has_header('ETag'))
+            self.assertEqual(self.revalidate("*").status_code, 200)
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim: ai ts=4 sts=4 et sw=4
+
+import os, shutil, tempfile
+from datetime import datetime, timedelta
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+from ..accounts.models import flangioUser
+from . import exports
+from .exports import submit_export, run_export, artifact_path, artifact_response, ExportError
+from .models import ExportJob
+
+
+@override_settings(EXPORT_WORKERS=0)
+class SubmitExportTest(TestCase):
+
+    def setUp(self):
+        self.alice = flangioUser.objects.create_user("alice", "alice@example.com", "pw")
+        self.bob = flangioUser.objects.create_user("bob", "bob@example.com", "pw")
+
+    def test_same_user_gets_the_same_job(self):
+        job, created = submit_export(self.alice, "csv", "db", "coll", {'a': 1})
+        again, created_again = submit_export(self.alice, "csv", "db", "coll", {'a': 1})
+        self.assertTrue(created)
+        self.assertFalse(created_again)
+        self.assertEqual(job.pk, again.pk)
+
+    def test_two_users_get_their_own_jobs(self):
+        """
+        Each user can poll the job they are handed.
+        """
+        for social_graph in (False, True):
+            with self.settings(RESPECT_SOCIAL_GRAPH=social_graph):
+                ExportJob.objects.all().delete()
+                a, created_a = submit_export(self.alice, "csv", "db", "coll", {'a': 1})
+                b, created_b = submit_export(self.bob, "csv", "db", "coll", {'a': 1})
+                self.assertTrue(created_a and created_b)
+                self.assertNotEqual(a.pk, b.pk)
+                self.assertEqual(a.user_id, self.alice.pk)
+                self.assertEqual(b.user_id, self.bob.pk)
+                self.assertNotEqual(a.cache_key, b.cache_key)
+
+    def running(self, seconds_ago):
+        job, created = submit_export(self.alice, "csv", "db", "coll", {'a': 1})
+        ExportJob.objects.filter(pk=job.pk).update(
+            status="running", heartbeat=datetime.now() - timedelta(seconds=seconds_ago))
+        return job
+
+    def test_a_running_job_with_a_live_worker_is_reused(self):
+        job = self.running(10)
+        again, created = submit_export(self.alice, "csv", "db", "coll", {'a': 1})
+        self.assertFalse(created)
+        self.assertEqual(again.pk, job.pk)
+
+    def test_a_running_job_that_lost_its_worker_is_not_reused(self):
+        with self.settings(EXPORT_STALE_SECONDS=60):
+            job = self.running(61)
+            again, created = submit_export(self.alice, "csv", "db", "coll", {'a': 1})
+        self.assertTrue(created)
+        self.assertNotEqual(again.pk, job.pk)
+        self.assertEqual(ExportJob.objects.get(pk=job.pk).status, "failed")
+
+    def test_starting_workers_picks_up_orphans(self):
+        stale = self.running(3600)
+        queued, created = submit_export(self.bob, "csv", "db", "coll", {'a': 1})
+        exports._workers_pid = None
+        try:
+            #no threads, so the queue can be read back
+            exports._start_workers()
+            self.assertEqual(exports._queue.get_nowait(), queued.pk)
+            self.assertTrue(exports._queue.empty())
+        finally:
+            exports._workers_pid = None
+        self.assertEqual(ExportJob.objects.get(pk=stale.pk).status, "failed")
+        self.assertEqual(ExportJob.objects.get(pk=queued.pk).status, "queued")
+
+
+@override_settings(EXPORT_WORKERS=0)
+class RunExportTest(TestCase):
+
+    def setUp(self):
+        self.alice = flangioUser.objects.create_user("alice", "alice@example.com", "pw")
+        self.root = tempfile.mkdtemp()
+        self.settings_override = self.settings(EXPORT_ROOT=self.root)
+        self.settings_override.enable()
+        self.write_export = exports.write_export
+
+    def tearDown(self):
+        exports.write_export = self.write_export
+        self.settings_override.disable()
+        shutil.rmtree(self.root)
+
+    def run_with(self, write):
+        exports.write_export = write
+        job, created = submit_export(self.alice, "csv", "db", "coll", {'a': 1})
+        self.assertTrue(run_export(job.pk))
+        return ExportJob.objects.get(pk=job.pk)
+
+    def test_the_file_appears_only_once_written(self):
+        seen = []
+        def write(job, f):
+            f.write("a,b\r\n")
+            seen.append((f.name, os.listdir(self.root)))
+        job = self.run_with(write)
+        partial, listing = seen[0]
+        self.assertTrue(partial.endswith(".part"))
+        self.assertEqual(listing, [os.path.basename(partial)])
+
+        self.assertEqual(job.status, "complete")
+        self.assertEqual(artifact_path(job) + ".part", partial)
+        self.assertEqual(os.listdir(self.root), [job.artifact])
+        self.assertEqual(open(artifact_path(job), "rb").read(), "a,b\r\n")
+        self.assertEqual(job.size, 5)
+        #a job runs once
+        self.assertFalse(run_export(job.pk))
+
+    def test_a_failed_export_leaves_no_file(self):
+        def write(job, f):
+            f.write("a,b\r\n")
+            raise ExportError("The search failed.")
+        job = self.run_with(write)
+        self.assertEqual(job.status, "failed")
+        self.assertEqual(job.message, "The search failed.")
+        self.assertEqual(job.artifact, "")
+        self.assertTrue(job.finished is not None)
+        self.assertEqual(os.listdir(self.root), [])
+
+    def test_a_deleted_file_is_exported_again(self):
+        job = self.run_with(lambda job, f: f.write("a,b\r\n"))
+        again, created = submit_export(self.alice, "csv", "db", "coll", {'a': 1})
+        self.assertFalse(created)
+        self.assertEqual(again.pk, job.pk)
+
+        os.remove(artifact_path(job))
+        again, created = submit_export(self.alice, "csv", "db", "coll", {'a': 1})
+        self.assertTrue(created)
+        self.assertNotEqual(again.pk, job.pk)
+        self.assertEqual(again.status, "queued")
+
+    def download(self, **headers):
+        job = ExportJob.objects.filter(status="complete").first() or \
+              self.run_with(lambda job, f: f.write("0123456789"))
+        response = artifact_response(RequestFactory().get("/", **headers), job)
+        content = "".join(response.streaming_content) if response.streaming else \
+                  response.content
+        return response, content
+
+    def test_whole_file(self):
+        response, content = self.download()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(content, "0123456789")
+        self.assertEqual(response['Content-Length'], "10")
+        self.assertEqual(response['Accept-Ranges'], "bytes")
+
+    def test_byte_ranges(self):
+        for header, content_range, body in (("bytes=2-5", "bytes 2-5/10", "2345"),
+                                            ("bytes=7-", "bytes 7-9/10", "789"),
+                                            ("bytes=8-20", "bytes 8-9/10", "89"),
+                                            ("bytes=-3", "bytes 7-9/10", "789")):
+            response, content = self.download(HTTP_RANGE=header)
+            self.assertEqual(response.status_code, 206)
+            self.assertEqual(response['Content-Range'], content_range)
+            self.assertEqual(response['Content-Length'], str(len(body)))
+            self.assertEqual(content, body)
+
+    def test_unsatisfiable_range(self):
+        for header in ("bytes=10-", "bytes=5-2"):
+            response, content = self.download(HTTP_RANGE=header)
+            self.assertEqual(response.status_code, 416)
+            self.assertEqual(response['Content-Range'], "bytes */10")
+
+    def test_multiple_ranges_get_the_whole_file(self):
+        response, content = self.download(HTTP_RANGE="bytes=0-1,4-5")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(content, "0123456789")
+
+    def test_if_range(self):
+        response, content = self.download()
+        etag = response['ETag']
+        response, content = self.download(HTTP_RANGE="bytes=2-5", HTTP_IF_RANGE=etag)
+        self.assertEqual(response.status_code, 206)
+        response, content = self.download(HTTP_RANGE="bytes=2-5", HTTP_IF_RANGE='"other"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(content, "0123456789")
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim: ai ts=4 sts=4 et sw=4
+
+from django.test import TestCase
+from django.conf import settings
+from bson.son import SON
+from .. import utils
+from ..utils import social_graph_query
+
+
+class _Request(object):
+    _social_graph_subjects = ["alice", "alice@example.com"]
+
+
+class SocialGraphQueryTest(TestCase):
+
+    def test_no_query_is_just_the_restriction(self):
+        self.assertEqual(social_graph_query(_Request(), {}),
+                         {'subject': {'$in': ["alice", "alice@example.com"]}})
+
+    def test_restriction_is_merged_at_the_top(self):
+        with self.settings(CAST_STRINGS_TO_INTEGERS=True):
+            query = social_graph_query(_Request(), {'age': "42", 'name': "x"})
+        self.assertEqual(query, {'age': 42, 'name': "x",
+                                 'subject': {'$in': ["alice", "alice@example.com"]}})
+
+    def test_a_subject_in_the_query_is_kept(self):
+        with self.settings(CAST_STRINGS_TO_INTEGERS=True):
+            query = social_graph_query(_Request(), {'age': "42", 'subject': "bob"})
+        self.assertEqual(query, {'$and': [
+            {'age': 42, 'subject': "bob"},
+            {'subject': {'$in': ["alice", "alice@example.com"]}}]})
+
+    def test_numbers_are_left_alone_without_the_setting(self):
+        with self.settings(CAST_STRINGS_TO_INTEGERS=False):
+            query = social_graph_query(_Request(), {'age': "42"})
+        self.assertEqual(query['age'], "42")
+
+
+class _Collection(object):
+    """The key scan's answer, as inline_map_reduce gives it."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.calls = []
+
+    def inline_map_reduce(self, map, reduce, **kwargs):
+        self.calls.append(kwargs)
+        return self.rows
+
+
+class _Cursor(object):
+    """Just enough of a pymongo cursor for stream_keys."""
+
+    def __init__(self, documents, collection=None):
+        self.documents = documents
+        self.collection = collection
+        self.read = 0
+
+    def clone(self):
+        return _Cursor(self.documents)
+
+    def __iter__(self):
+        for d in self.documents:
+            self.read += 1
+            yield d
+
+
+class StreamKeysTest(TestCase):
+
+    #rows 0 to 1999 have a, only row 1500 has late.x
+    scanned = [{'_id': "a", 'value': {'rank': [1.0], 'types': ["int"]}},
+               {'_id': "late.x", 'value': {'rank': [2.0, 0.0], 'types': ["string"]}},
+               {'_id': "_id", 'value': {'rank': [0.0], 'types': ["other"]}}]
+
+    def test_return_keys_are_the_keys(self):
+        cursor = _Cursor([{'_id': 1, 'a': 1}])
+        keys = utils.stream_keys(cursor, {}, return_keys=["a", "b.c"], flat=True)
+        self.assertEqual(keys, ["id", "a", "b.c"])
+        self.assertEqual(cursor.read, 0)
+
+    def test_a_small_result_is_read(self):
+        documents = [SON([('_id', i), ('a', {'b': i})]) for i in range(3)]
+        documents[-1]['c'] = 1
+        keys = utils.stream_keys(_Cursor(documents), {}, limit=10, flat=True)
+        self.assertEqual(keys, ["id", "a.b", "c"])
+
+    def test_a_large_result_is_scanned_on_the_server(self):
+        collection = _Collection(self.scanned)
+        value_types = {}
+        with self.settings(SCAN_KEYS_READ_MAX=100):
+            keys = utils.stream_keys(_Cursor([], collection), {'a': 1}, limit=2000,
+                                     value_types=value_types, flat=True, max_time_ms=50)
+        self.assertEqual(keys, ["id", "a", "late.x"])
+        self.assertEqual(value_types, {'id': set([unicode]), 'a': set([int]),
+                                       'late.x': set([unicode])})
+        self.assertEqual(collection.calls, [{'query': {'a': 1}, 'maxTimeMS': 50,
+                                             'scope': {'flat': True,
+                                                       'flattenArrays': settings.FLATTEN_ARRAYS}}])
+
+    def test_types_for_return_keys(self):
+        value_types = {}
+        keys = utils.stream_keys(_Cursor([], _Collection(self.scanned)), {},
+                                 return_keys=["late"], value_types=value_types)
+        self.assertEqual(keys, ["id", "late.x"])
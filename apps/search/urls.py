@@ -2,6 +2,7 @@
 # -*- coding: utf-8 -*-
 
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
 from django.views.decorators.csrf import csrf_exempt
 from ..accounts.decorators import json_login_required
 from django.conf.urls import patterns, include, url
@@ -24,6 +25,30 @@ urlpatterns = patterns('',
     
 
     
+    #return XLSX
+    url(r'^search.xlsx$',  search_xls, name="search_xls"),
+    url(r'^database/(?P<database_name>[^/]+)/collection/(?P<collection_name>[^/]+)/search.xlsx$',
+         search_xls, name="search_xls_w_params"),
+    
+    
+    #return XML
+    url(r'^search.xml$',  search_xml, name="search_xml"),
+    url(r'^database/(?P<database_name>[^/]+)/collection/(?P<collection_name>[^/]+)/search.xml$',
+         search_xml, name="search_xml_w_params"),
+    
+    
+    #return newline delimited JSON
+    url(r'^search.ndjson$',  search_ndjson, name="search_ndjson"),
+    url(r'^database/(?P<database_name>[^/]+)/collection/(?P<collection_name>[^/]+)/search.ndjson$',
+         search_ndjson, name="search_ndjson_w_params"),
+    
+    
+    #return Parquet or an Arrow IPC stream
+    url(r'^search.(?P<output_format>parquet|arrow)$',  search_arrow, name="search_arrow"),
+    url(r'^database/(?P<database_name>[^/]+)/collection/(?P<collection_name>[^/]+)/search.(?P<output_format>parquet|arrow)$',
+         search_arrow, name="search_arrow_w_params"),
+    
+    
     #return HTML Table
     url(r'^search.html$',  search_html, name="search_html"),
     url(r'^database/(?P<database_name>[^/]+)/collection/(?P<collection_name>[^/]+)/search.html$',
@@ -62,9 +87,24 @@ urlpatterns = patterns('',
     url(r'^database/(?P<database_name>[^/]+)/collection/(?P<collection_name>[^/]+)/complex-search$',
          login_required(complex_search), name="complex-search"),
     
+    #background exports
+    url(r'^export/search.(?P<output_format>csv|xlsx|json|html|ndjson|parquet|arrow)$',
+         login_required(export_search), name="export_search"),
+    url(r'^database/(?P<database_name>[^/]+)/collection/(?P<collection_name>[^/]+)/export/search.(?P<output_format>csv|xlsx|json|html|ndjson|parquet|arrow)$',
+         login_required(export_search), name="export_search_w_params"),
+    url(r'^export/saved-search/(?P<slug>[-\w]+).(?P<output_format>csv|xlsx|json|html|ndjson|parquet|arrow)$',
+         login_required(export_saved_search), name="export_saved_search"),
+    url(r'^export/job/(?P<job_id>\d+)$', login_required(export_job_status),
+         name="export_job_status"),
+    url(r'^export/job/(?P<job_id>\d+)/download$', login_required(export_job_download),
+         name="export_job_download"),
+    
     url(r'^saved-searches$', login_required(display_saved_searches),
                     name="saved_searches"),
     
+    url(r'^slow-queries$', staff_member_required(slow_queries),
+                    name="search_slow_queries"),
+    
     url(r'^build-keys', login_required(build_keys),
                     name="search_build_keys"),
     
@@ -83,10 +123,10 @@ urlpatterns = patterns('',
 
     # search for all get all features that match the search dict
     #return JSON
-    url(r'^api/search.json$', search_json,
+    url(r'^api/search.json$', search_json, {'stream': True},
         name="api_search_json"),
     url(r'^api/database/(?P<database_name>[^/]+)/collection/(?P<collection_name>[^/]+)/search.json$',
-         search_json, name="api_search_json_w_params"),
+         search_json, {'stream': True}, name="api_search_json_w_params"),
     
     #return CSV
     url(r'^api/search.csv$',  search_csv,
@@ -96,6 +136,38 @@ urlpatterns = patterns('',
          search_csv, name="api_search_csv_w_params"),
 
  
+    #return XLSX
+    url(r'^api/search.xlsx$',  search_xls,
+        name="api_search_xls"),
+    
+    url(r'^api/database/(?P<database_name>[^/]+)/collection/(?P<collection_name>[^/]+)/search.xlsx$',
+         search_xls, name="api_search_xls_w_params"),
+
+ 
+    #return XML
+    url(r'^api/search.xml$',  search_xml,
+        name="api_search_xml"),
+    
+    url(r'^api/database/(?P<database_name>[^/]+)/collection/(?P<collection_name>[^/]+)/search.xml$',
+         search_xml, name="api_search_xml_w_params"),
+
+ 
+    #return newline delimited JSON
+    url(r'^api/search.ndjson$',  search_ndjson,
+        name="api_search_ndjson"),
+    
+    url(r'^api/database/(?P<database_name>[^/]+)/collection/(?P<collection_name>[^/]+)/search.ndjson$',
+         search_ndjson, name="api_search_ndjson_w_params"),
+
+ 
+    #return Parquet or an Arrow IPC stream
+    url(r'^api/search.(?P<output_format>parquet|arrow)$',  search_arrow,
+        name="api_search_arrow"),
+    
+    url(r'^api/database/(?P<database_name>[^/]+)/collection/(?P<collection_name>[^/]+)/search.(?P<output_format>parquet|arrow)$',
+         search_arrow, name="api_search_arrow_w_params"),
+
+ 
     #return HTML Table
     url(r'^api/search.html$',  search_html,
         name="api_search_html"),
@@ -107,6 +179,17 @@ urlpatterns = patterns('',
         run_saved_search_by_slug,
         name="run_saved_search_by_slug"),
     
+    url(r'^api/export/search.(?P<output_format>csv|xlsx|json|html|ndjson|parquet|arrow)$',
+         json_login_required(csrf_exempt(export_search)), name="api_export_search"),
+    url(r'^api/database/(?P<database_name>[^/]+)/collection/(?P<collection_name>[^/]+)/export/search.(?P<output_format>csv|xlsx|json|html|ndjson|parquet|arrow)$',
+         json_login_required(csrf_exempt(export_search)), name="api_export_search_w_params"),
+    url(r'^api/export/saved-search/(?P<slug>[-\w]+).(?P<output_format>csv|xlsx|json|html|ndjson|parquet|arrow)$',
+         json_login_required(csrf_exempt(export_saved_search)), name="api_export_saved_search"),
+    url(r'^api/export/job/(?P<job_id>\d+)$', json_login_required(export_job_status),
+         name="api_export_job_status"),
+    url(r'^api/export/job/(?P<job_id>\d+)/download$', json_login_required(export_job_download),
+         name="api_export_job_download"),
+    
     url(r'^api/complex-search$',
         json_login_required(csrf_exempt(complex_search)),
         name="api_complex_search"),
@@ -1,11 +1,11 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 # vim: ai ts=4 sts=4 et sw=4
-import os, uuid, json
+import os, sys, uuid, json
 from django.conf import settings
 from django.shortcuts import render_to_response,  get_object_or_404
 from django.contrib import messages
-from django.http import HttpResponse, Http404, HttpResponseRedirect
+from django.http import HttpResponse, Http404, HttpResponseRedirect, StreamingHttpResponse
 from django.contrib.auth.models import User
 from django.template import RequestContext
 from django.core.context_processors import csrf
@@ -16,9 +16,19 @@ from ..accounts.decorators import access_required
 from ..accounts.models import Permission
 from forms import SavedSearchForm, ComplexSearchForm
 from ..utils import *
-from models import SavedSearch
-from xls_utils import convert_to_xls, convert_to_csv, convert_labels_to_xls, convert_to_rows
-from dict2xml import dict2xml
+from ..mongodb.encoding import dumps, pretty_requested
+from ..mongodb.filters import compile_filter, InvalidQuery
+from ..mongodb.indexes import parse_sort, parse_fields, sort_is_indexed
+from ..mongodb.slowlog import worst_shapes, explain_for_shape
+from ..mongodb.cache import (result_cache_enabled, result_cache_key,
+                             get_cached_result, set_cached_result)
+from models import SavedSearch, ExportJob
+from arrow_utils import arrow_available, arrow_response
+from compression import compressed
+from conditional import conditional_search
+from exports import submit_export, export_status, artifact_response
+from xls_utils import (convert_to_xls, convert_to_csv, convert_to_streaming_csv,
+                       convert_labels_to_xls, html_page)
 from django.db import IntegrityError
 from django.utils.translation import ugettext_lazy as _
 import shlex
@@ -32,30 +42,121 @@ def build_keys(request):
 
 
 
-def prepare_search_results(request, database_name=settings.MONGO_DB_NAME,
+#GET parameters that control a search rather than filter it.
+RESERVED_SEARCH_PARAMS = ('limit', 'skip', 'stream', 'after', 'count', 'pretty',
+                          'fields', 'sort', 'fragment', 'column')
+
+
+def stream_requested(request, stream=False):
+    """Streaming is on if the view asked for it or the client sent stream=true."""
+    if stream:
+        return True
+    return request.GET.get('stream', '').lower() in ('1', 'true', 'yes')
+
+
+def search_time_limit(request):
+    """Return the maxTimeMS budget for this request, or None for no limit."""
+    if request.user.is_authenticated():
+        username = request.user.get_username()
+        if settings.SEARCH_USER_TIME_LIMITS_MS.has_key(username):
+            return settings.SEARCH_USER_TIME_LIMITS_MS[username]
+    resolver_match = getattr(request, 'resolver_match', None)
+    if resolver_match and settings.SEARCH_TIME_LIMITS_MS.has_key(resolver_match.url_name):
+        return settings.SEARCH_TIME_LIMITS_MS[resolver_match.url_name]
+    return settings.SEARCH_TIME_LIMIT_MS
+
+
+def parse_search_request(request, database_name=settings.MONGO_DB_NAME,
                 collection_name=settings.MONGO_MASTER_COLLECTION,
-                skip=0, sort=None, limit=settings.MONGO_LIMIT, return_keys=(), query={}):
+                skip=0, sort=None, limit=settings.MONGO_LIMIT, return_keys=(), query={},
+                max_limit=None):
+    """Work out the filter, skip, limit, sort and return_keys of a search
+    from its GET parameters, where the caller has not already set them.
+    The limit is capped at max_limit if given. Return them as a dict; raise
+    InvalidQuery if the parameters are bad."""
     if not query:
-        kwargs = {}
+        params = {}
         for k,v in request.GET.items():
-            kwargs[k]=v
-            if kwargs.has_key('limit'):
-                limit=int(kwargs['limit'])
-                del kwargs['limit']
-            if kwargs.has_key('skip'):
-                skip=int(kwargs['skip'])
-                del kwargs['skip']
+            if k not in RESERVED_SEARCH_PARAMS:
+                params[k]=v
+        #age__gte=30, state__in=MD,VA, ... see apps/mongodb/filters.py
+        kwargs = compile_filter(params)
+        try:
+            if request.GET.has_key('limit'):
+                limit=int(request.GET['limit'])
+            if request.GET.has_key('skip'):
+                skip=int(request.GET['skip'])
+        except ValueError:
+            raise InvalidQuery("limit and skip must be integers.")
     else:
         kwargs = query
+    if max_limit and (not limit or limit > max_limit):
+        limit = max_limit
+
+    #fields=name,age and sort=-age,name apply unless the caller set them.
+    if not return_keys and request.GET.get('fields'):
+        return_keys = parse_fields(request.GET['fields'])
+    if not sort and request.GET.get('sort'):
+        sort = parse_sort(request.GET['sort'])
+        if settings.SEARCH_REQUIRE_INDEXED_SORT:
+            try:
+                indexed = sort_is_indexed(database_name, collection_name, sort, kwargs)
+            except:
+                #let the search itself report the connection error.
+                indexed = True
+            if not indexed:
+                raise InvalidQuery(
+                    "No index can serve sort=%s. Sort on indexed keys or add an index."
+                    % (request.GET['sort']))
+
+    return {'query': kwargs, 'skip': skip, 'limit': limit, 'sort': sort,
+            'return_keys': return_keys}
+
+
+def prepare_search_results(request, database_name=settings.MONGO_DB_NAME,
+                collection_name=settings.MONGO_MASTER_COLLECTION,
+                skip=0, sort=None, limit=settings.MONGO_LIMIT, return_keys=(), query={},
+                stream=False, after=None, scan_keys=False, scan_types=False,
+                max_limit=None):
+    #keyset pagination is requested with after= (empty for the first page).
+    if after is None:
+        after = request.GET.get('after', None)
+    count_mode = request.GET.get('count', None)
+
+    try:
+        search = parse_search_request(request, database_name, collection_name,
+                                      skip=skip, sort=sort, limit=limit,
+                                      return_keys=return_keys, query=query,
+                                      max_limit=max_limit)
+    except InvalidQuery, e:
+        return invalid_search_response(unicode(e))
+    kwargs = search['query']
+    if settings.RESPECT_SOCIAL_GRAPH:
+        #only documents about users who share with the requester
+        kwargs = social_graph_query(request, kwargs)
+    skip = search['skip']
+    limit = search['limit']
+    sort = search['sort']
+    return_keys = search['return_keys']
     
+    max_time_ms = search_time_limit(request)
+
+    if stream:
+        return query_mongo_stream(kwargs, database_name, collection_name, skip=skip,
+                                  limit=limit, sort=sort, return_keys=return_keys,
+                                  after=after, count_mode=count_mode,
+                                  max_time_ms=max_time_ms, scan_keys=scan_keys,
+                                  scan_types=scan_types)
 
     result = query_mongo(kwargs, database_name, collection_name, skip=skip, limit=limit,
-                         sort=sort, return_keys=return_keys)
+                         sort=sort, return_keys=return_keys, after=after,
+                         count_mode=count_mode, max_time_ms=max_time_ms)
 
     return result
     
 
 @csrf_exempt
+@compressed
 def custom_report(request, database_name=settings.MONGO_DB_NAME,
                 collection_name=settings.MONGO_MASTER_COLLECTION):
     ckeys = get_collection_keys()
@@ -69,21 +170,27 @@ def custom_report(request, database_name=settings.MONGO_DB_NAME,
                 if v==True:
                     return_keys.append(k)
 
-            q = massage_dates(json.loads(data['query']))
-
             if data['outputformat']=="xls":
-                return search_xls(request, collection=None, return_keys=return_keys,
+                return search_xls(request, return_keys=return_keys,
                                    query=json.loads(data['query']))
             
             elif data['outputformat']=="csv":
-                return search_csv(request, collection=None, return_keys=return_keys,
+                return search_csv(request, return_keys=return_keys,
                                    query=json.loads(data['query']))
             
             elif data['outputformat']=="xml":
-                return search_xml(request, collection=None, return_keys=return_keys,
+                return search_xml(request, return_keys=return_keys,
+                                   query=json.loads(data['query']))
+
+            elif data['outputformat']=="ndjson":
+                return search_ndjson(request, return_keys=return_keys,
+                                   query=json.loads(data['query']))
+
+            elif data['outputformat'] in ("parquet", "arrow"):
+                return search_arrow(request, data['outputformat'], return_keys=return_keys,
                                    query=json.loads(data['query']))
             else:
-                return search_json(request, collection=None, return_keys=return_keys,
+                return search_json(request, return_keys=return_keys,
                                    query=json.loads(data['query']))
 
         else:
@@ -103,119 +210,306 @@ def custom_report(request, database_name=settings.MONGO_DB_NAME,
 
 
 
+@compressed
+@conditional_search
 def search_json(request, database_name=settings.MONGO_DB_NAME,
                 collection_name=settings.MONGO_MASTER_COLLECTION,
                 skip=0, limit=settings.MONGO_LIMIT, sort=None, return_keys=(),
-                query={}):
+                query={}, stream=False, after=None):
     
+    stream = stream_requested(request, stream)
 
     result = prepare_search_results(request, database_name=database_name,
                 collection_name=collection_name, skip=skip, sort=sort,
-                limit=limit, return_keys=return_keys, query=query)
+                limit=limit, return_keys=return_keys, query=query, stream=stream,
+                after=after)
 
     if int(result['code'])==200:
         listresults=result['results']
 
     else:
-        response = json.dumps(result, indent =4)
+        response = dumps(result, pretty_requested(request))
         return HttpResponse(response, status=int(result['code']),
                             content_type="application/json")
 
-    if settings.RESPECT_SOCIAL_GRAPH:
-        listresults=filter_social_graph(request, listresults)
-
-
-        len_results=len(listresults)
-        if len_results < result['num_results']:
-            result['ommitted-results']= result['num_results'] - len_results
-            result['results']=listresults
+    if stream:
+        return StreamingHttpResponse(stream_json(result, pretty_requested(request)),
+                                     status=int(result['code']),
+                                     content_type="application/json")
 
-        jsonresults=to_json(result)
-        return HttpResponse(jsonresults, status=int(result['code']),
-                            content_type="application/json")
-    else:
-        jsonresults=to_json(normalize_results(result))
-        return HttpResponse(jsonresults, status=int(result['code']),content_type="application/json")
+    jsonresults=to_json(result, pretty_requested(request))
+    return HttpResponse(jsonresults, status=int(result['code']),content_type="application/json")
 
 
 
 
 
+@compressed
+@conditional_search
 def search_csv(request, database_name=settings.MONGO_DB_NAME,
                 collection_name=settings.MONGO_MASTER_COLLECTION,
-                skip=0, sort=None, limit=settings.MONGO_LIMIT, return_keys=(), query={}):
+                skip=0, sort=None, limit=settings.MONGO_LIMIT, return_keys=(), query={},
+                after=None):
+
+    #The CSV is streamed from the cursor unless a keyset page needs its
+    #X-Next-Cursor header, which is only known once every row has been read.
+    if after is None:
+        after = request.GET.get('after', None)
+    stream = after is None
     
     result = prepare_search_results(request, database_name=database_name,
                 collection_name=collection_name, sort=sort, skip=skip,
-                limit=limit, return_keys=return_keys, query=query)
+                limit=limit, return_keys=return_keys, query=query, after=after,
+                stream=stream, scan_keys=stream)
 
     #print result.keys()
 
+    if int(result['code']) == 200 and stream:
+        return convert_to_streaming_csv(result['keys'], result['results'], collection_name)
+
     if int(result['code']) == 200:
         listresults=result['results']
-        if settings.RESPECT_SOCIAL_GRAPH:
-            listresults = filter_social_graph(request, listresults)
-            len_results = len(listresults)
-            if len_results < result['num_results']:
-                result['ommitted-results']= result['num_results'] - len_results
+        keylist = result_keys(listresults, flat=True)
 
-        keylist = []
-        for i in listresults:
-            for j in i.keys():
-                if not keylist.__contains__(j):
-                    keylist.append(j)
 
-
-        return convert_to_csv(keylist, listresults)
+        response = convert_to_csv(keylist, listresults, collection_name=collection_name)
+        if result.get('next'):
+            response['X-Next-Cursor'] = result['next']
+        return response
 
     else:
-        jsonresults=to_json(result)
+        jsonresults=to_json(result, pretty_requested(request))
         return HttpResponse(jsonresults, status=int(result['code']),
                             content_type="application/json")
 
 
 
-def search_html(request, database_name=settings.MONGO_DB_NAME,
+@conditional_search
+def search_xls(request, database_name=settings.MONGO_DB_NAME,
                 collection_name=settings.MONGO_MASTER_COLLECTION,
-                sort=None, skip=0, limit=settings.MONGO_LIMIT, return_keys=(),
-                query={}):
-    
-    
-    timestamp = datetime.now().strftime('%m-%d-%Y %H:%M:%S UTC')    
+                skip=0, sort=None, limit=settings.MONGO_LIMIT, return_keys=(), query={},
+                after=None):
+
+    #Streamed from the cursor like search_csv, with the same exception.
+    if after is None:
+        after = request.GET.get('after', None)
+    stream = after is None
+
     result = prepare_search_results(request, database_name=database_name,
                 collection_name=collection_name, sort=sort, skip=skip,
-                limit=limit, return_keys=return_keys, query=query)
+                limit=limit, return_keys=return_keys, query=query, after=after,
+                stream=stream, scan_keys=stream)
 
-    #print result.keys()
+    if int(result['code']) != 200:
+        jsonresults=to_json(result, pretty_requested(request))
+        return HttpResponse(jsonresults, status=int(result['code']),
+                            content_type="application/json")
 
-    if int(result['code']) == 200:
-        listresults=result['results']
-        if settings.RESPECT_SOCIAL_GRAPH:
-            listresults = filter_social_graph(request, listresults)
-            len_results = len(listresults)
-            if len_results < result['num_results']:
-                result['ommitted-results']= result['num_results'] - len_results
-
-        keylist = []
-        for i in listresults:
-            for j in i.keys():
-                if not keylist.__contains__(j):
-                    keylist.append(j)
-        context ={"rows": convert_to_rows(keylist, listresults),
-                  "timestamp": timestamp}
-        
-        return render_to_response('search/html-table.html',
-                              RequestContext(request, context,))   
+    if stream:
+        return convert_to_xls(result['keys'], result['results'],
+                              collection_name=collection_name)
 
+    listresults=result['results']
 
-    else:
-        jsonresults=to_json(result)
+    keylist = result_keys(listresults, flat=True)
+
+    response = convert_to_xls(keylist, listresults, collection_name=collection_name)
+    if result.get('next'):
+        response['X-Next-Cursor'] = result['next']
+    return response
+
+
+
+@compressed
+@conditional_search
+def search_ndjson(request, database_name=settings.MONGO_DB_NAME,
+                collection_name=settings.MONGO_MASTER_COLLECTION,
+                skip=0, sort=None, limit=settings.MONGO_LIMIT, return_keys=(), query={},
+                after=None):
+
+    #One document per line. Streamed from the cursor like search_csv, with
+    #the same exception.
+    if after is None:
+        after = request.GET.get('after', None)
+    stream = after is None
+
+    result = prepare_search_results(request, database_name=database_name,
+                collection_name=collection_name, sort=sort, skip=skip,
+                limit=limit, return_keys=return_keys, query=query, after=after,
+                stream=stream)
+
+    if int(result['code']) != 200:
+        jsonresults=to_json(result, pretty_requested(request))
         return HttpResponse(jsonresults, status=int(result['code']),
                             content_type="application/json")
 
+    listresults=result['results']
+
+    response = StreamingHttpResponse(stream_ndjson(listresults),
+                                     content_type="application/x-ndjson")
+    if result.get('next'):
+        response['X-Next-Cursor'] = result['next']
+    return response
 
 
 
+@compressed
+@conditional_search
+def search_arrow(request, output_format="arrow", database_name=settings.MONGO_DB_NAME,
+                collection_name=settings.MONGO_MASTER_COLLECTION,
+                skip=0, sort=None, limit=settings.MONGO_LIMIT, return_keys=(), query={},
+                after=None):
+
+    #Parquet or Arrow IPC, typed from the BSON values (see arrow_utils.py).
+    #Streamed from the cursor like search_csv, with the same exception.
+    if not arrow_available():
+        response_dict = {}
+        response_dict['num_results']=0
+        response_dict['code']=501
+        response_dict['type']="Error"
+        response_dict['results']=[]
+        response_dict['message']="Parquet and Arrow output need the pyarrow package."
+        return HttpResponse(dumps(response_dict, pretty_requested(request)), status=501,
+                            content_type="application/json")
+
+    if after is None:
+        after = request.GET.get('after', None)
+    stream = after is None
+
+    result = prepare_search_results(request, database_name=database_name,
+                collection_name=collection_name, sort=sort, skip=skip,
+                limit=limit, return_keys=return_keys, query=query, after=after,
+                stream=stream, scan_types=stream)
+
+    if int(result['code']) != 200:
+        jsonresults=to_json(result, pretty_requested(request))
+        return HttpResponse(jsonresults, status=int(result['code']),
+                            content_type="application/json")
+
+    if stream:
+        return arrow_response(result['keys'], result['types'], result['results'],
+                              output_format, collection_name)
+
+    listresults=result['results']
+
+    value_types = {}
+    keylist = result_keys(listresults, value_types)
+    response = arrow_response(keylist, value_types, listresults, output_format,
+                              collection_name)
+    if result.get('next'):
+        response['X-Next-Cursor'] = result['next']
+    return response
+
+
+
+@compressed
+@conditional_search
+def search_xml(request, database_name=settings.MONGO_DB_NAME,
+                collection_name=settings.MONGO_MASTER_COLLECTION,
+                skip=0, sort=None, limit=settings.MONGO_LIMIT, return_keys=(), query={},
+                after=None):
+
+    #One <result> element per document, streamed from the cursor like
+    #search_csv, with the same exception. See stream_xml in apps/utils.py.
+    if after is None:
+        after = request.GET.get('after', None)
+    stream = after is None
+
+    result = prepare_search_results(request, database_name=database_name,
+                collection_name=collection_name, sort=sort, skip=skip,
+                limit=limit, return_keys=return_keys, query=query, after=after,
+                stream=stream)
+
+    if int(result['code']) != 200:
+        jsonresults=to_json(result, pretty_requested(request))
+        return HttpResponse(jsonresults, status=int(result['code']),
+                            content_type="application/json")
+
+    response = StreamingHttpResponse(stream_xml(result),
+                                     content_type="application/xml; charset=utf-8")
+    if result.get('next'):
+        response['X-Next-Cursor'] = result['next']
+    return response
+
+
+
+@compressed
+@conditional_search
+def search_html(request, database_name=settings.MONGO_DB_NAME,
+                collection_name=settings.MONGO_MASTER_COLLECTION,
+                sort=None, skip=0, limit=settings.MONGO_LIMIT, return_keys=(),
+                query={}, after=None):
+    """Render the first page of the results, at most HTML_PAGE_ROWS rows, as
+    an HTML table. Pages are keyset paginated; with fragment=1 the view
+    answers JSON holding one page's rendered rows and the URLs of the next,
+    which the page fetches to load more rows. Rendered pages are cached per
+    collection generation (and, with RESPECT_SOCIAL_GRAPH, per set of users
+    sharing with the requester)."""
+    timestamp = datetime.now().strftime('%m-%d-%Y %H:%M:%S UTC')
+    if after is None:
+        after = request.GET.get('after', '')
+    columns = request.GET.getlist('column')
+
+    page = None
+    cache_key = None
+    if result_cache_enabled():
+        params = sorted((k, request.GET.getlist(k)) for k in request.GET.keys()
+                        if k != 'fragment')
+        parts = ["search_html", query, sort, skip, limit, sorted(return_keys), after,
+                 params]
+        if settings.RESPECT_SOCIAL_GRAPH:
+            parts.append(social_graph_subjects(request))
+        cache_key = result_cache_key(database_name, collection_name, *parts)
+        page = get_cached_result(cache_key)
+
+    if page is None:
+        result = prepare_search_results(request, database_name=database_name,
+                    collection_name=collection_name, sort=sort, skip=skip,
+                    limit=limit, return_keys=return_keys, query=query, after=after,
+                    max_limit=settings.HTML_PAGE_ROWS)
+        if int(result['code']) != 200:
+            jsonresults=to_json(result, pretty_requested(request))
+            return HttpResponse(jsonresults, status=int(result['code']),
+                                content_type="application/json")
+
+        listresults=result['results']
+        keylist = ()
+        if not columns:
+            keylist = result_keys(listresults, flat=True)
+        page = html_page(keylist, listresults, columns, collection_name=collection_name)
+        page['next'] = result.get('next')
+        page['num_results'] = result['num_results']
+        if cache_key:
+            set_cached_result(cache_key, page)
+
+    #the next page is asked for with the same GET parameters, so a search
+    #POSTed to a form isn't paged.
+    next_url = fragment_url = None
+    if page['next'] and request.method == 'GET':
+        params = request.GET.copy()
+        params['after'] = page['next']
+        params.setlist('column', page['columns'])
+        params.pop('fragment', None)
+        next_url = "?%s" % (params.urlencode())
+        params['fragment'] = '1'
+        fragment_url = "?%s" % (params.urlencode())
+
+    if request.GET.get('fragment', '').lower() in ('1', 'true', 'yes'):
+        response_dict = {'rows': page['rows'], 'next': fragment_url,
+                         'next_page': next_url}
+        return HttpResponse(dumps(response_dict, pretty_requested(request)),
+                            content_type="application/json")
+
+    context ={"header": page['header'],
+              "rows": page['rows'],
+              "num_results": page['num_results'],
+              "next_url": next_url,
+              "fragment_url": fragment_url,
+              "timestamp": timestamp}
+    return render_to_response('search/html-table.html',
+                              RequestContext(request, context,))
+
+
 
 @csrf_exempt
 def data_dictionary(request):
@@ -229,7 +523,7 @@ def data_dictionary(request):
                 return convert_labels_to_xls(data)
 
             else:
-                response = json.dumps(data['labels'], indent =4)
+                response = dumps(data['labels'], pretty_requested(request))
                 return HttpResponse(response, status=200,
                                     content_type="application/json")
         else:
@@ -274,7 +568,7 @@ def load_labels(request):
                 return convert_labels_to_xls(data)
 
             else:
-                response = json.dumps(data['labels'], indent =4)
+                response = dumps(data['labels'], pretty_requested(request))
                 return HttpResponse(response, status=200,
                                     content_type="application/json")
         else:
@@ -290,31 +584,41 @@ def load_labels(request):
 
 
 
-def run_saved_search_by_slug(request, slug, output_format=None, skip=0,
-                             sort=None,limit = settings.MONGO_LIMIT):
-    
-
-    error = False
-    response_dict = {}
-    
-    ss = get_object_or_404(SavedSearch,  slug=slug)
-    
+def saved_search_query(request, ss, sort=None):
+    """Return the (query, sort) of a saved search with any GET parameters
+    substituted into the query. Raise ValueError if either is not JSON."""
     query = ss.query
     #if a GET param matches, then replace it
     
     for k,v in request.GET.items():
+       if k in RESERVED_SEARCH_PARAMS:
+            continue
        if k in query:
             if v.isdigit() and settings.CAST_STRINGS_TO_INTEGERS:
                 query = query.replace(k,v)
             else:
                 quoted_value = '"%s"' % (v)
                 query = query.replace(k,quoted_value)
+
+    query = json.loads(query)
+    if ss.sort:
+        #print ss.sort
+        sort = json.loads(ss.sort)
+    return query, sort
+
+
+@compressed
+def run_saved_search_by_slug(request, slug, output_format=None, skip=0,
+                             sort=None,limit = settings.MONGO_LIMIT):
+    
+
+    error = False
+    response_dict = {}
+    
+    ss = get_object_or_404(SavedSearch,  slug=slug)
     
     try:
-        query = json.loads(query)
-        if ss.sort:
-            #print ss.sort
-            sort = json.loads(ss.sort)
+        query, sort = saved_search_query(request, ss, sort)
  
  
     except ValueError:
@@ -324,15 +628,15 @@ def run_saved_search_by_slug(request, slug, output_format=None, skip=0,
         response_dict['type']="Error"
         response_dict['results']=[]
         response_dict['message']="Your query was not valid JSON."
-        response = json.dumps(response_dict, indent =4)
+        response = dumps(response_dict, pretty_requested(request))
         return HttpResponse(response, status=int(response_dict['code']),
                 content_type="application/json")
     
     
 
     if output_format:
-        if output_format not in ("json", "csv", "html"):
-            response_dict['message']="The putput format must be json, csv, or html."
+        if output_format not in ("json", "csv", "html", "xml", "ndjson", "parquet", "arrow"):
+            response_dict['message']="The putput format must be json, csv, html, xml, ndjson, parquet or arrow."
             error = True
         else:
             ss.output_format=output_format
@@ -352,11 +656,14 @@ def run_saved_search_by_slug(request, slug, output_format=None, skip=0,
         response_dict['code']=400
         response_dict['type']="Error"
         response_dict['results']=[]
-        response = json.dumps(response_dict, indent =4)
+        response = dumps(response_dict, pretty_requested(request))
         return HttpResponse(response, status=int(response_dict['code']),
                 content_type="application/json")
     
     
+    #keyset pagination token from the previous page, if any.
+    after = request.GET.get('after', None)
+
     #setup the list of keys for return if specified.
     key_list=()
     if ss.return_keys:  
@@ -368,7 +675,7 @@ def run_saved_search_by_slug(request, slug, output_format=None, skip=0,
                            collection_name =ss.collection_name,
                            sort=sort,
                            query = query, skip=int(skip), limit=int(ss.default_limit),
-                           return_keys= key_list)
+                           return_keys= key_list, after=after)
     
 
     if ss.output_format=="html":
@@ -377,15 +684,40 @@ def run_saved_search_by_slug(request, slug, output_format=None, skip=0,
                           collection_name =ss.collection_name,
                           sort=sort,
                           query = query, skip=int(skip), limit=int(ss.default_limit),
-                          return_keys= key_list) 
+                          return_keys= key_list, after=after)
     
 
     if ss.output_format=="csv":
         return search_csv(request,
                           database_name=ss.database_name,
                            collection_name =ss.collection_name,
+                          sort=sort,
                           query = query, skip=int(skip), limit=int(ss.default_limit),
-                           return_keys= key_list)
+                           return_keys= key_list, after=after)
+    
+    if ss.output_format=="xml":
+        return search_xml(request,
+                          database_name=ss.database_name,
+                          collection_name =ss.collection_name,
+                          sort=sort,
+                          query = query, skip=int(skip), limit=int(ss.default_limit),
+                          return_keys= key_list, after=after)
+
+    if ss.output_format=="ndjson":
+        return search_ndjson(request,
+                          database_name=ss.database_name,
+                          collection_name =ss.collection_name,
+                          sort=sort,
+                          query = query, skip=int(skip), limit=int(ss.default_limit),
+                          return_keys= key_list, after=after)
+
+    if ss.output_format in ("parquet", "arrow"):
+        return search_arrow(request, ss.output_format,
+                          database_name=ss.database_name,
+                          collection_name =ss.collection_name,
+                          sort=sort,
+                          query = query, skip=int(skip), limit=int(ss.default_limit),
+                          return_keys= key_list, after=after)
     
     
     #these next line "should" never execute.
@@ -395,12 +727,85 @@ def run_saved_search_by_slug(request, slug, output_format=None, skip=0,
     response_dict['type']="Error"
     response_dict['results']=[]
     response_dict['message']="Oops something has gone wrong.  Please contact a systems administrator."
-    response = json.dumps(response_dict, indent =4)
+    response = dumps(response_dict, pretty_requested(request))
     return HttpResponse(response, status=int(response_dict['code']),
                             content_type="application/json")
 
 
 
+def export_job_response(request, job, created=False):
+    response_dict = export_status(job)
+    response_dict['reused'] = not created
+    response_dict['status_url'] = reverse("export_job_status", args=(job.pk,))
+    if job.status == "complete":
+        response_dict['download_url'] = reverse("export_job_download", args=(job.pk,))
+    if job.status in ("queued", "running"):
+        status = 202
+    else:
+        status = 200
+    return HttpResponse(dumps(response_dict, pretty_requested(request)), status=status,
+                        content_type="application/json")
+
+
+def export_search(request, output_format, database_name=settings.MONGO_DB_NAME,
+                  collection_name=settings.MONGO_MASTER_COLLECTION):
+    """Start (or reuse) a background export of a search. Takes the same
+    parameters as search.json, except that limit defaults to 0 (everything)."""
+    try:
+        search = parse_search_request(request, database_name, collection_name, limit=0)
+    except InvalidQuery, e:
+        return HttpResponse(dumps(invalid_search_response(unicode(e)), pretty_requested(request)),
+                            status=400, content_type="application/json")
+
+    job, created = submit_export(request.user, output_format, database_name,
+                                 collection_name, search['query'], sort=search['sort'],
+                                 return_keys=search['return_keys'],
+                                 skip=search['skip'], limit=search['limit'])
+    return export_job_response(request, job, created)
+
+
+def export_saved_search(request, slug, output_format):
+    """Start (or reuse) a background export of a saved search. limit=
+    overrides the saved search's default limit; limit=0 exports everything."""
+    ss = get_object_or_404(SavedSearch,  slug=slug)
+    try:
+        query, sort = saved_search_query(request, ss)
+        limit = int(request.GET.get('limit', ss.default_limit))
+        skip = int(request.GET.get('skip', 0))
+    except ValueError:
+        response_dict = invalid_search_response("The saved search query or sort is not valid JSON, or limit and skip are not integers.")
+        return HttpResponse(dumps(response_dict, pretty_requested(request)), status=400,
+                            content_type="application/json")
+
+    key_list=()
+    if ss.return_keys:
+        key_list = shlex.split(ss.return_keys)
+    job, created = submit_export(request.user, output_format, ss.database_name,
+                                 ss.collection_name, query, sort=sort,
+                                 return_keys=key_list, skip=skip, limit=limit,
+                                 saved_search=ss)
+    return export_job_response(request, job, created)
+
+
+def _get_export_job(request, job_id):
+    job = get_object_or_404(ExportJob, pk=job_id)
+    if job.user_id != request.user.pk and not request.user.is_staff:
+        raise Http404
+    return job
+
+
+def export_job_status(request, job_id):
+    return export_job_response(request, _get_export_job(request, job_id), True)
+
+
+@compressed
+def export_job_download(request, job_id):
+    job = _get_export_job(request, job_id)
+    if job.status != "complete":
+        return export_job_response(request, job, True)
+    return artifact_response(request, job)
+
+
 def create_saved_search(request, database_name=settings.MONGO_DB_NAME,
                 collection_name=settings.MONGO_MASTER_COLLECTION,
                         skip=0, limit=200, return_keys=()):
@@ -474,6 +879,7 @@ def edit_saved_search_by_slug(request, slug):
 
 
 
+@compressed
 def complex_search(request, database_name=settings.MONGO_DB_NAME,
                 collection_name=settings.MONGO_MASTER_COLLECTION,
                         sort=None, skip=0, limit=200, return_keys=()):
@@ -498,7 +904,7 @@ def complex_search(request, database_name=settings.MONGO_DB_NAME,
                 response_dict['type']="Error"
                 response_dict['results']=[]
                 response_dict['message']="Your query was not valid JSON."
-                response = json.dumps(response_dict, indent =4)
+                response = dumps(response_dict, pretty_requested(request))
                 return HttpResponse(response, status=int(response_dict['code']),
                                     content_type="application/json")
             #Query was valid JSON    
@@ -508,6 +914,13 @@ def complex_search(request, database_name=settings.MONGO_DB_NAME,
                 return search_csv(request, query = query, sort=sort, limit=limit, skip=skip)
             if form.cleaned_data['output_format']=="html":
                 return search_html(request, query = query, sort=sort, limit=limit, skip=skip)
+            if form.cleaned_data['output_format']=="xml":
+                return search_xml(request, query = query, sort=sort, limit=limit, skip=skip)
+            if form.cleaned_data['output_format']=="ndjson":
+                return search_ndjson(request, query = query, sort=sort, limit=limit, skip=skip)
+            if form.cleaned_data['output_format'] in ("parquet", "arrow"):
+                return search_arrow(request, form.cleaned_data['output_format'],
+                                    query = query, sort=sort, limit=limit, skip=skip)
             
             #these next line "should" never execute, but here just in case.
             response_dict = {}
@@ -516,7 +929,7 @@ def complex_search(request, database_name=settings.MONGO_DB_NAME,
             response_dict['type']="Error"
             response_dict['results']=[]
             response_dict['message']="Oops somthing has gone wrong.  Please contact a systems administrator"
-            response = json.dumps(response_dict, indent =4)
+            response = dumps(response_dict, pretty_requested(request))
             return HttpResponse(response, status=int(response_dict['code']),
                                     content_type="application/json")
             
@@ -551,6 +964,24 @@ def complex_search(request, database_name=settings.MONGO_DB_NAME,
     return render_to_response('generic/bootstrapform.html',
                              RequestContext(request, context,))
 
+def slow_queries(request):
+    """List the query shapes that spent the most time in the slow query log."""
+    shapes = []
+    explain = None
+    try:
+        shapes = worst_shapes()
+        if request.GET.get('shape'):
+            explain = explain_for_shape(request.GET['shape'])
+    except:
+        messages.error(request, "The slow query log could not be read: %s" % (str(sys.exc_info()[1])))
+    context = {"shapes": shapes,
+               "shape": request.GET.get('shape'),
+               "explain": explain,
+               "log_ms": settings.SLOW_QUERY_LOG_MS}
+    return render_to_response('search/slow-queries.html',
+                              RequestContext(request, context,))
+
+
 def display_saved_searches(request):
      
     savedsearches = SavedSearch.objects.all()
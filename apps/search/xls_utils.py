@@ -1,202 +1,215 @@
-#!/usr/bin/env python
-# -*- coding: utf-8 -*-
-# vim: ai ts=4 sts=4 et sw=4
-from django.shortcuts import render_to_response
-from django.template import RequestContext
-from django.conf import settings
-from django.utils.datastructures import SortedDict
-from django.http import HttpResponse
-from datetime import datetime
-import csv, string
-import xlwt
-from ..utils import get_collection_keys, get_collection_labels, build_non_observational_key
-
-def flatten_results(keylist, listresults, exclude=()):
-
-    #print "keylist", keylist
-    #print listresults
-    #create a blank list to use as our table
-    rows =[]
-    #if settings.OTHER_LABELS:
-    #    labeldict = get_collection_labels()
-    #else:
-    #    labeldict={}
-
-    # Make the first row
-    row=SortedDict()
-    for i in keylist:
-        row[i]=i
-    rows.append(row)
-    #print "results", len(listresults)
-    #write the rest of the rows.
-    for i in listresults:
-        #Make the other rows
-        row=SortedDict()
-        for j in keylist:
-            if i.has_key(j):
-                
-                #print i[j]
-                
-                if i[j]:
-                    if type(i[j])==type([]) or type(i[j])==type({}) :
-                        row[j]=str(i[j])
-                    else:
-                         # Avoiding int object has no attribute encode
-                        if isinstance(i[j],(int, long)):
-                            row[j] =str(i[j])
-                        else:
-                            row[j] ="".join(s for s in i[j].encode("ascii", errors="ignore") if s in string.printable)
-                else:
-                    row[j]=""
-            else:
-                row[j]=""
-        rows.append(row)
-
-    return rows
-
-def tupleize(rows):
-    """Also alphabetizes columns and returns a tuple of tuples"""
-
-    #define a blank list as our return object
-    l = []
-    for r in rows:
-        row=[]
-        row =list(r.values())
-        l.append(row)
-
-
-    # alphabetize
-    if settings.ALPHABETIZE_COLUMNS:
-        col = zip(*l)
-        col.sort()
-        result = zip(*col)
-        return result
-    else:
-        return l
-
-
-#def apply_custom_labels(rows):
-#    if settings.OTHER_LABELS:
-#        labeldict = get_collection_labels()
-#        counter=0
-#        old_column_header = rows[0]
-#        new_column_header = []
-#        for i in old_column_header:
-#            try:
-#                l =  DataLabelMeta.objects.get(variable_name = build_non_observational_key(i))
-#                new_column_header.append(str(l.label))
-#            except(DataLabelMeta.DoesNotExist):
-#                #there is no custom label defined, so lets try and use the
-#                #regular label from the Data dictionary.
-#                if labeldict.has_key(i):
-#                    new_column_header.append(labeldict[i])
-#                else:
-#                    # else, fallback to the system key
-#                    new_column_header.append(i)
-#        rows[0] = new_column_header
-#    return rows
-
-
-def sort_by_columns(rows):
-
-    if settings.SORTCOLUMNS:
-        ncolumns =[]
-        columns = list(zip(*rows))
-        sl = get_collection_keys()
-
-        for s in sl:
-            for c in columns:
-                if c[0]==s:
-                    ncolumns.append(c)
-
-        difflist = list(set(columns) - set(ncolumns))
-
-
-        for i in difflist:
-            ncolumns.append(i)
-        rows = zip(*ncolumns)
-        lrows =[]
-        for r in rows:
-            lrows.append(list(r))
-        return lrows
-
-    return rows
-
-
-def convert_to_xls(keylist, listresults, exclude=()):
-    rows = flatten_results(keylist, listresults, exclude=())
-
-
-    #turn rows into a tuple of tuples
-    rows = tupleize(rows)
-
-    if settings.SORTCOLUMNS:
-        #sort by our preferred column order, if specificed
-        rows = sort_by_columns(rows)
-
-
-
-    filename = datetime.now().strftime('%m-%d-%Y_%H:%M:%S') + '.xls'
-    response = HttpResponse(mimetype="application/vnd.ms-excel")
-    response['Content-Disposition'] = 'attachment; filename=' + filename
-    excelwb = excelify(rows)
-    excelwb.save(response)
-    return response
-
-
-
-def convert_labels_to_xls(rows):
-
-    filename = datetime.now().strftime('%m-%d-%Y_%H:%M:%S') + '.xls'
-    response = HttpResponse(mimetype="application/vnd.ms-excel")
-    response['Content-Disposition'] = 'attachment; filename=' + filename
-    excelwb = excelify(rows['labels'])
-    excelwb.save(response)
-    return response
-
-def convert_to_csv(keylist, listresults, exclude=()):
-    rows =flatten_results(keylist, listresults, exclude=())
-    rows = tupleize(rows)
-
-    if settings.SORTCOLUMNS:
-        #sort by our preferred column order, if specificed
-        rows = sort_by_columns(rows)
-
-
-    filename = datetime.now().strftime('%m-%d-%Y_%H:%M:%S') + '.csv'
-    response = HttpResponse(mimetype="text/csv")
-    response['Content-Disposition'] = 'attachment; filename=' + filename
-
-
-    writer = csv.writer(response, delimiter=',')
-    for r in rows:
-        #filtered_string = "".join(s for s in c if s in string.printable)
-        writer.writerows([r])
-    return response
-
-def convert_to_rows(keylist, listresults, exclude=()):
-    rows =flatten_results(keylist, listresults, exclude=())
-    rows = tupleize(rows)
-
-    if settings.SORTCOLUMNS:
-        #sort by our preferred column order, if specificed
-        rows = sort_by_columns(rows)
-
-    return rows
-
-
-
-def excelify(rows, sheet_name="Sheet1"):
-    wb      = xlwt.Workbook()
-    sheet1  = wb.add_sheet(sheet_name)
-    column  = 0
-    row     = 0
-
-
-    for i in rows:
-       for j in i:
-            sheet1.write(row,column, str(j))
-            column += 1
-       column = 0
-       row += 1
-    return wb
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim: ai ts=4 sts=4 et sw=4
+from django.shortcuts import render_to_response
+from django.template import RequestContext
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.html import escape
+from django.core.servers.basehttp import FileWrapper
+from datetime import datetime, date, time
+import csv, tempfile
+import xlsxwriter
+from ..utils import chunk_output
+from ..mongodb.flatten import get_plan, cell_text, clean
+from columns import get_column_plan
+
+
+def utf8(row):
+    """csv writes bytes; encode a row of unicode cells."""
+    return [c.encode("utf-8") if isinstance(c, unicode) else c for c in row]
+
+def flatten_results(keylist, listresults, exclude=(), collection_name=None):
+    """Return the table of the results as a list of rows of unicode cells,
+    the header first. The columns are keylist, which may hold dotted paths
+    to nested values (see mongodb/flatten.py), in column plan order (see
+    columns.py)."""
+    column_plan = get_column_plan(collection_name)
+    columns = column_plan.order(keylist)
+    rows = [column_plan.headers(columns)]
+    rows.extend(get_plan(columns).text_rows(listresults))
+    return rows
+
+
+def xls_rows(keylist, listresults, collection_name=None):
+    """Return the header and a generator of the rows of values for
+    excelify()."""
+    column_plan = get_column_plan(collection_name)
+    columns = column_plan.order(keylist)
+    plan = get_plan(columns)
+
+    def rows():
+        try:
+            for i in listresults:
+                yield plan.values(i)
+        finally:
+            if hasattr(listresults, 'close'):
+                listresults.close()
+
+    return column_plan.headers(columns), rows()
+
+
+def convert_to_xls(keylist, listresults, exclude=(), collection_name=None):
+    """Return an XLSX download of the results. listresults may be a cursor;
+    rows are written as they are read."""
+    header, rows = xls_rows(keylist, listresults, collection_name)
+    return xlsx_response(rows, header=header)
+
+
+
+def convert_labels_to_xls(rows):
+    return xlsx_response(rows['labels'])
+
+def convert_to_csv(keylist, listresults, exclude=(), collection_name=None):
+    rows =flatten_results(keylist, listresults, collection_name=collection_name)
+
+    filename = datetime.now().strftime('%m-%d-%Y_%H:%M:%S') + '.csv'
+    response = HttpResponse(mimetype="text/csv")
+    response['Content-Disposition'] = 'attachment; filename=' + filename
+
+
+    writer = csv.writer(response, delimiter=',')
+    for r in rows:
+        writer.writerow(utf8(r))
+    return response
+
+class Echo(object):
+    """A file-like object whose write() returns what it is given, so a
+    csv.writer hands back each line instead of storing it."""
+    def write(self, value):
+        return value
+
+
+def stream_csv_rows(keylist, listresults, collection_name=None):
+    """Generate CSV lines: the header, then one line per result. Only the
+    current row is held in memory, so listresults may be a cursor."""
+    column_plan = get_column_plan(collection_name)
+    columns = column_plan.order(keylist)
+    writer = csv.writer(Echo(), delimiter=',')
+    try:
+        yield writer.writerow(utf8(column_plan.headers(columns)))
+        for cells in get_plan(columns).text_rows(listresults):
+            yield writer.writerow(utf8(cells))
+    finally:
+        if hasattr(listresults, 'close'):
+            listresults.close()
+
+
+def html_header(columns, collection_name=None):
+    """Return the <tr> of <th> headers for columns in output order."""
+    return u"<tr>%s</tr>\n" % (u"".join(u"<th>%s</th>" % (escape(j))
+                                        for j in get_column_plan(collection_name).headers(columns)))
+
+
+def html_rows(columns, listresults):
+    """Generate a <tr> of escaped cells per result."""
+    for cells in get_plan(columns).text_rows(listresults):
+        yield u"<tr>%s</tr>\n" % (u"".join(u"<td>%s</td>" % (escape(c)) for c in cells))
+
+
+def html_page(keylist, listresults, columns=None, collection_name=None):
+    """Render one page of results as table rows. The columns are keylist in
+    column plan order unless given, so later pages can keep the columns of
+    the first. Return a dict of the columns, the header row and the rows."""
+    if not columns:
+        columns = get_column_plan(collection_name).order(keylist)
+    return {'columns': list(columns),
+            'header': html_header(columns, collection_name),
+            'rows': u"".join(html_rows(columns, listresults))}
+
+
+def stream_html_rows(keylist, listresults, title="Search Results", collection_name=None):
+    """Generate a standalone HTML table, one row at a time."""
+    columns = get_column_plan(collection_name).order(keylist)
+    try:
+        yield '<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>%s</title></head>\n' % (escape(title))
+        yield '<body>\n<h1>%s</h1>\n<table border="1">\n' % (escape(title))
+        yield html_header(columns, collection_name)
+        for row in html_rows(columns, listresults):
+            yield row
+        yield "</table>\n</body></html>\n"
+    finally:
+        if hasattr(listresults, 'close'):
+            listresults.close()
+
+
+def convert_to_streaming_csv(keylist, listresults, collection_name=None):
+    filename = datetime.now().strftime('%m-%d-%Y_%H:%M:%S') + '.csv'
+    response = StreamingHttpResponse(chunk_output(stream_csv_rows(keylist, listresults,
+                                                                  collection_name)),
+                                     content_type="text/csv")
+    response['Content-Disposition'] = 'attachment; filename=' + filename
+    return response
+
+
+def convert_to_rows(keylist, listresults, exclude=(), collection_name=None):
+    return flatten_results(keylist, listresults, collection_name=collection_name)
+
+
+
+XLSX_CONTENT_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+
+def excelify(rows, fileobj, header=None, sheet_name="Sheet1",
+             max_rows=settings.XLSX_MAX_ROWS):
+    """Write rows to fileobj as an XLSX workbook. Rows are flushed to disk as
+    they are written, so memory use does not grow with the number of rows.
+    Numbers, booleans, dates and times are written as typed cells. When a
+    sheet reaches max_rows a new one is started, with the header repeated."""
+    wb = xlsxwriter.Workbook(fileobj, {'constant_memory': True,
+                                       'tmpdir': tempfile.gettempdir(),
+                                       'strings_to_numbers': False,
+                                       'strings_to_formulas': False,
+                                       'strings_to_urls': False})
+    datetime_format = wb.add_format({'num_format': 'yyyy-mm-dd hh:mm:ss'})
+    date_format = wb.add_format({'num_format': 'yyyy-mm-dd'})
+    time_format = wb.add_format({'num_format': 'hh:mm:ss'})
+
+    sheets = 0
+    sheet = None
+    row = max_rows
+    for r in rows:
+        if row >= max_rows:
+            sheets += 1
+            if sheets == 1:
+                sheet = wb.add_worksheet(sheet_name)
+            else:
+                sheet = wb.add_worksheet("%s (%s)" % (sheet_name, sheets))
+            row = 0
+            if header:
+                sheet.write_row(row, 0, header)
+                row += 1
+        for column, value in enumerate(r):
+            if value is None or value == "":
+                continue
+            if isinstance(value, bool):
+                sheet.write_boolean(row, column, value)
+            elif isinstance(value, (int, long, float)):
+                sheet.write_number(row, column, value)
+            elif isinstance(value, datetime):
+                sheet.write_datetime(row, column, value.replace(tzinfo=None), datetime_format)
+            elif isinstance(value, date):
+                sheet.write_datetime(row, column, value, date_format)
+            elif isinstance(value, time):
+                sheet.write_datetime(row, column, value, time_format)
+            else:
+                sheet.write_string(row, column, clean(cell_text(value)))
+        row += 1
+    if sheet is None:
+        sheet = wb.add_worksheet(sheet_name)
+        if header:
+            sheet.write_row(0, 0, header)
+    wb.close()
+
+
+def xlsx_response(rows, header=None):
+    """Build the workbook in a temporary file and stream it back."""
+    f = tempfile.TemporaryFile()
+    excelify(rows, f, header=header)
+    size = f.tell()
+    f.seek(0)
+    filename = datetime.now().strftime('%m-%d-%Y_%H:%M:%S') + '.xlsx'
+    response = StreamingHttpResponse(FileWrapper(f), content_type=XLSX_CONTENT_TYPE)
+    response['Content-Disposition'] = 'attachment; filename=' + filename
+    response['Content-Length'] = size
+    return response
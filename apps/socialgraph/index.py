@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim: ai ts=4 sts=4 et sw=4
+
+"""
+    An in-memory index of the social graph.
+
+    The SocialGraph table is read once, lazily, into two maps of user ids:
+    grantee -> the grantors sharing with them, and grantor -> the grantees
+    they share with. Checks are then set lookups instead of queries.
+
+    The post_save and post_delete signals of SocialGraph (see models.py)
+    add or remove the edge in this process's index and advance the
+    "flangio-gen:socialgraph" generation (see apps/mongodb/cache.py). An
+    index is dropped and read again when the generation is not the one it
+    last saw. With a shared SEARCH_CACHE_BACKEND that generation is shared,
+    so another worker's change is seen on its next lookup. Without one,
+    other processes' changes are seen after SOCIAL_GRAPH_INDEX_TTL seconds.
+
+    Writes that send no signals (bulk_create(), QuerySet.update()) must call
+    social_graph_changed() themselves.
+"""
+
+import threading, time
+from django.conf import settings
+from ..mongodb.cache import named_generation, bump_named_generation
+
+
+GENERATION_NAME = "flangio-gen:socialgraph"
+
+_index = None
+_index_lock = threading.Lock()
+
+
+class SocialGraphIndex(object):
+
+    def __init__(self, edges=(), generation=None):
+        self.generation = generation
+        self.expires = time.time() + settings.SOCIAL_GRAPH_INDEX_TTL
+        self.grantors = {}
+        self.grantees = {}
+        for grantor_id, grantee_id in edges:
+            self.add(grantor_id, grantee_id)
+
+    def add(self, grantor_id, grantee_id):
+        self.grantors.setdefault(grantee_id, set()).add(grantor_id)
+        self.grantees.setdefault(grantor_id, set()).add(grantee_id)
+
+    def remove(self, grantor_id, grantee_id):
+        self.grantors.get(grantee_id, set()).discard(grantor_id)
+        self.grantees.get(grantor_id, set()).discard(grantee_id)
+
+
+def _load(generation):
+    from models import SocialGraph
+    return SocialGraphIndex(SocialGraph.objects.values_list('grantor_id', 'grantee_id'),
+                            generation)
+
+
+def get_index():
+    """Return the current index, reading the table if it is out of date."""
+    global _index
+    generation = named_generation(GENERATION_NAME)
+    index = _index
+    if index is None or index.generation != generation or index.expires < time.time():
+        index = _load(generation)
+        with _index_lock:
+            _index = index
+    return index
+
+
+def shares(grantor_id, grantee_id):
+    """Return True if the user grantor_id shares with the user grantee_id."""
+    return grantor_id in get_index().grantors.get(grantee_id, ())
+
+
+def grantors_of(grantee_id):
+    """Return the ids of the users sharing with grantee_id."""
+    return frozenset(get_index().grantors.get(grantee_id, ()))
+
+
+def grantees_of(grantor_id):
+    """Return the ids of the users grantor_id shares with."""
+    return frozenset(get_index().grantees.get(grantor_id, ()))
+
+
+def _changed(edit=None):
+    """Advance the generation. edit, given the index, applies the change to
+    it if this process's index was current; otherwise it is dropped."""
+    global _index
+    with _index_lock:
+        generation = bump_named_generation(GENERATION_NAME)
+        index = _index
+        if index is None:
+            return
+        if edit is not None and index.generation is not None and \
+           generation == index.generation + 1:
+            edit(index)
+            index.generation = generation
+        else:
+            _index = None
+
+
+def social_graph_changed():
+    """Make every process read the social graph again."""
+    _changed()
+
+
+def edge_saved(sender, instance, created=False, **kwargs):
+    if created:
+        _changed(lambda index: index.add(instance.grantor_id, instance.grantee_id))
+    else:
+        #the edge it replaced is not known
+        _changed()
+
+
+def edge_deleted(sender, instance, **kwargs):
+    _changed(lambda index: index.remove(instance.grantor_id, instance.grantee_id))
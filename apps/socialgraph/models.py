@@ -1,6 +1,8 @@
 from django.db import models
+from django.db.models.signals import post_save, post_delete
 import datetime
 from django.conf import settings
+from index import edge_saved, edge_deleted
 
 class SocialGraph(models.Model):
     
@@ -19,3 +21,6 @@ class SocialGraph(models.Model):
         get_latest_by = "created_on"
 
 
+#keep the in-memory index (index.py) current
+post_save.connect(edge_saved, sender=SocialGraph)
+post_delete.connect(edge_deleted, sender=SocialGraph)
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim: ai ts=4 sts=4 et sw=4
+
+import base64, json
+from django.test import TestCase
+from django.test.client import Client
+from ..accounts.models import flangioUser, Permission
+from .models import SocialGraph
+from .index import shares, social_graph_changed
+
+
+class BulkSocialGraphTest(TestCase):
+    """bulk/create and bulk/delete, as tests.py covers create and delete."""
+
+    def setUp(self):
+        #the index outlives each test's rolled back transaction
+        social_graph_changed()
+        self.users = {}
+        for name in ("alice", "bob", "carol", "dave"):
+            self.users[name] = flangioUser.objects.create_user(
+                name, "%s@example.com" % (name), "pw")
+        self.client = Client()
+
+    def post(self, path, pairs, username="alice"):
+        auth = "Basic " + base64.b64encode("%s:pw" % (username))
+        response = self.client.post("/socialgraph/bulk/" + path, json.dumps(pairs),
+                                    content_type="application/json",
+                                    HTTP_AUTHORIZATION=auth)
+        return response.status_code, json.loads(response.content)
+
+    def share(self, grantor, grantee):
+        SocialGraph.objects.create(grantor=self.users[grantor],
+                                   grantee=self.users[grantee])
+
+    def shares(self, grantor, grantee):
+        return shares(self.users[grantor].pk, self.users[grantee].pk)
+
+    def statuses(self, body):
+        return [(r["grantor"], r["grantee"], r["status"]) for r in body["results"]]
+
+    def test_mixed_batch(self):
+        self.share("alice", "carol")
+        code, body = self.post("create", [["alice", "bob"],
+                                          {"grantor": "alice", "grantee": "carol"},
+                                          ["alice", "nobody"],
+                                          ["bob", "carol"],
+                                          {"grantor": "alice"},
+                                          5])
+        self.assertEqual(code, 200)
+        self.assertEqual(body["created"], 1)
+        self.assertEqual(self.statuses(body), [("alice", "bob", "200"),
+                                               ("alice", "carol", "409"),
+                                               ("alice", "nobody", "404"),
+                                               ("bob", "carol", "401"),
+                                               ("alice", None, "400"),
+                                               (None, None, "400")])
+        self.assertEqual(SocialGraph.objects.count(), 2)
+
+    def test_a_pair_sent_twice_is_created_once(self):
+        code, body = self.post("create", [["alice", "bob"], ["alice", "bob"]])
+        self.assertEqual(body["created"], 1)
+        self.assertEqual(self.statuses(body), [("alice", "bob", "200"),
+                                               ("alice", "bob", "409")])
+        self.assertEqual(SocialGraph.objects.filter(grantor=self.users["alice"]).count(), 1)
+
+    def test_others_need_the_any_permission(self):
+        code, body = self.post("create", [["bob", "carol"]])
+        self.assertEqual(self.statuses(body), [("bob", "carol", "401")])
+        Permission.objects.create(user=self.users["alice"],
+                                  permission_name="create-any-socialgraph")
+        code, body = self.post("create", [["bob", "carol"]])
+        self.assertEqual(self.statuses(body), [("bob", "carol", "200")])
+
+        code, body = self.post("delete", [["bob", "carol"]])
+        self.assertEqual(self.statuses(body), [("bob", "carol", "401")])
+        self.assertTrue(self.shares("bob", "carol"))
+        Permission.objects.create(user=self.users["alice"],
+                                  permission_name="delete-any-socialgraph")
+        code, body = self.post("delete", [["bob", "carol"]])
+        self.assertEqual(body["deleted"], 1)
+        self.assertEqual(self.statuses(body), [("bob", "carol", "200")])
+
+    def test_delete(self):
+        self.share("alice", "bob")
+        self.share("alice", "carol")
+        code, body = self.post("delete", [["alice", "bob"], ["alice", "bob"],
+                                          ["alice", "dave"]])
+        self.assertEqual(body["deleted"], 1)
+        self.assertEqual([r["message"] for r in body["results"]],
+                         ["Social graph deleted", "Nothing to delete", "Nothing to delete"])
+        self.assertEqual(SocialGraph.objects.count(), 1)
+
+    def test_the_index_sees_the_change(self):
+        self.share("alice", "dave")
+        self.assertFalse(self.shares("alice", "bob"))
+        self.post("create", [["alice", "bob"], ["alice", "carol"]])
+        self.assertTrue(self.shares("alice", "bob"))
+        self.assertTrue(self.shares("alice", "carol"))
+        self.post("delete", [["alice", "bob"], ["alice", "dave"]])
+        self.assertFalse(self.shares("alice", "bob"))
+        self.assertFalse(self.shares("alice", "dave"))
+        self.assertTrue(self.shares("alice", "carol"))
+
+    def test_too_many_pairs(self):
+        with self.settings(SOCIAL_GRAPH_BULK_MAX=2):
+            code, body = self.post("create", [["alice", "bob"]] * 3)
+        self.assertEqual(code, 400)
+        self.assertEqual(body["message"], "At most 2 pairs may be sent at once.")
+        self.assertEqual(SocialGraph.objects.count(), 0)
+
+    def test_body_must_be_a_list(self):
+        code, body = self.post("create", {"grantor": "alice", "grantee": "bob"})
+        self.assertEqual(code, 400)
+
+    def test_get_is_not_allowed(self):
+        auth = "Basic " + base64.b64encode("alice:pw")
+        response = self.client.get("/socialgraph/bulk/delete", HTTP_AUTHORIZATION=auth)
+        self.assertEqual(response.status_code, 405)
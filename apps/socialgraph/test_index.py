@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim: ai ts=4 sts=4 et sw=4
+
+from django.test import TestCase
+from ..accounts.models import flangioUser
+from .models import SocialGraph
+from .index import shares, grantors_of, grantees_of, social_graph_changed, get_index
+
+
+class SocialGraphIndexTest(TestCase):
+
+    def setUp(self):
+        #the index outlives each test's rolled back transaction
+        social_graph_changed()
+        self.alice, self.bob, self.carol = [
+            flangioUser.objects.create_user(name, "%s@example.com" % (name), "pw")
+            for name in ("alice", "bob", "carol")]
+
+    def test_grants_are_seen_at_once(self):
+        self.assertFalse(shares(self.alice.pk, self.bob.pk))
+        SocialGraph.objects.create(grantor=self.alice, grantee=self.bob)
+        SocialGraph.objects.create(grantor=self.carol, grantee=self.bob)
+        self.assertTrue(shares(self.alice.pk, self.bob.pk))
+        self.assertFalse(shares(self.bob.pk, self.alice.pk))
+        self.assertEqual(grantors_of(self.bob.pk), frozenset([self.alice.pk, self.carol.pk]))
+        self.assertEqual(grantees_of(self.alice.pk), frozenset([self.bob.pk]))
+
+    def test_revokes_are_seen_at_once(self):
+        edge = SocialGraph.objects.create(grantor=self.alice, grantee=self.bob)
+        self.assertTrue(shares(self.alice.pk, self.bob.pk))
+        edge.delete()
+        self.assertFalse(shares(self.alice.pk, self.bob.pk))
+        self.assertEqual(grantors_of(self.bob.pk), frozenset())
+
+    def test_signals_edit_the_loaded_index(self):
+        index = get_index()
+        SocialGraph.objects.create(grantor=self.alice, grantee=self.bob)
+        self.assertTrue(get_index() is index)
+        self.assertTrue(shares(self.alice.pk, self.bob.pk))
+
+    def test_writes_without_signals_need_social_graph_changed(self):
+        edge = SocialGraph.objects.create(grantor=self.alice, grantee=self.bob)
+        self.assertTrue(shares(self.alice.pk, self.bob.pk))
+        SocialGraph.objects.bulk_create([SocialGraph(grantor=self.carol, grantee=self.bob)])
+        SocialGraph.objects.filter(pk=edge.pk).update(grantee=self.carol)
+        self.assertTrue(shares(self.alice.pk, self.bob.pk))
+        self.assertFalse(shares(self.carol.pk, self.bob.pk))
+
+        social_graph_changed()
+        self.assertFalse(shares(self.alice.pk, self.bob.pk))
+        self.assertTrue(shares(self.alice.pk, self.carol.pk))
+        self.assertTrue(shares(self.carol.pk, self.bob.pk))
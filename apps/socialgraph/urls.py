@@ -7,6 +7,9 @@ from views import *
 
 urlpatterns = patterns('',
 
+    #before create and delete, whose patterns match these too
+    url(r'^bulk/create$', social_graph_bulk_create,  name='social_graph_bulk_create'),
+    url(r'^bulk/delete$', social_graph_bulk_delete,  name='social_graph_bulk_delete'),
     url(r'create', social_graph_create,  name='social_graph_create'),
     url(r'delete', social_graph_delete,  name='social_graph_delete'),
     
@@ -1,5 +1,7 @@
-from django.contrib.auth.models import User
+from django.db import connection, transaction, IntegrityError
+from ..accounts.models import flangioUser as User
 from models import SocialGraph
+from index import shares, grantors_of, social_graph_changed
 
 def social_graph_validator(sndr, rcvr, subj):
     ##print """Validate a social graph exists where the
@@ -32,6 +34,8 @@ def get_valid_social_graph(grntr, grnte):
 
         grantor=User.objects.get(username=grntr)
         grantee=User.objects.get(username=grnte)
+        if not shares(grantor.pk, grantee.pk):
+            return None
         sg=SocialGraph.objects.get(grantor=grantor, grantee=grantee)
         return sg
     
@@ -44,6 +48,8 @@ def get_valid_social_graph_by_email(grntr, grnte):
 
         grantor=User.objects.get(email=grntr)
         grantee=User.objects.get(email=grnte)
+        if not shares(grantor.pk, grantee.pk):
+            return None
         sg=SocialGraph.objects.get(grantor=grantor, grantee=grantee)
         return sg
     
@@ -51,17 +57,75 @@ def get_valid_social_graph_by_email(grntr, grnte):
         return None
 
 def get_all_valid_socialgraphs_for_requester(username):
-    ##print "Get a social graph where %s grants rights to %s" % (grntr, grnte)
-    try:
-        l=[]
-        grantee=User.objects.filter(username=username)
-        sg=SocialGraph.objects.filter(grantee=grantee)
-        
-        for s in sg:
-           l.append(str(s.grantor.email)) 
-        return l
-    
-    except(SocialGraph.DoesNotExist):
-        return None
+    """Return the emails of the users sharing with username."""
+    grantee_ids=User.objects.filter(username=username).values_list('pk', flat=True)
+    if not grantee_ids:
+        return []
+    grantor_ids=grantors_of(grantee_ids[0])
+    if not grantor_ids:
+        return []
+    return [str(e) for e in User.objects.filter(pk__in=grantor_ids).values_list('email', flat=True)]
+
+
+#Rows per statement in the bulk helpers below, so the parameters fit the
+#database's limit.
+BULK_BATCH_SIZE = 400
+
+def resolve_usernames(usernames):
+    """Return {username: user id} for the usernames that exist, with one
+    query per BULK_BATCH_SIZE names."""
+    usernames = list(set(usernames))
+    found = {}
+    for i in range(0, len(usernames), BULK_BATCH_SIZE):
+        found.update(User.objects.filter(username__in=usernames[i:i + BULK_BATCH_SIZE])
+                     .values_list('username', 'pk'))
+    return found
+
+def existing_social_graphs(pairs):
+    """Return {(grantor id, grantee id): social graph id} for the pairs that
+    exist."""
+    pairs = list(set(pairs))
+    found = {}
+    for i in range(0, len(pairs), BULK_BATCH_SIZE):
+        batch = pairs[i:i + BULK_BATCH_SIZE]
+        wanted = set(batch)
+        rows = SocialGraph.objects.filter(grantor__in=set(p[0] for p in batch),
+                                          grantee__in=set(p[1] for p in batch)
+                                          ).values_list('grantor_id', 'grantee_id', 'pk')
+        for grantor_id, grantee_id, pk in rows:
+            if (grantor_id, grantee_id) in wanted:
+                found[(grantor_id, grantee_id)] = pk
+    return found
 
+def bulk_create_social_graphs(pairs):
+    """Create a social graph for each (grantor id, grantee id) pair that
+    does not exist yet. Return the set of pairs created."""
+    for attempt in range(2):
+        new = set(pairs) - set(existing_social_graphs(pairs))
+        try:
+            with transaction.atomic():
+                SocialGraph.objects.bulk_create(
+                    [SocialGraph(grantor_id=g, grantee_id=e) for g, e in new],
+                    batch_size=BULK_BATCH_SIZE)
+            break
+        except IntegrityError:
+            #some were created meanwhile; look again.
+            if attempt:
+                raise
+    #bulk_create sends no signals
+    social_graph_changed()
+    return new
 
+def bulk_delete_social_graphs(pks):
+    """Delete social graphs by id, with one statement per BULK_BATCH_SIZE."""
+    pks = list(pks)
+    table = connection.ops.quote_name(SocialGraph._meta.db_table)
+    column = connection.ops.quote_name(SocialGraph._meta.pk.column)
+    with transaction.atomic():
+        cursor = connection.cursor()
+        for i in range(0, len(pks), BULK_BATCH_SIZE):
+            batch = pks[i:i + BULK_BATCH_SIZE]
+            cursor.execute("DELETE FROM %s WHERE %s IN (%s)"
+                           % (table, column, ", ".join(["%s"] * len(batch))), batch)
+    #deleted without signals
+    social_graph_changed()
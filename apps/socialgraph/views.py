@@ -3,9 +3,13 @@ from django.contrib.auth.models import User
 from django.http import HttpResponse
 from django.views.decorators.csrf import csrf_exempt
 import json, sys
+from django.conf import settings
 from ..accounts.models import Permission
 from ..accounts.decorators import json_login_required, access_required
+from ..mongodb.encoding import dumps, pretty_requested
 from models import SocialGraph
+from utils import (resolve_usernames, existing_social_graphs, bulk_create_social_graphs,
+                   bulk_delete_social_graphs)
 
 
 @json_login_required
@@ -15,7 +19,7 @@ def social_graph_delete(request):
     if request.method == 'GET':
         jsonstr={"status": "405",
                  "message": "This method is not implemented or not allowed. Try a POST"}
-        jsonstr=json.dumps(jsonstr, indent = 4,)
+        jsonstr=dumps(jsonstr, pretty_requested(request))
         return HttpResponse( jsonstr, status=405)
 
     attrs={}
@@ -25,7 +29,7 @@ def social_graph_delete(request):
 
     if attrs.has_key('grantor')==False or attrs.has_key('grantee')==False:
         jsonstr={"status": "400", "message": "You must supply a grantor and a grantee"}
-        jsonstr=json.dumps(jsonstr, indent = 4,)
+        jsonstr=dumps(jsonstr, pretty_requested(request))
         return HttpResponse( jsonstr, status=400)
     
     #check that the grantor exists
@@ -34,7 +38,7 @@ def social_graph_delete(request):
     except(User.DoesNotExist):
         jsonstr={"status": "404", "message": "Grantor user does not Exist.",
                  "exists": "false"}
-        jsonstr=json.dumps(jsonstr, indent = 4,)
+        jsonstr=dumps(jsonstr, pretty_requested(request))
         return HttpResponse( jsonstr, status=404)
     
     #check that the grantee exists	
@@ -44,7 +48,7 @@ def social_graph_delete(request):
         jsonstr={"status": "404",
                  "message": "Grantee user does not Exist.",
                  "exists": "false"}
-        jsonstr=json.dumps(jsonstr, indent = 4,)
+        jsonstr=dumps(jsonstr, pretty_requested(request))
         return HttpResponse( jsonstr, status=404)
    
     if grantor!=request.user:
@@ -53,7 +57,7 @@ def social_graph_delete(request):
         jsonstr={"status": "401",
                  "message": "Unauthorized - You do not have the right to delete this social graph."}
 
-        jsonstr=json.dumps( jsonstr, indent=4)
+        jsonstr=dumps(jsonstr, pretty_requested(request))
         return HttpResponse( jsonstr, status=401)
 
     sg=SocialGraph.objects.filter(grantor=grantor, grantee=grantee)
@@ -62,10 +66,10 @@ def social_graph_delete(request):
     sg.delete()
     if how_many == 0:
         jsonstr={"status": "200", "message": "Nothing to delete"}
-        jsonstr=json.dumps(jsonstr, indent = 4,)
+        jsonstr=dumps(jsonstr, pretty_requested(request))
     else:
         jsonstr={"status": "200", "message": "Social graph deleted","result": how_many}
-        jsonstr=json.dumps(jsonstr, indent = 4,)
+        jsonstr=dumps(jsonstr, pretty_requested(request))
     return HttpResponse( jsonstr, status=200)
 
 
@@ -79,7 +83,7 @@ def social_graph_create(request):
     if request.method == 'GET':
         jsonstr={"status": "405",
                  "message": "This method is Not implemented or not allowed. Try a POST"}
-        jsonstr=json.dumps(jsonstr, indent = 4,)
+        jsonstr=dumps(jsonstr, pretty_requested(request))
         return HttpResponse( jsonstr, status=405)
     
     attrs={}	
@@ -92,7 +96,7 @@ def social_graph_create(request):
 	
     if attrs.has_key('grantor')==False or attrs.has_key('grantee')==False:
         jsonstr={"status": "400", "message": "You must supply a grantor and a grantee"}
-        jsonstr=json.dumps(jsonstr, indent = 4,)
+        jsonstr=dumps(jsonstr, pretty_requested(request))
         return HttpResponse( jsonstr, status=400)
 
     try:
@@ -101,7 +105,7 @@ def social_graph_create(request):
         jsonstr={"status": "404",
                  "message": "Grantor user does not Exist.",
                  "exists": "false"}
-        jsonstr=json.dumps( jsonstr, indent = 4,)
+        jsonstr=dumps(jsonstr, pretty_requested(request))
         return HttpResponse( jsonstr, status=404)
 	
     try:
@@ -110,7 +114,7 @@ def social_graph_create(request):
         jsonstr={"status": "404",
                  "message": "Grantee user does not Exist.",
                  "exists": "false"}
-        jsonstr=json.dumps(jsonstr, indent = 4,)
+        jsonstr=dumps(jsonstr, pretty_requested(request))
         return HttpResponse( jsonstr, status=404)
 	
     try:
@@ -120,17 +124,131 @@ def social_graph_create(request):
         if grantor!=request.user:
             jsonstr={"status": "401",
                      "message": "Unauthorized - You do not have the right to create this socialgraph."}
-            jsonstr=json.dumps(jsonstr, indent=4)
+            jsonstr=dumps(jsonstr, pretty_requested(request))
             return HttpResponse( jsonstr, status=401)
 
     try:
         sg=SocialGraph.objects.create(grantor=grantor, grantee=grantee)
         sg.save()
         jsonstr={"status": "200", "message": "Social graph created"}
-        jsonstr=json.dumps(jsonstr, indent = 4,)
+        jsonstr=dumps(jsonstr, pretty_requested(request))
         return HttpResponse( jsonstr, status=200)
     except:
         print sys.exc_info()
         jsonstr={"status": "409", "message": "Conflict. The social graph already exists"}
-        jsonstr=json.dumps(jsonstr, indent = 4,)
+        jsonstr=dumps(jsonstr, pretty_requested(request))
         return HttpResponse( jsonstr, status=409)
+
+
+
+def parse_pairs(request):
+    """Return the (grantor, grantee) username pairs of a bulk request's JSON
+    body, a list of {"grantor": ..., "grantee": ...} objects or of
+    [grantor, grantee] lists. Raise ValueError if it is not one."""
+    items = json.loads(request.body)
+    if not isinstance(items, list):
+        raise ValueError("The body must be a JSON array of grantor/grantee pairs.")
+    if len(items) > settings.SOCIAL_GRAPH_BULK_MAX:
+        raise ValueError("At most %s pairs may be sent at once." % (settings.SOCIAL_GRAPH_BULK_MAX))
+    pairs = []
+    for item in items:
+        if isinstance(item, dict):
+            pairs.append((item.get('grantor'), item.get('grantee')))
+        elif isinstance(item, list) and len(item) == 2:
+            pairs.append(tuple(item))
+        else:
+            pairs.append((None, None))
+    return pairs
+
+
+def check_pair(request, grantor, grantee, user_ids, any_grantor):
+    """Return the (status, message) refusing one pair of a bulk request, or
+    None if it may go ahead."""
+    if not isinstance(grantor, basestring) or not isinstance(grantee, basestring):
+        return "400", "You must supply a grantor and a grantee"
+    if not user_ids.has_key(grantor):
+        return "404", "Grantor user does not Exist."
+    if not user_ids.has_key(grantee):
+        return "404", "Grantee user does not Exist."
+    if not any_grantor and user_ids[grantor] != request.user.pk:
+        return "401", "Unauthorized - You do not have the right to change this social graph."
+    return None
+
+
+def bulk_request(request, permission_name):
+    """Check a bulk request and each of its pairs. Return (an error response
+    or None, the per-pair results, the (grantor id, grantee id) of each pair
+    that may go ahead, or None where it may not)."""
+    if request.method != 'POST':
+        jsonstr={"status": "405",
+                 "message": "This method is not implemented or not allowed. Try a POST"}
+        return HttpResponse(dumps(jsonstr, pretty_requested(request)), status=405), None, None
+    try:
+        pairs = parse_pairs(request)
+    except ValueError, e:
+        jsonstr={"status": "400", "message": str(e)}
+        return HttpResponse(dumps(jsonstr, pretty_requested(request)), status=400), None, None
+
+    #every username in one query
+    user_ids = resolve_usernames([n for pair in pairs for n in pair
+                                  if isinstance(n, basestring)])
+    any_grantor = Permission.objects.filter(user=request.user,
+                                            permission_name=permission_name).exists()
+    results = []
+    allowed = []
+    for grantor, grantee in pairs:
+        results.append({"grantor": grantor, "grantee": grantee})
+        refused = check_pair(request, grantor, grantee, user_ids, any_grantor)
+        if refused:
+            results[-1]["status"], results[-1]["message"] = refused
+            allowed.append(None)
+        else:
+            allowed.append((user_ids[grantor], user_ids[grantee]))
+    return None, results, allowed
+
+
+@json_login_required
+@csrf_exempt
+def social_graph_bulk_create(request):
+    """Create the social graphs of a JSON array of grantor/grantee pairs.
+    Those that already exist are left alone. Answer with a result per
+    pair."""
+    response, results, allowed = bulk_request(request, "create-any-socialgraph")
+    if response:
+        return response
+
+    created = bulk_create_social_graphs([p for p in allowed if p])
+    jsonstr={"status": "200", "results": results, "created": len(created)}
+    for result, pair in zip(results, allowed):
+        if not pair:
+            continue
+        if pair in created:
+            result["status"], result["message"] = "200", "Social graph created"
+            #a pair sent twice is only created once
+            created.discard(pair)
+        else:
+            result["status"], result["message"] = "409", "Conflict. The social graph already exists"
+
+    return HttpResponse(dumps(jsonstr, pretty_requested(request)), status=200)
+
+
+@json_login_required
+@csrf_exempt
+def social_graph_bulk_delete(request):
+    """Delete the social graphs of a JSON array of grantor/grantee pairs.
+    Answer with a result per pair."""
+    response, results, allowed = bulk_request(request, "delete-any-socialgraph")
+    if response:
+        return response
+
+    existing = existing_social_graphs([p for p in allowed if p])
+    bulk_delete_social_graphs(existing.values())
+    jsonstr={"status": "200", "results": results, "deleted": len(existing)}
+    for result, pair in zip(results, allowed):
+        if not pair:
+            continue
+        if existing.pop(pair, None):
+            result["status"], result["message"] = "200", "Social graph deleted"
+        else:
+            result["status"], result["message"] = "200", "Nothing to delete"
+    return HttpResponse(dumps(jsonstr, pretty_requested(request)), status=200)
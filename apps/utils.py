@@ -5,54 +5,213 @@
 from django.conf import settings
 from accounts.models import flangioUser as User
 from django.utils.datastructures import SortedDict
-import os, json, sys, uuid, csv, pickle
-from pymongo import Connection
+import os, re, json, sys, uuid, csv, pickle
+from xml.sax.saxutils import escape, quoteattr
 from socialgraph.models import SocialGraph
+from socialgraph.index import shares, grantors_of
+from accounts.identity import resolve_users, resolve_user
 from datetime import datetime, date, time
 from bson.code import Code
-from pymongo import Connection, DESCENDING
+from pymongo import DESCENDING
+from pymongo.errors import ExecutionTimeout
 from bson.objectid import ObjectId
+from mongodb.connection import get_mongo_client
+from mongodb.encoding import dumps, get_encoder
+from mongodb.flatten import document_paths, cell_text, clean
+from mongodb import keyscan
+from mongodb.slowlog import start_timer, log_query, tag_cursor
+from mongodb.pagination import KeysetPage, InvalidCursor
+from mongodb.cache import (get_cached_count, set_cached_count, collection_changed,
+                           result_cache_enabled, result_cache_key,
+                           get_cached_result, set_cached_result)
+
+
+def to_json(results_dict, pretty=None):
+    return dumps(results_dict, pretty)
+
+
+def chunk_output(pieces, chunk_size=settings.STREAM_CHUNK_SIZE):
+    """Join an iterable of small strings into chunks of about chunk_size
+    characters so a streaming response is not written one fragment at a time.
+    Closing the generator closes pieces too."""
+    buf = []
+    size = 0
+    try:
+        for piece in pieces:
+            buf.append(piece)
+            size += len(piece)
+            if size >= chunk_size:
+                yield "".join(buf)
+                buf = []
+                size = 0
+        if buf:
+            yield "".join(buf)
+    finally:
+        if hasattr(pieces, 'close'):
+            pieces.close()
+
+
+def stream_json(results_dict, pretty=None):
+    """Generate the JSON text of a response_dict in chunks. The envelope
+    is written first and 'results' last, one document at a time, so
+    'results' may be a generator such as the one from query_mongo_stream."""
+    if pretty is None:
+        pretty = settings.JSON_PRETTY_PRINT
+    return chunk_output(_json_pieces(results_dict, get_encoder(pretty)))
+
+
+def stream_ndjson(results):
+    """Generate newline delimited JSON: one compact document per line."""
+    return chunk_output(_ndjson_pieces(results, get_encoder(False)))
+
+
+def _ndjson_pieces(results, encoder):
+    try:
+        for r in results:
+            yield encoder.encode(r)
+            yield "\n"
+    finally:
+        if hasattr(results, 'close'):
+            results.close()
 
-from pymongo import MongoClient
 
+#Keys written after 'results' because they are only known once it is read.
+DEFERRED_RESULT_KEYS = ('next', 'error')
 
-def to_json(results_dict):
-    return json.dumps(results_dict, indent = 4)
-    
 
-def filter_social_graph(request, serial_result):
-    result_list=[]
-    try:
-        grantee=User.objects.get(username=request.user)
-    except(User.DoesNotExist):
-        error = "The grantee could not be found."
-        grantee=None
+def stream_xml(results_dict):
+    """Generate the XML text of a response_dict in chunks: a <results>
+    element with the envelope as attributes and one <result> element per
+    document, written as each is read. Embedded documents become nested
+    elements and array items <item> elements. A key that is not a valid
+    XML name is written as <field name="...">."""
+    return chunk_output(_xml_pieces(results_dict))
 
-    for r in serial_result:
-        try:
-            grantr=r['subject']
-            grantor=User.objects.get(username=grantr)
-        except(User.DoesNotExist):
-            try:
-                grantor=User.objects.get(email=grantr)
-            except(User.DoesNotExist):
-                try:
-                    gp=User.objects.get(anonymous_patient_id=grantr)
-                    grantor = gp.user
-                except(User.DoesNotExist):
-                    error = "The grantor could not be found."
 
-        try:
-            sg=SocialGraph.objects.get(grantor=grantor, grantee=grantee)
-            result_list.append(r)
-        except(SocialGraph.DoesNotExist):
-            """"Keep going"""
-            pass
-        except(User.DoesNotExist):
-            print """The user does not exist.  Fatal Server Error!"""
-            return ()
+_XML_NAME = re.compile(r'^[A-Za-z_][\w.\-]*$')
+
+
+def _xml_element(name, value, pieces):
+    if _XML_NAME.match(name):
+        start, end = "<%s>" % (name), "</%s>" % (name)
+    else:
+        start, end = "<field name=%s>" % (quoteattr(clean(cell_text(name)))), "</field>"
+    if isinstance(value, dict):
+        pieces.append(start)
+        for k, v in value.items():
+            _xml_element(k, v, pieces)
+        pieces.append(end)
+    elif isinstance(value, (list, tuple)):
+        pieces.append(start)
+        for v in value:
+            _xml_element("item", v, pieces)
+        pieces.append(end)
+    elif value is None:
+        pieces.append(start[:-1] + "/>")
+    else:
+        pieces.append(start + escape(clean(cell_text(value))) + end)
 
-    return result_list
+
+def _xml_pieces(results_dict):
+    results = results_dict.get('results', ())
+    try:
+        yield '<?xml version="1.0" encoding="UTF-8"?>\n<results'
+        for k, v in results_dict.items():
+            if k in ('results', 'keys', 'types') or k in DEFERRED_RESULT_KEYS or \
+               isinstance(v, (dict, list, tuple)) or not _XML_NAME.match(k):
+                continue
+            yield ' %s=%s' % (k, quoteattr(clean(cell_text(v))))
+        yield '>\n'
+        for r in results:
+            pieces = []
+            _xml_element("result", r, pieces)
+            pieces.append("\n")
+            yield "".join(pieces)
+        for k in DEFERRED_RESULT_KEYS:
+            if results_dict.has_key(k):
+                v = results_dict[k]
+                if callable(v):
+                    v = v()
+                pieces = []
+                _xml_element(k, v, pieces)
+                yield "".join(pieces)
+        yield '</results>\n'
+    finally:
+        #stop the query if the client went away part way through
+        if hasattr(results, 'close'):
+            results.close()
+
+
+def _json_pieces(results_dict, encoder):
+    results = results_dict.get('results', ())
+    try:
+        yield "{"
+        for k, v in results_dict.items():
+            if k != 'results' and k not in DEFERRED_RESULT_KEYS:
+                yield "%s:%s," % (encoder.encode(k), encoder.encode(v))
+        yield '"results":['
+        first = True
+        for r in results:
+            if first:
+                first = False
+                yield "\n"
+            else:
+                yield ",\n"
+            yield encoder.encode(r)
+        yield "\n]"
+        for k in DEFERRED_RESULT_KEYS:
+            if results_dict.has_key(k):
+                v = results_dict[k]
+                if callable(v):
+                    v = v()
+                yield ",%s:%s" % (encoder.encode(k), encoder.encode(v))
+        yield "}"
+    finally:
+        #stop the query if the client went away part way through
+        if hasattr(results, 'close'):
+            results.close()
+
+
+def social_graph_subjects(request):
+    """Return the identifiers (username, email, anonymous patient id) of
+    every user who shares with request.user, sorted. They are looked up with
+    one query, once per request."""
+    subjects = getattr(request, '_social_graph_subjects', None)
+    if subjects is None:
+        subjects = set()
+        grantor_ids = grantors_of(getattr(request.user, 'pk', None))
+        if grantor_ids:
+            grantors = User.objects.filter(pk__in=grantor_ids).values_list(
+                'username', 'email', 'anonymous_patient_id')
+            for identifiers in grantors:
+                subjects.update(i for i in identifiers if i)
+        subjects = sorted(subjects)
+        request._social_graph_subjects = subjects
+    return subjects
+
+
+def social_graph_query(request, query):
+    """Restrict a Mongo filter to the documents whose subject shares with
+    request.user, so paging and counts only see those."""
+    restriction = {'subject': {'$in': social_graph_subjects(request)}}
+    if not query:
+        return restriction
+    #build_mongo_cursor only casts top-level values, so cast the caller's
+    #first and keep them at the top where the restriction allows.
+    if settings.CAST_STRINGS_TO_INTEGERS:
+        query = cast_number_strings_to_integers(dict(query))
+    if 'subject' not in query:
+        query = dict(query)
+        query.update(restriction)
+        return query
+    return {'$and': [query, restriction]}
+
+
+def filter_social_graph(request, serial_result):
+    """Return the results whose subject shares with request.user. Searches
+    apply social_graph_query() instead."""
+    subjects = set(social_graph_subjects(request))
+    return [r for r in serial_result if r.get('subject') in subjects]
 
 
 def normalize_results(results_dict):
@@ -81,49 +240,286 @@ def normalize_list(results_list):
 
     return results_list
 
+def build_mongo_cursor(query={}, database_name=settings.MONGO_DB_NAME,
+                collection_name=settings.MONGO_MASTER_COLLECTION,
+                skip=0, sort=None, limit=settings.MONGO_LIMIT, return_keys=(),
+                keyset=None, max_time_ms=None):
+    """return an unevaluated pymongo cursor for the query. Errors connecting
+    to Mongo are raised to the caller. If keyset (a KeysetPage) is given the
+    cursor starts after its position and is sorted by its keys; skip only
+    applies to the first page. max_time_ms is the server-side time limit of the cursor."""
+    mc =   get_mongo_client()
+
+    db          =   mc[str(database_name)]
+    collection   = db[str(collection_name)]
+
+
+    #Cast the query to integers
+    if settings.CAST_STRINGS_TO_INTEGERS:
+        query = cast_number_strings_to_integers(query)
+
+    if keyset:
+        spec = keyset.filter(query)
+        sort = keyset.sort
+        if keyset.values is not None:
+            skip = 0
+    else:
+        spec = query
+
+    #print query
+    if return_keys:
+        return_dict={}
+        for k in return_keys:
+            return_dict[k]=1
+        if keyset:
+            #the sort keys are needed to build the next cursor
+            for k in keyset.keys():
+                return_dict[k]=1
+        #print "returndict=",return_dict
+        mysearchresult=collection.find(spec, return_dict).skip(skip).limit(limit)
+    else:
+        mysearchresult=collection.find(spec).skip(skip).limit(limit)
+
+    if sort:
+        mysearchresult.sort(sort)
+    if max_time_ms:
+        mysearchresult.max_time_ms(int(max_time_ms))
+    return tag_cursor(mysearchresult)
+
+
+def iterate_results(mysearchresult, keyset=None, return_keys=()):
+    """yield each document of a cursor with its _id replaced by a string id.
+    The cursor is closed, ending the query on the server, if the generator
+    is closed early (e.g. the client of a streamed response went away)."""
+    hidden_keys = ()
+    if keyset and return_keys:
+        top_level = [k.split('.')[0] for k in return_keys]
+        hidden_keys = [k.split('.')[0] for k in keyset.keys()
+                       if k != '_id' and k.split('.')[0] not in top_level]
+    try:
+        for d in mysearchresult:
+            if keyset:
+                keyset.observe(d)
+            for k in hidden_keys:
+                if d.has_key(k):
+                    del d[k]
+            d['id'] = d['_id'].__str__()
+            del d['_id']
+            yield d
+    finally:
+        mysearchresult.close()
+
+
+def result_keys(mysearchresult, value_types=None, flat=False):
+    """Return the keys of every document of a cursor (or list) in order of
+    first appearance, with id in place of _id, as the search views list
+    them. If value_types is a dict, it is filled with key -> the set of
+    Python types of that key's values. If flat is True, nested values are
+    listed by their dotted paths instead (see mongodb/flatten.py)."""
+    keylist = []
+    seen = set()
+    try:
+        for d in mysearchresult:
+            if flat:
+                for k in document_paths(d):
+                    if k == '_id':
+                        k = 'id'
+                    if k not in seen:
+                        seen.add(k)
+                        keylist.append(k)
+                continue
+            for k, v in d.items():
+                if k == '_id':
+                    #iterate_results turns it into a string
+                    k, v = 'id', u""
+                if k not in seen:
+                    seen.add(k)
+                    keylist.append(k)
+                if value_types is not None:
+                    value_types.setdefault(k, set()).add(type(v))
+    finally:
+        if hasattr(mysearchresult, 'close'):
+            mysearchresult.close()
+    return keylist
+
+
+def stream_keys(mysearchresult, query, limit=0, return_keys=(), value_types=None,
+                flat=False, max_time_ms=None):
+    """Return every key of a cursor's results, as result_keys does, without
+    reading a large result twice. With return_keys (and no value_types
+    wanted) they are the keys. A result of at most SCAN_KEYS_READ_MAX rows
+    is read; otherwise the keys of everything matching query are found on
+    the server (see mongodb/keyscan.py)."""
+    if return_keys and value_types is None:
+        keylist = ['id']
+        for k in return_keys:
+            if k not in ('_id', 'id') and k not in keylist:
+                keylist.append(k)
+        return keylist
+
+    if limit and limit <= settings.SCAN_KEYS_READ_MAX:
+        return result_keys(mysearchresult.clone(), value_types, flat)
+    keylist = keyscan.scan_keys(mysearchresult.collection, query, value_types, flat,
+                                max_time_ms)
+    if return_keys:
+        top_level = set(k.split('.')[0] for k in return_keys)
+        keylist = [k for k in keylist if k == 'id' or k.split('.')[0] in top_level]
+    return keylist
+
+
+COUNT_MODES = ('exact', 'estimated', 'capped', 'none')
+
+
+def count_mongo(collection, query={}, count_mode=None, max_time_ms=None):
+    """Count the documents matching query using one of COUNT_MODES and
+    return a (num_results, count_type) tuple:
+
+    exact      count every match; the total is cached per query
+    estimated  the collection size from its metadata, ignoring the query
+    capped     count matches but stop at SEARCH_COUNT_CAP
+    none       do not count; num_results is None
+    """
+    if not count_mode:
+        count_mode = settings.SEARCH_COUNT_MODE
+
+    if count_mode == "none":
+        return None, count_mode
+
+    if count_mode == "estimated":
+        return int(collection.count()), count_mode
+
+    if count_mode == "capped":
+        cap = settings.SEARCH_COUNT_CAP
+        cursor = collection.find(query).limit(cap)
+        if max_time_ms:
+            cursor.max_time_ms(int(max_time_ms))
+        n = int(cursor.count(with_limit_and_skip=True))
+        if n >= cap:
+            return n, "capped"
+        return n, "exact"
+
+    database_name = collection.database.name
+    n = get_cached_count(database_name, collection.name, query)
+    if n is None:
+        cursor = collection.find(query)
+        if max_time_ms:
+            cursor.max_time_ms(int(max_time_ms))
+        n = int(cursor.count())
+        set_cached_count(database_name, collection.name, query, n)
+    return n, "exact"
+
+
+def invalid_search_response(message):
+    response_dict={}
+    response_dict['num_results']=0
+    response_dict['code']=400
+    response_dict['type']="Error"
+    response_dict['results']=[]
+    response_dict['message']=message
+    return response_dict
+
+
+def timeout_search_response(max_time_ms):
+    response_dict={}
+    response_dict['num_results']=0
+    response_dict['code']=settings.SEARCH_TIMEOUT_STATUS
+    response_dict['type']="Timeout"
+    response_dict['results']=[]
+    response_dict['max_time_ms']=max_time_ms
+    response_dict['message']="The search did not finish within its time budget of %s ms. Narrow the query or use an indexed filter." % (max_time_ms)
+    return response_dict
+
+
+def _stream_results(response_dict, results, max_time_ms, finished=None):
+    #The status line has already been sent when a streamed search runs out
+    #of time, so the error is reported in the trailing 'error' key instead.
+    #finished is called with the number of documents sent, the seconds spent
+    #waiting for them (not for the client) and whether the client went away
+    #before the end.
+    n = 0
+    waited = 0.0
+    aborted = True
+    try:
+        while True:
+            started = start_timer()
+            try:
+                d = results.next()
+            except StopIteration:
+                aborted = False
+                break
+            finally:
+                waited += start_timer() - started
+            n += 1
+            yield d
+    except ExecutionTimeout:
+        aborted = False
+        error = timeout_search_response(max_time_ms)
+        response_dict['error'] = {'code': error['code'], 'type': error['type'],
+                                  'message': error['message']}
+    finally:
+        results.close()
+        if finished:
+            finished(n, waited, aborted)
+
+
 def query_mongo(query={}, database_name=settings.MONGO_DB_NAME,
                 collection_name=settings.MONGO_MASTER_COLLECTION,
-                skip=0, sort=None, limit=settings.MONGO_LIMIT, return_keys=()):
-    """return a response_dict  with a list of search results"""
+                skip=0, sort=None, limit=settings.MONGO_LIMIT, return_keys=(),
+                after=None, count_mode=None, max_time_ms=None):
+    """return a response_dict  with a list of search results. If after is
+    not None the search is keyset paginated: after is the 'next' token of
+    the previous page (or "" for the first page) and the response_dict
+    carries the 'next' token for the following page. count_mode is one of
+    COUNT_MODES and defaults to settings.SEARCH_COUNT_MODE. max_time_ms
+    limits the time the server spends on the count and on the cursor."""
     
     
     l=[]
     response_dict={}
+
+    if count_mode and count_mode not in COUNT_MODES:
+        return invalid_search_response("count must be one of %s." % (", ".join(COUNT_MODES)))
+
+    keyset = None
+    if after is not None:
+        try:
+            keyset = KeysetPage(sort, after, limit)
+        except InvalidCursor, e:
+            return invalid_search_response(str(e))
+
+    cache_key = None
+    if result_cache_enabled():
+        cache_key = result_cache_key(database_name, collection_name, query,
+                                     sorted(return_keys), sort, skip, limit,
+                                     after, count_mode)
+        cached = get_cached_result(cache_key)
+        if cached is not None:
+            return cached
     
     try:
-        mc =   MongoClient(host=settings.MONGO_HOST,
-                           port=settings.MONGO_PORT)
-        
-        db          =   mc[str(database_name)]
-        collection   = db[str(collection_name)]
-        
-        
-        #Cast the query to integers 
-        if settings.CAST_STRINGS_TO_INTEGERS: 
-            query = cast_number_strings_to_integers(query)
-        
-        #print query
-        if return_keys:
-            return_dict={}
-            for k in return_keys:
-                return_dict[k]=1
-            #print "returndict=",return_dict
-            mysearchresult=collection.find(query, return_dict).skip(skip).limit(limit)
-        else:            
-            mysearchresult=collection.find(query).skip(skip).limit(limit)
-        
-        if sort:
-            mysearchresult.sort(sort)
-
-        response_dict['num_results']=int(mysearchresult.count(with_limit_and_skip=False))
+        started = start_timer()
+        mysearchresult = build_mongo_cursor(query, database_name, collection_name,
+                                            skip=skip, sort=sort, limit=limit,
+                                            return_keys=return_keys, keyset=keyset,
+                                            max_time_ms=max_time_ms)
+
+        #count the whole query, not just what is left after a keyset cursor.
+        response_dict['num_results'], response_dict['count_type'] = \
+            count_mongo(mysearchresult.collection, query, count_mode, max_time_ms)
         response_dict['code']=200
         response_dict['type']="search-results"
-        for d in mysearchresult:
-            d['id'] = d['_id'].__str__()
-            del d['_id']
+        for d in iterate_results(mysearchresult, keyset, return_keys):
             l.append(d)
         response_dict['results']=l
-            
+        log_query("query_mongo", mysearchresult.collection, query, sort, started,
+                  len(l), mysearchresult)
+        if keyset:
+            response_dict['next']=keyset.next_token()
+        if cache_key:
+            set_cached_result(cache_key, response_dict)
+
+    except ExecutionTimeout:
+        return timeout_search_response(max_time_ms)
     except:
         print "Error reading from Mongo"
         print str(sys.exc_info())
@@ -136,9 +532,81 @@ def query_mongo(query={}, database_name=settings.MONGO_DB_NAME,
     return response_dict
 
 
+def query_mongo_stream(query={}, database_name=settings.MONGO_DB_NAME,
+                collection_name=settings.MONGO_MASTER_COLLECTION,
+                skip=0, sort=None, limit=settings.MONGO_LIMIT, return_keys=(),
+                after=None, count_mode=None, max_time_ms=None, scan_keys=False,
+                scan_types=False):
+    """return a response_dict like query_mongo's, except that 'results' is a
+    generator reading from the open cursor. Nothing is fetched beyond the
+    count until the generator is consumed. When paginating, 'next' is a
+    callable that is only valid once 'results' has been consumed. If the
+    cursor runs out of time while streaming, 'error' is set. If scan_keys
+    is True, 'keys' lists the columns of the results, nested values by
+    their dotted paths. With scan_types, 'keys' lists the top level keys
+    instead and 'types' the value types seen for each. Both come from
+    return_keys or every matching document (see stream_keys)."""
+
+    response_dict={}
+
+    if count_mode and count_mode not in COUNT_MODES:
+        return invalid_search_response("count must be one of %s." % (", ".join(COUNT_MODES)))
+
+    keyset = None
+    if after is not None:
+        try:
+            keyset = KeysetPage(sort, after, limit)
+        except InvalidCursor, e:
+            return invalid_search_response(str(e))
+
+    try:
+        started = start_timer()
+        mysearchresult = build_mongo_cursor(query, database_name, collection_name,
+                                            skip=skip, sort=sort, limit=limit,
+                                            return_keys=return_keys, keyset=keyset,
+                                            max_time_ms=max_time_ms)
+
+        response_dict['num_results'], response_dict['count_type'] = \
+            count_mongo(mysearchresult.collection, query, count_mode, max_time_ms)
+        counted = start_timer() - started
+        response_dict['code']=200
+        response_dict['type']="search-results"
+        if scan_keys or scan_types:
+            value_types = None
+            if scan_types:
+                value_types = response_dict['types'] = {}
+            response_dict['keys']=stream_keys(mysearchresult, query, limit, return_keys,
+                                              value_types, not scan_types, max_time_ms)
+
+        def finished(returned, waited, aborted):
+            log_query("query_mongo_stream", mysearchresult.collection, query, sort,
+                      returned=returned, cursor=mysearchresult,
+                      millis=int((counted + waited) * 1000), explain=not aborted)
+
+        response_dict['results']=_stream_results(response_dict,
+            iterate_results(mysearchresult, keyset, return_keys), max_time_ms,
+            finished)
+        if keyset:
+            response_dict['next']=keyset.next_token
+
+    except ExecutionTimeout:
+        return timeout_search_response(max_time_ms)
+    except:
+        print "Error reading from Mongo"
+        print str(sys.exc_info())
+        response_dict['num_results']=0
+        response_dict['code']=500
+        response_dict['type']="Error"
+        response_dict['results']=[]
+        response_dict['message']=str(sys.exc_info())
+
+    return response_dict
+
+
 def query_mongo_sort_decend(query={}, database_name=settings.MONGO_DB_NAME,
                 collection_name=settings.MONGO_MASTER_COLLECTION,
-                skip=0, limit=settings.MONGO_LIMIT, return_keys=(), sortkey=None):
+                skip=0, limit=settings.MONGO_LIMIT, return_keys=(), sortkey=None,
+                count_mode=None):
     """return a response_dict  with a list of search results in decending
     order based on a sort key
     """
@@ -147,8 +615,8 @@ def query_mongo_sort_decend(query={}, database_name=settings.MONGO_DB_NAME,
     response_dict={}
     
     try:
-        mc =   MongoClient(host=settings.MONGO_HOST,
-                           port=settings.MONGO_PORT)
+        started = start_timer()
+        mc =   get_mongo_client()
         
         db          =   mc[str(database_name)]
         collection   = db[str(collection_name)]
@@ -161,8 +629,10 @@ def query_mongo_sort_decend(query={}, database_name=settings.MONGO_DB_NAME,
             mysearchresult=collection.find(query, return_dict).skip(skip).limit(limit).sort(sortkey,DESCENDING)
         else:
             mysearchresult=collection.find(query).skip(skip).limit(limit).sort(sortkey,DESCENDING)
+        tag_cursor(mysearchresult)
         
-        response_dict['num_results']=int(mysearchresult.count(with_limit_and_skip=False))
+        response_dict['num_results'], response_dict['count_type'] = \
+            count_mongo(collection, query, count_mode)
         response_dict['code']=200
         response_dict['type']="search-results"
         for d in mysearchresult:
@@ -170,6 +640,8 @@ def query_mongo_sort_decend(query={}, database_name=settings.MONGO_DB_NAME,
             del d['_id']
             l.append(d)
         response_dict['results']=l
+        log_query("query_mongo_sort_decend", collection, query, [(sortkey, DESCENDING)],
+                  started, len(l), mysearchresult)
             
     except:
         print "Error reading from Mongo"
@@ -192,13 +664,13 @@ def delete_mongo(query={}, database_name=settings.MONGO_DB_NAME,
     response_dict={}
     
     try:
-        mc =   MongoClient(host=settings.MONGO_HOST,
-                           port=settings.MONGO_PORT)
+        mc =   get_mongo_client()
         db          =   mc[str(database_name)]
         collection   = db[str(collection_name)]
         
         
         mysearchresult=collection.remove(query, just_one)
+        collection_changed(database_name, collection_name)
         
         
         #response_dict['num_results']=int(mysearchresult.count())
@@ -228,8 +700,7 @@ def write_mongo(document, database_name=settings.MONGO_DB_NAME,
     l=[]
     response_dict={}
     try:
-        mc =   MongoClient(host=settings.MONGO_HOST,
-                           port=settings.MONGO_PORT)
+        mc =   get_mongo_client()
         db          =   mc[str(database_name)]
         collection   = db[str(collection_name)]
         
@@ -307,6 +778,7 @@ def write_mongo(document, database_name=settings.MONGO_DB_NAME,
                 
                 #now write the record to the historical collection
                 written_object = history_collection.insert(history_object)
+                collection_changed(database_name, history_collection_name)
                 
         
             
@@ -317,6 +789,8 @@ def write_mongo(document, database_name=settings.MONGO_DB_NAME,
             # this is new so perform an insert.
             myobjectid=collection.insert(document)
         
+        collection_changed(database_name, collection_name)
+
         #now fetch the record we just wrote so that we write it back to the DB.
         myobject=collection.find_one({'_id':myobjectid})
         response_dict['code']=200
@@ -349,7 +823,7 @@ def bulk_csv_import_mongo(csvfile, delete_collection_before_import=False,
     l=[]
     response_dict={}
     try:
-        mconnection =   Connection(settings.MONGO_HOST, settings.MONGO_PORT)
+        mconnection =   get_mongo_client()
         db = 	        mconnection[database_name]
         if not collection_name:
             collection = db[settings.MONGO_MASTER_COLLECTION]
@@ -359,6 +833,7 @@ def bulk_csv_import_mongo(csvfile, delete_collection_before_import=False,
         
         if delete_collection_before_import:
             myobjectid=collection.remove({})
+            collection_changed(collection.database.name, collection.name)
             
         #open the csv file.
         csvhandle = csv.reader(open(csvfile._get_path(), 'rb'), delimiter=',')
@@ -401,6 +876,8 @@ def bulk_csv_import_mongo(csvfile, delete_collection_before_import=False,
                 
   
             rowindex+=1
+
+        collection_changed(collection.database.name, collection.name)
             
         if error_list:
             response_dict ={}
@@ -437,52 +914,23 @@ def bulk_csv_import_mongo(csvfile, delete_collection_before_import=False,
 def verify_users_exist_and_sg(data):
     """
     Scan supplied user id's for exist valitity. All must exists.
-    Compare ids against username, email, and anonymous_patient_id
-    in that order.
+    Each may be a username, email, vid or anonymous_patient_id; they are
+    resolved together (see accounts/identity.py).
     """
 
     data['errors']=[]
-    try:
-        receiver=User.objects.get(username=data['receiver'])
-    except User.DoesNotExist:
-        try:
-            receiver=User.objects.get(email=data['receiver'])
-        except User.DoesNotExist:
-            try:
-                receiver=UserProfile.objects.get(anonymous_patient_id=data['receiver'])
-            except UserProfile.DoesNotExist:
-                msg ="Receiver %s not found." %(data['receiver'])
-                data['errors'].append({'field':'receiver','description':msg})
+    users = resolve_users([data['receiver'], data['sender'], data['subject']])
+    for field in ('receiver', 'sender', 'subject'):
+        if not users.has_key(data[field]):
+            msg ="%s %s not found." %(field.capitalize(), data[field])
+            data['errors'].append({'field':field, 'description':msg})
 
-    try:
-        sender=User.objects.get(username=data['sender'])
-    except User.DoesNotExist:
-        try:
-            sender=User.objects.get(email=data['sender'])
-        except User.DoesNotExist:
-            try:
-                sender=UserProfile.objects.get(anonymous_patient_id=data['sender'])
-            except UserProfile.DoesNotExist:
-                msg ="Sender %s not found." %(data['sender'])
-                data['errors'].append({'field':'sender','description': msg})
-
-    try:
-        subject=User.objects.get(username=data['subject'])
-    except User.DoesNotExist:
-        try:
-            subject=User.objects.get(email=data['subject'])
-        except User.DoesNotExist:
-            try:
-                up = UserProfile.objects.get(anonymous_patient_id=data['subject'])
-                subject = up.user
-            except UserProfile.DoesNotExist:
-                msg ="Subject %s not found." %(data['subject'])
-                data['errors'].append({'field':'subject', 'description': msg })
-
-    social_graph_errors = verify_social_graph(sender, receiver, subject)
-
-    if social_graph_errors:
-        data['errors'].append(social_graph_errors)
+    if not data['errors']:
+        social_graph_errors = verify_social_graph(users[data['sender']],
+                                                  users[data['receiver']],
+                                                  users[data['subject']])
+        if social_graph_errors:
+            data['errors'].append(social_graph_errors)
 
     #If all is good then this should be an empty list.
     if not data['errors']:
@@ -496,9 +944,7 @@ def verify_social_graph(sender, receiver, subject):
     if settings.RESPECT_SOCIAL_GRAPH==False:
         return errors
     #otherwise verify that a Social graph G exists between sender and subject.
-    try:
-        sg=SocialGraph.objects.get(grantor=subject, grantee=sender)
-    except(SocialGraph.DoesNotExist):
+    if not shares(subject.pk, sender.pk):
         error = "A social graph does not exist between the grantor %s and the grantee %s." % (subject, sender)
         errors.append(error)
 
@@ -522,21 +968,7 @@ def get_user_profile_info(identifier):
     """Get the user profile based on username, email, vid, or anon ID, else
        return None
     """
-    up = None
-    try:
-        up = User.objects.get(username=identifier)
-    except User.DoesNotExist:
-        try:
-           up = User.objects.get(email=identifier) 
-        except User.DoesNotExist:
-            try:
-                up = User.objects.get(vid=identifier) 
-            except User.DoesNotExist:
-                try:
-                    up = User.objects.get(anonymous_patient_id=identifier) 
-                except UserProfile.DoesNotExist:
-                    up=None
-    return up          
+    return resolve_user(identifier)
 
 def build_non_observational_key(k):
     
@@ -556,7 +988,7 @@ def delete_tx(attrs, collection=None):
 
     #Connect to the db or fail.
     try:
-        mconnection     = Connection(settings.MONGO_HOST, settings.MONGO_PORT)
+        mconnection     = get_mongo_client()
         db              = mconnection[settings.MONGO_DB_NAME]
         transactions    = db[settings.MONGO_MASTER_COLLECTION_NAME]
         history         = db[settings.MONGO_HISTORYDB_NAME]
@@ -580,6 +1012,8 @@ def delete_tx(attrs, collection=None):
             hist_id=history.insert(responsedict)
             #print "saved to history!!!"
             r= transactions.remove({'_id': attrs['transaction_id']})
+            collection_changed(settings.MONGO_DB_NAME, history.name)
+            collection_changed(settings.MONGO_DB_NAME, transactions.name)
         #print "removed origional from main collection"
             return {"code": "200", "message": "Transaction deleted.",}
         else:
@@ -607,7 +1041,7 @@ def raw_query_mongo_db(kwargs, collection_name=None):
     response_dict={}
 
     try:
-        mconnection =   Connection(settings.MONGO_HOST, settings.MONGO_PORT)
+        mconnection =   get_mongo_client()
         db =            mconnection[settings.MONGO_DB_NAME]
         if not collection_name:
             transactions = db[settings.MONGO_MASTER_COLLECTION]
@@ -686,7 +1120,7 @@ def prepare_idTransaction_dict(model_instance):
 def get_collection_keys(collection_name=None):
     l=[]
     try:
-        mconnection =   Connection(settings.MONGO_HOST, settings.MONGO_PORT)
+        mconnection =   get_mongo_client()
         db =            mconnection[settings.MONGO_DB_NAME]
         if not collection_name:
             ckey_collection = "%s_keys" % (settings.MONGO_MASTER_COLLECTION)
@@ -707,7 +1141,7 @@ def get_collection_keys(collection_name=None):
                 for j in l:
                     if j.__contains__(i):
                         nl.append(j)
-            difflist = list(set(l) - set(nl))
+            difflist = sorted(set(l) - set(nl))
 
             for i in difflist:
                 nl.append(i)
@@ -724,7 +1158,7 @@ def get_collection_keys(collection_name=None):
 def get_collection_labels():
     l=[]
     try:
-        mconnection     = Connection(settings.MONGO_HOST, settings.MONGO_PORT)
+        mconnection     = get_mongo_client()
         db              = mconnection[settings.MONGO_DB_NAME]
         collection      = db[settings.MONGO_MASTER_LABELS_COLLECTION]
 
@@ -740,7 +1174,7 @@ def get_collection_labels():
 def get_labels_tuple():
     l=[]
     try:
-        mconnection     = Connection(settings.MONGO_HOST, settings.MONGO_PORT)
+        mconnection     = get_mongo_client()
         db              = mconnection[settings.MONGO_DB_NAME]
         collection      = db[settings.MONGO_MASTER_LABELS_COLLECTION]
 
@@ -771,7 +1205,7 @@ def build_keys_with_mapreduce(collection_name=None):
                   )
 
 
-    mconnection =   Connection(settings.MONGO_HOST, settings.MONGO_PORT)
+    mconnection =   get_mongo_client()
     db =            mconnection[settings.MONGO_DB_NAME]
 
     if collection_name:
@@ -784,6 +1218,8 @@ def build_keys_with_mapreduce(collection_name=None):
     #print "mr: %s %s %s" % (settings.MONGO_DB_NAME, collection, result_collection_name)
 
     result = collection.map_reduce(map, reduce, result_collection_name)
+    #the column plans (search/columns.py) are built from these keys
+    collection_changed(settings.MONGO_DB_NAME, result_collection_name)
     return None
 
 
@@ -796,20 +1232,23 @@ def raw_query_mongo_db(kwargs, collection_name=None):
     response_dict={}
 
     try:
-        mconnection =   Connection(settings.MONGO_HOST, settings.MONGO_PORT)
+        started = start_timer()
+        mconnection =   get_mongo_client()
         db =            mconnection[settings.MONGO_DB_NAME]
         if not collection_name:
             transactions = db[settings.MONGO_MASTER_COLLECTION]
         elif (collection_name=="history"):
             transactions = db[settings.MONGO_HISTORYDB_NAME]
 
-        mysearchresult=transactions.find(kwargs)
+        mysearchresult=tag_cursor(transactions.find(kwargs))
         mysearchcount=mysearchresult.count()
         if mysearchcount>0:
             response_dict['code']=200
             for d in mysearchresult:
                 l.append(d)
             response_dict['results']=l
+        log_query("raw_query_mongo_db", transactions, kwargs, None, started,
+                  len(l), mysearchresult)
     except:
         #print "Error reading from Mongo"
         #print str(sys.exc_info())
@@ -197,6 +197,65 @@ BINARY_STORAGE        = ''
 #Global control of output (CSV, XLS).
 SORTCOLUMNS= ()
 ALPHABETIZE_COLUMNS   = False
+#Seconds the in-memory social graph index (apps/socialgraph/index.py) is kept
+#before it is read again. Changes in this process, and in every process when
+#SEARCH_CACHE_BACKEND is set, are seen at once.
+SOCIAL_GRAPH_INDEX_TTL = 300
+#User identifiers (username, email, vid, anonymous patient id) resolved to user
+#ids are kept in an LRU of IDENTITY_CACHE_SIZE entries for IDENTITY_CACHE_TTL
+#seconds (apps/accounts/identity.py).
+IDENTITY_CACHE_SIZE = 10000
+IDENTITY_CACHE_TTL = 300
+#Most grantor/grantee pairs accepted by one bulk social graph request.
+SOCIAL_GRAPH_BULK_MAX = 10000
+#API tokens (apps/accounts/tokens.py) that check out are remembered for
+#API_TOKEN_CACHE_TTL seconds, in an LRU of API_TOKEN_CACHE_SIZE entries. A
+#revoked token stops working at once in every process when
+#SEARCH_CACHE_BACKEND is set, otherwise within API_TOKEN_CACHE_TTL seconds.
+API_TOKEN_CACHE_SIZE = 10000
+API_TOKEN_CACHE_TTL = 60
+#Seconds a column plan (apps/search/columns.py) is kept. Plans are rebuilt
+#sooner when keys are rebuilt or labels change in this process.
+COLUMN_PLAN_TTL = 300
+#Background exports (apps/search/exports.py) run in EXPORT_WORKERS threads per
+#process; with 0, run "manage.py run_export_jobs" instead. Files are written to
+#EXPORT_ROOT, which must not be under MEDIA_ROOT: /media/ is served to anyone,
+#while exports are only handed to their owner. EXPORT_TIME_LIMIT_MS is their
+#maxTimeMS (None: no limit).
+#A running job whose worker has not been heard from for EXPORT_STALE_SECONDS
+#(after a restart or crash) is marked failed, so asking again starts afresh.
+EXPORT_WORKERS = 2
+EXPORT_ROOT = os.path.join(BASE_DIR, 'exports')
+EXPORT_TIME_LIMIT_MS = None
+EXPORT_STALE_SECONDS = 600
+#Rows per sheet of an XLSX export (the Excel limit). Longer exports continue
+#on further sheets.
+XLSX_MAX_ROWS = 1048576
+#CSV, XLSX and HTML tables give each element of an array its own column
+#(tags.0, tags.1, ...). With False an array is one cell of JSON.
+FLATTEN_ARRAYS = True
+#search.html renders at most HTML_PAGE_ROWS rows; the page loads the rest a
+#page at a time (fragment=1), each rendered page cached like search results.
+HTML_PAGE_ROWS = 100
+#Streamed CSV, HTML and Arrow output needs every column before the first row.
+#A result of at most SCAN_KEYS_READ_MAX rows is read twice; the columns of a
+#larger one are found on the server (apps/mongodb/keyscan.py).
+SCAN_KEYS_READ_MAX = 1000
+#Search responses carry an ETag from the collection's write generation and
+#answer If-None-Match with 304. Without SEARCH_CACHE_BACKEND an ETag is only
+#honoured for SEARCH_ETAG_TTL seconds, as other processes' writes aren't seen.
+SEARCH_ETAGS = True
+SEARCH_ETAG_TTL = 60
+#Search and export responses are compressed for clients that accept it
+#(apps/search/compression.py): zstd or brotli when installed, else gzip.
+#Bodies under RESPONSE_COMPRESSION_MIN_SIZE bytes are sent as they are.
+RESPONSE_COMPRESSION = True
+RESPONSE_COMPRESSION_LEVELS = {"gzip": 6, "br": 4, "zstd": 3}
+RESPONSE_COMPRESSION_MIN_SIZE = 1024
+#Parquet and Arrow output (needs pyarrow) is built this many rows at a time.
+#Each batch is a Parquet row group.
+ARROW_BATCH_ROWS = 10000
+PARQUET_COMPRESSION = "snappy"
 
 
 
@@ -206,8 +265,60 @@ MONGO_PORT = 27017
 MONGO_DB_NAME = "flangio"
 MONGO_MASTER_COLLECTION = "main"
 MONGO_HISTORYDB_NAME = "history"
+#Data dictionary labels (get_collection_labels), used with OTHER_LABELS
+MONGO_MASTER_LABELS_COLLECTION = "labels"
 MONGO_LIMIT = 100
+#Connection pool used by every Mongo helper (see apps/mongodb/connection.py).
+#Timeouts are in milliseconds. None leaves the pymongo default in place.
+MONGO_MAX_POOL_SIZE = 100
+MONGO_CONNECT_TIMEOUT_MS = 20000
+MONGO_SOCKET_TIMEOUT_MS = None
+MONGO_WAIT_QUEUE_TIMEOUT_MS = None
+#Any other MongoClient keyword arguments, e.g. {"replicaSet": "rs0"}
+MONGO_CLIENT_OPTIONS = {}
+#Streamed search responses are written in chunks of about this many characters.
+STREAM_CHUNK_SIZE = 65536
+#How searches count their matches: "exact", "estimated" (collection size from
+#metadata), "capped" (stop at SEARCH_COUNT_CAP) or "none". Clients may pass count=.
+SEARCH_COUNT_MODE = "exact"
+SEARCH_COUNT_CAP = 10000
+#Seconds an exact count is reused for the same query. 0 disables the cache.
+SEARCH_COUNT_CACHE_TTL = 60
+SEARCH_COUNT_CACHE_SIZE = 1000
+#Search results are cached in an in-process LRU of SEARCH_CACHE_SIZE entries
+#(0 disables it) and, if SEARCH_CACHE_BACKEND names an entry in CACHES, in that
+#shared cache as well. Writes through flangio invalidate the cached entries.
+SEARCH_CACHE_SIZE = 500
+SEARCH_CACHE_BACKEND = None
+SEARCH_CACHE_TTL = 300
+#Larger result sets are not cached.
+SEARCH_CACHE_MAX_RESULTS = 1000
+#Refuse a sort= parameter that no index can serve (it would sort in memory).
+SEARCH_REQUIRE_INDEXED_SORT = True
+#Time budgets for searches in milliseconds, passed to MongoDB as maxTimeMS.
+#SEARCH_TIME_LIMITS_MS is keyed by URL name (e.g. {"api_complex_search": 60000})
+#and SEARCH_USER_TIME_LIMITS_MS by username. A user's budget wins over the
+#endpoint's, which wins over SEARCH_TIME_LIMIT_MS. None means no limit.
+SEARCH_TIME_LIMIT_MS = 30000
+SEARCH_TIME_LIMITS_MS = {}
+SEARCH_USER_TIME_LIMITS_MS = {}
+#HTTP status of a search that runs out of time: 503 or 408.
+SEARCH_TIMEOUT_STATUS = 503
+#Searches taking SLOW_QUERY_LOG_MS or longer are recorded in a capped collection
+#of SLOW_QUERY_LOG_SIZE bytes, with their query plan from SLOW_QUERY_EXPLAIN_MS
+#(at most once per query shape every SLOW_QUERY_EXPLAIN_INTERVAL seconds).
+#None turns either off. Documents examined are recorded when the database
+#profiler is on (e.g. db.setProfilingLevel(1, 200)).
+SLOW_QUERY_LOG_MS = 200
+SLOW_QUERY_EXPLAIN_MS = 1000
+SLOW_QUERY_EXPLAIN_INTERVAL = 300
+SLOW_QUERY_LOG_COLLECTION = "flangio_slowlog"
+SLOW_QUERY_LOG_SIZE = 10 * 1024 * 1024
 SINCE_ID_FILE = os.path.join(BASE_DIR, 'db/since.id')
+#Encoder for JSON responses (see apps/mongodb/encoding.py). Responses are
+#compact unless JSON_PRETTY_PRINT is set or the client sends pretty=true.
+JSON_ENCODER = "apps.mongodb.encoding.BSONEncoder"
+JSON_PRETTY_PRINT = False
 
 
 ALLOWABLE_TRANSACTION_TYPES = ("text",)